@@ -1,9 +1,35 @@
 from django.contrib import admin
+from django.utils import timezone
 from .models import *
+from .images import warm_thumbnails
+from .services import add_listing, recategorize
+
+
+class ListingAdmin(admin.ModelAdmin):
+
+    # route category changes through the services so category counts stay right
+    def save_model(self, request, obj, form, change):
+        if change:
+            # edits can change what the listing card shows
+            obj.version += 1
+            obj.modified = timezone.now()
+
+        if not change:
+            add_listing(obj)
+        elif "category" in form.changed_data:
+            new_category = obj.category
+            obj.category_id = form.initial["category"]
+            obj.save()
+            recategorize(obj, new_category)
+        else:
+            obj.save()
+        if change and "image_url" in form.changed_data:
+            warm_thumbnails(obj.image_url)
 
 # Register your models here.
 admin.site.register(User)
-admin.site.register(Listing)
+admin.site.register(Category)
+admin.site.register(Listing, ListingAdmin)
 admin.site.register(Bid)
 admin.site.register(Comment)
 admin.site.register(Watchlist)
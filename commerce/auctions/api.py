@@ -0,0 +1,383 @@
+import hashlib
+import json
+import secrets
+from functools import wraps
+from operator import itemgetter
+
+from django.contrib.auth import authenticate
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_http_methods
+
+from .idempotency import idempotent
+from .models import ApiToken, Bid, Category, Comment, Listing, PriceBucket, Watchlist
+from .services import BidRejected, CommentRejected, add_comment, place_bid, place_max_bid, seller_rollups
+from .sharding import default_joins, fan_out, fill_joins, listing_shard
+
+
+# api field name -> lookup, ?fields= picks from these
+LISTING_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "description": "description",
+    "category": "category__slug",
+    "image_url": "image_url",
+    "start_bid": "start_bid",
+    "current_price": "current_price",
+    "seller": "user__username",
+    "highest_bidder": "highest_bidder__username",
+    "bid_count": "bid_count",
+    "bidder_count": "bidder_count",
+    "last_bid_at": "last_bid_at",
+    "comment_count": "comment_count",
+    "is_closed": "is_closed",
+    "closed_at": "closed_at",
+    "modified": "modified",
+    "version": "version",
+}
+BID_FIELDS = {
+    "id": "id",
+    "amount": "amount",
+    "bidder": "user__username",
+    "created": "created",
+}
+TIMELINE_FIELDS = {
+    "start": "start",
+    "open": "open",
+    "close": "close",
+    "bids": "bids",
+}
+COMMENT_FIELDS = {
+    "id": "id",
+    "text": "text",
+    "user": "user__username",
+    "created": "created",
+}
+
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+
+
+class ApiError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def token_hash(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def token_for(request):
+    """The ApiToken in the Authorization header, None without one."""
+    header = request.headers.get("Authorization")
+    if not header:
+        return None
+    scheme, _, key = header.partition(" ")
+    if scheme != "Token" or not key.strip():
+        raise ApiError("expected an Authorization: Token <key> header", status=401)
+    token = ApiToken.objects.select_related("user").filter(key_hash=token_hash(key.strip())).first()
+    if token is None or not token.user.is_active:
+        raise ApiError("invalid token", status=401)
+    return token
+
+
+def csrf_failed(request):
+    # what CsrfViewMiddleware would have answered, had the api not been exempt from it
+    check = CsrfViewMiddleware(lambda request: None)
+    check.process_request(request)
+    return check.process_view(request, None, (), {}) is not None
+
+
+def api_view(methods):
+    """
+    Decorator for api views: allowed methods, authentication, and ApiError turned into a JSON error.
+
+    A client either sends "Authorization: Token <key>" (see tokens) and needs
+    nothing else, or uses the site's session cookie, and then its writes need
+    the csrf token like the html forms do: the csrftoken cookie sent back in
+    an X-CSRFToken header.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            try:
+                token = token_for(request)
+                if token is not None:
+                    request.user = token.user
+                    request.api_token = token
+                elif request.method not in ("GET", "HEAD") and request.user.is_authenticated and csrf_failed(request):
+                    raise ApiError("csrf token missing or incorrect, send it in X-CSRFToken or use an api token", status=403)
+                return view(request, *args, **kwargs)
+            except ApiError as e:
+                return JsonResponse({"error": str(e)}, status=e.status)
+        return csrf_exempt(require_http_methods(methods)(wrapper))
+    return decorator
+
+
+def require_user(request):
+    if not request.user.is_authenticated:
+        raise ApiError("authentication required", status=401)
+
+
+def payload(request):
+    # accept either a JSON body or a normal form post
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            raise ApiError("invalid JSON")
+        if not isinstance(data, dict):
+            raise ApiError("expected a JSON object")
+        return data
+    return request.POST
+
+
+def selected_fields(request, available):
+    fields = request.GET.get("fields")
+    if not fields:
+        return list(available)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f"unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def rows(queryset, fields, available, limit=None):
+    """
+    Only the requested columns are selected, renamed to their api names.
+
+    With limit, the first limit rows of a newest first queryset with id as
+    the first field, from every shard when it isn't pinned to one.
+    """
+    lookups, joins = default_joins(queryset.model, [available[name] for name in fields])
+    values = queryset.values_list(*lookups)
+    values = list(values) if limit is None else fan_out(values, limit, key=itemgetter(0))
+    return [dict(zip(fields, row)) for row in fill_joins(values, joins)]
+
+
+def keyset(request, queryset, fields, available):
+    """
+    One page of rows newest first plus the url of the next page.
+
+    Same ?before=<id> cursor as the html grids, with ?limit= up to MAX_LIMIT.
+    """
+    try:
+        limit = min(max(int(request.GET.get("limit", DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        before = request.GET.get("before")
+        if before is not None:
+            queryset = queryset.filter(id__lt=int(before))
+    except ValueError:
+        raise ApiError("before and limit must be integers")
+
+    # id is always fetched for the cursor, and dropped again if not asked for
+    page = rows(queryset.order_by("-id"), ["id"] + [f for f in fields if f != "id"], available, limit=limit + 1)
+    next_url = None
+    if len(page) > limit:
+        page = page[:limit]
+        params = request.GET.copy()
+        params["before"] = page[-1]["id"]
+        next_url = f"{request.path}?{params.urlencode()}"
+    if "id" not in fields:
+        for row in page:
+            del row["id"]
+    return page, next_url
+
+
+def page_response(request, results, next_url, **extra):
+    """
+    JSON for a page of results (and any extra keys) with a strong ETag over the body.
+
+    Pollers that send the ETag back get an empty 304 instead of the payload.
+    """
+    response = JsonResponse({**extra, "results": results, "next": next_url})
+    etag = '"%s"' % hashlib.md5(response.content, usedforsecurity=False).hexdigest()
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    response["ETag"] = etag
+    return response
+
+
+def listing_queryset(request):
+    listings = Listing.objects.all()
+    if request.GET.get("all") != "1":
+        listings = listings.filter(is_closed=False)
+    category = request.GET.get("category")
+    if category:
+        listings = listings.filter(category=get_object_or_404(Category, slug=category))
+    return listings
+
+
+def listing_state(request, id):
+    """(version, comment count, modified) of a listing, looked up once per request."""
+    if not hasattr(request, "_listing_state"):
+        request._listing_state = (
+            Listing.objects.filter(id=id).values_list("version", "comment_count", "modified").first()
+        )
+    return request._listing_state
+
+
+def listing_etag(request, id):
+    state = listing_state(request, id)
+    if state is None:
+        return None
+    # bids and closes bump version, comments bump comment_count. each ?fields
+    # selection is its own representation so it needs its own tag
+    fields = hashlib.md5(request.GET.get("fields", "").encode(), usedforsecurity=False).hexdigest()[:8]
+    return f"{id}-{state[0]}-{state[1]}-{fields}"
+
+
+def listing_last_modified(request, id):
+    state = listing_state(request, id)
+    return state[2] if state else None
+
+
+@api_view(["GET"])
+def listings(request):
+    fields = selected_fields(request, LISTING_FIELDS)
+    results, next_url = keyset(request, listing_queryset(request), fields, LISTING_FIELDS)
+    return page_response(request, results, next_url)
+
+
+@api_view(["GET"])
+@listing_shard
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+def listing(request, id):
+    fields = selected_fields(request, LISTING_FIELDS)
+    found = rows(Listing.objects.filter(id=id), fields, LISTING_FIELDS)
+    if not found:
+        raise ApiError("no such listing", status=404)
+    return JsonResponse(found[0])
+
+
+@api_view(["GET", "POST"])
+@listing_shard
+@idempotent
+def bids(request, id):
+    listing = get_object_or_404(Listing, id=id)
+    if request.method == "GET":
+        bids = Bid.objects.filter(listing=listing)
+        # ?since= only returns bids placed after a time, for pollers
+        since = request.GET.get("since")
+        if since:
+            try:
+                # None when it doesn't look like a datetime, ValueError when it does but isn't one (month 13)
+                moment = parse_datetime(since)
+            except ValueError:
+                moment = None
+            if moment is None:
+                raise ApiError("since must be an ISO 8601 datetime")
+            bids = bids.filter(created__gt=moment)
+        fields = selected_fields(request, BID_FIELDS)
+        results, next_url = keyset(request, bids, fields, BID_FIELDS)
+        return page_response(request, results, next_url)
+
+    require_user(request)
+    data = payload(request)
+    try:
+        if "max_amount" in data:
+            # a maximum bid, the response doesn't say what anyone else's maximum is
+            proxy = place_max_bid(listing, request.user, data["max_amount"])
+            return JsonResponse({
+                "max_amount": proxy.max_amount,
+                "current_price": listing.current_price,
+                "leading": listing.highest_bidder == request.user,
+            }, status=201)
+        bid = place_bid(listing, request.user, data.get("amount", ""))
+    except BidRejected as e:
+        # the message says whether the bid was invalid or beaten
+        raise ApiError(str(e), status=409)
+    return JsonResponse({"id": bid.id, "amount": bid.amount, "current_price": listing.current_price}, status=201)
+
+
+@api_view(["GET"])
+@listing_shard
+def timeline(request, id):
+    """Hourly price buckets of a listing, oldest first, kept up to date by place_bid."""
+    listing = get_object_or_404(Listing, id=id)
+    fields = selected_fields(request, TIMELINE_FIELDS)
+    buckets = PriceBucket.objects.filter(listing=listing).order_by("start")
+    return page_response(request, rows(buckets, fields, TIMELINE_FIELDS), None)
+
+
+@api_view(["GET", "POST"])
+@listing_shard
+@idempotent
+def comments(request, id):
+    listing = get_object_or_404(Listing, id=id)
+    if request.method == "POST":
+        require_user(request)
+        text = str(payload(request).get("text", "")).strip()
+        if not text:
+            raise ApiError("type something")
+        try:
+            comment = add_comment(listing, request.user, text)
+        except CommentRejected as e:
+            raise ApiError(str(e), status=429)
+        return JsonResponse(
+            {"id": comment.id, "text": comment.text, "user": request.user.username, "created": comment.created},
+            status=201,
+        )
+
+    fields = selected_fields(request, COMMENT_FIELDS)
+    results, next_url = keyset(request, Comment.objects.filter(listing=listing), fields, COMMENT_FIELDS)
+    return page_response(request, results, next_url)
+
+
+@api_view(["GET"])
+def watchlist(request):
+    require_user(request)
+    fields = selected_fields(request, LISTING_FIELDS)
+    listings = listing_queryset(request).filter(watchlist__user=request.user)
+    results, next_url = keyset(request, listings, fields, LISTING_FIELDS)
+    return page_response(request, results, next_url)
+
+
+@api_view(["GET"])
+def dashboard(request):
+    """The seller dashboard: totals and categories from the rollups, then a page of the seller's listings."""
+    require_user(request)
+    fields = selected_fields(request, LISTING_FIELDS)
+    totals, categories = seller_rollups(request.user.id)
+    results, next_url = keyset(request, Listing.objects.filter(user=request.user), fields, LISTING_FIELDS)
+    categories = [
+        {"category": row.pop("category__slug"), "name": row.pop("category__name"), **row} for row in categories
+    ]
+    return page_response(request, results, next_url, totals=totals, categories=categories)
+
+
+@api_view(["PUT", "DELETE"])
+@listing_shard
+def watchlist_entry(request, id):
+    require_user(request)
+    listing = get_object_or_404(Listing, id=id)
+    if request.method == "PUT":
+        Watchlist.objects.get_or_create(user=request.user, listing=listing)
+    else:
+        Watchlist.objects.filter(user=request.user, listing=listing).delete()
+    return HttpResponse(status=204)
+
+
+@api_view(["POST", "DELETE"])
+def tokens(request):
+    """POST a username and password for a new api token, DELETE with a token to revoke it."""
+    if request.method == "DELETE":
+        token = getattr(request, "api_token", None)
+        if token is None:
+            raise ApiError("send the token to revoke in the Authorization header", status=401)
+        token.delete()
+        return HttpResponse(status=204)
+
+    data = payload(request)
+    user = authenticate(request, username=data.get("username"), password=data.get("password"))
+    if user is None:
+        raise ApiError("invalid username or password", status=401)
+    # the key is only ever shown here, a lost one is revoked and replaced
+    key = secrets.token_urlsafe(32)
+    ApiToken.objects.create(user=user, key_hash=token_hash(key))
+    return JsonResponse({"token": key}, status=201)
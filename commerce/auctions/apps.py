@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class AuctionsConfig(AppConfig):
     name = 'auctions'
+
+    def ready(self):
+        from .search import ensure_index_triggers, mirror_category
+        post_migrate.connect(ensure_index_triggers, sender=self)
+        post_save.connect(mirror_category, sender=self.get_model("Category"))
+
+        from .sharding import disable_foreign_keys
+        post_migrate.connect(disable_foreign_keys, sender=self)
+
+        from .backends import forget_user_on_logout, invalidate_cached_user
+        post_save.connect(invalidate_cached_user, sender=get_user_model())
+        post_delete.connect(invalidate_cached_user, sender=get_user_model())
+        user_logged_out.connect(forget_user_on_logout)
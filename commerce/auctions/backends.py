@@ -0,0 +1,45 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+
+# shares the cache alias of the sessions, see CACHES in settings.py
+USER_CACHE = "sessions"
+# how long a loaded user is reused. saves and logouts delete it from the shared
+# cache right away, the timeout only bounds changes made around the ORM (update())
+USER_CACHE_TIMEOUT = 5 * 60
+
+
+def user_cache_key(user_id):
+    return f"auctions:user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that keeps the logged in user in the cache.
+
+    Every page renders the username from request.user, so without this each
+    logged in request costs an auth_user query. The whole row is cached,
+    password hash included, so django can still check the session against
+    it and log out other sessions after a password change.
+    """
+
+    def get_user(self, user_id):
+        cache = caches[USER_CACHE]
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    # connected to User post_save/post_delete: password changes, last_login, admin edits
+    caches[USER_CACHE].delete(user_cache_key(instance.pk))
+
+
+def forget_user_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        caches[USER_CACHE].delete(user_cache_key(user.pk))
@@ -0,0 +1,352 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from .middleware import RequestStats
+from .models import Bid, Category, Closed, Comment, Listing, User, Watchlist
+from .services import rebuild_bid_stats
+
+
+CATEGORY_NAMES = [
+    "Electronics", "Books", "Furniture", "Lamps", "Clothing", "Toys", "Garden", "Art",
+    "Music", "Sports", "Tools", "Jewelry", "Cameras", "Kitchen", "Bikes", "Games",
+]
+# share of seeded listings that are already closed
+CLOSED_SHARE = 0.1
+# zipf exponent for how bids and views pile onto popular listings
+SKEW = 1.1
+# scenario -> weight, the default traffic mix of the workflow benchmark
+DEFAULT_MIX = {
+    "index": 25,
+    "category": 10,
+    "listing": 35,
+    "place_bid": 15,
+    "comment": 5,
+    "watchlist": 10,
+}
+BATCH_SIZE = 2000
+
+
+@contextmanager
+def throwaway_database(path=None):
+    """
+    Run a benchmark against a freshly migrated database instead of your own.
+
+    A sqlite file, not the in-memory test database, so threads share it like
+    a real server's workers. It is deleted afterwards unless a path is given,
+    then it's kept and reused by the next run.
+    """
+    keep = bool(path)
+    path = path or os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    connection.settings_dict.setdefault("TEST", {})["NAME"] = path
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keep)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep)
+        teardown_test_environment()
+
+
+def uncached_pages():
+    """
+    override_settings turning the anonymous page cache off, so html views
+    render on every request instead of comparing a cache hit to a render.
+    """
+    return override_settings(
+        CACHES={**settings.CACHES, "pages": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+    )
+
+
+def zipf_weights(n):
+    return [1 / (rank + 1) ** SKEW for rank in range(n)]
+
+
+def seed(users=500, listings=5000, bids=50000, comments=10000, watchlists=10000, rng=None):
+    """
+    Fill the database with a benchmark dataset using bulk inserts, returns a summary.
+
+    Listings are spread over the categories and bids follow a zipf curve, so
+    a handful of listings get most of the bids like a real auction site.
+    Derived state (prices, counts, the bid timeline) is set the same way the
+    write paths in services.py would have left it.
+    """
+    rng = rng or random.Random(0)
+    now = timezone.now()
+    # hashing is slow, every benchmark user shares one password: "bench"
+    password = make_password("bench")
+
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=f"bench_{n}", email=f"bench_{n}@example.com", password=password) for n in range(users)],
+            batch_size=BATCH_SIZE,
+        )
+        user_ids = list(User.objects.filter(username__startswith="bench_").values_list("id", flat=True))
+        categories = [Category.for_name(name) for name in CATEGORY_NAMES]
+
+        Listing.objects.bulk_create([
+            Listing(
+                title=f"bench listing {n}",
+                description=f"{rng.choice(CATEGORY_NAMES).lower()} in good condition, lot {n}",
+                category=rng.choice(categories),
+                start_bid=price,
+                current_price=price,
+                user_id=rng.choice(user_ids),
+                modified=now,
+            )
+            for n, price in ((n, Decimal(rng.randint(100, 50000)) / 100) for n in range(listings))
+        ], batch_size=BATCH_SIZE)
+        listing_rows = list(Listing.objects.filter(title__startswith="bench listing ").order_by("id"))
+
+        # bids: a zipf share per listing, prices climbing from the start bid
+        per_listing = [0] * len(listing_rows)
+        for index in rng.choices(range(len(listing_rows)), weights=zipf_weights(len(listing_rows)), k=bids):
+            per_listing[index] += 1
+        bid_rows = []
+        start = now - timedelta(days=7)
+        for listing, count in zip(listing_rows, per_listing):
+            price = listing.start_bid
+            for n in range(count):
+                price += Decimal(rng.randint(1, 200)) / 100
+                bidder = rng.choice(user_ids)
+                bid_rows.append(Bid(
+                    listing=listing, user_id=bidder, amount=price,
+                    created=start + timedelta(seconds=(n + 1) * 7 * 86400 // (count + 1)),
+                ))
+            if count:
+                listing.current_price = price
+                listing.highest_bidder_id = bid_rows[-1].user_id
+                listing.bid_count = count
+                listing.version = count + 1
+        Bid.objects.bulk_create(bid_rows, batch_size=BATCH_SIZE)
+
+        comment_rows = [
+            Comment(listing=rng.choice(listing_rows), user_id=rng.choice(user_ids), text="is this still available?")
+            for _ in range(comments)
+        ]
+        Comment.objects.bulk_create(comment_rows, batch_size=BATCH_SIZE)
+        for comment in comment_rows:
+            comment.listing.comment_count += 1
+
+        pairs = set()
+        while len(pairs) < min(watchlists, users * listings):
+            pairs.add((rng.choice(user_ids), rng.choice(listing_rows).id))
+        Watchlist.objects.bulk_create(
+            [Watchlist(user_id=user_id, listing_id=listing_id) for user_id, listing_id in pairs],
+            batch_size=BATCH_SIZE,
+        )
+
+        closed = rng.sample(listing_rows, int(len(listing_rows) * CLOSED_SHARE))
+        for listing in closed:
+            listing.is_closed = True
+            listing.closed_at = now
+        Listing.objects.bulk_update(
+            listing_rows,
+            ["current_price", "highest_bidder", "bid_count", "comment_count", "version", "is_closed", "closed_at"],
+            batch_size=BATCH_SIZE,
+        )
+        Closed.objects.bulk_create(
+            [Closed(listing=listing, winner_id=listing.highest_bidder_id, price=listing.current_price)
+             for listing in closed],
+            batch_size=BATCH_SIZE,
+        )
+
+        for category in Category.objects.annotate(
+            total=Count("listings"), active=Count("listings", filter=Q(listings__is_closed=False))
+        ):
+            Category.objects.filter(id=category.id).update(listing_count=category.total, active_count=category.active)
+
+    rebuild_bid_stats()
+    return {
+        "users": users, "listings": listings, "bids": bids,
+        "comments": comments, "watchlists": len(pairs), "closed": len(closed),
+    }
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+class Workload:
+    """The seeded data the scenarios pick from, with popular listings picked more often."""
+
+    def __init__(self):
+        self.user_ids = list(User.objects.filter(username__startswith="bench_").values_list("id", flat=True))
+        self.open_ids = list(
+            Listing.objects.filter(is_closed=False).order_by("-bid_count", "id").values_list("id", flat=True)
+        )
+        self.cum_weights = list(accumulate(zipf_weights(len(self.open_ids))))
+        self.slugs = list(Category.objects.filter(listing_count__gt=0).values_list("slug", flat=True))
+        if not (self.user_ids and self.open_ids):
+            raise ValueError("seed the database first, there are no open benchmark listings")
+
+    def listing(self, rng):
+        return rng.choices(self.open_ids, cum_weights=self.cum_weights)[0]
+
+
+# scenarios return the request to time as (method, url, post data)
+
+def scenario_index(workload, rng):
+    return "get", reverse("index"), None
+
+
+def scenario_category(workload, rng):
+    return "get", reverse("category", args=[rng.choice(workload.slugs)]), None
+
+
+def scenario_listing(workload, rng):
+    return "get", reverse("listing", args=[workload.listing(rng)]), None
+
+
+def scenario_place_bid(workload, rng):
+    listing_id = workload.listing(rng)
+    # like a user who just loaded the page, a bit above the price they saw
+    price = Listing.objects.values_list("current_price", flat=True).get(id=listing_id)
+    amount = price + Decimal(rng.randint(1, 500)) / 100
+    return "post", reverse("listing", args=[listing_id]), {"action": "place_bid", "bid": str(amount)}
+
+
+def scenario_comment(workload, rng):
+    return "post", reverse("listing", args=[workload.listing(rng)]), {"action": "comment", "comment": "benchmark comment"}
+
+
+def scenario_watchlist(workload, rng):
+    if rng.random() < 0.5:
+        return "get", reverse("watchlist"), None
+    action = rng.choice(["add_watchlist", "remove_watchlist"])
+    return "post", reverse("listing", args=[workload.listing(rng)]), {"action": action}
+
+
+SCENARIOS = {
+    "index": scenario_index,
+    "category": scenario_category,
+    "listing": scenario_listing,
+    "place_bid": scenario_place_bid,
+    "comment": scenario_comment,
+    "watchlist": scenario_watchlist,
+}
+
+
+def run(mix=None, requests=1000, concurrency=4, rng_seed=0):
+    """
+    Drive the scenarios through the test client from concurrency threads, returns the report.
+
+    Every thread logs in as its own benchmark user. Latency is the whole
+    request through the middleware stack and queries are counted on the
+    thread's connection while the request runs.
+    """
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    workload = Workload()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: [] for name in names}
+    lock = threading.Lock()
+    remaining = [requests]
+    exceptions = Counter()
+
+    def worker(number):
+        rng = random.Random(rng_seed * 1000 + number)
+        client = Client()
+        client.force_login(User.objects.get(id=workload.user_ids[number % len(workload.user_ids)]))
+        local = []
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+                name = rng.choices(names, weights=weights)[0]
+                stats = RequestStats()
+                start = time.perf_counter()
+                try:
+                    method, url, data = SCENARIOS[name](workload, rng)
+                    with connection.execute_wrapper(stats):
+                        status = getattr(client, method)(url, data).status_code
+                except Exception as e:
+                    # counted as an error with the exception kept for the report, the run goes on
+                    status = 599
+                    with lock:
+                        exceptions[f"{type(e).__name__}: {e}"] += 1
+                local.append((name, time.perf_counter() - start, stats.queries, status))
+        finally:
+            connection.close()
+            with lock:
+                for name, elapsed, queries, status in local:
+                    results[name].append((elapsed, queries, status))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    result = report(results, wall, {"requests": requests, "concurrency": concurrency, "mix": mix, "seed": rng_seed})
+    result["exceptions"] = dict(exceptions)
+    return result
+
+
+def summarize(samples, wall):
+    timings = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, _, status in samples if status >= 400),
+        "throughput": len(samples) / wall if wall else 0.0,
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "p99_ms": percentile(timings, 99),
+        "max_ms": timings[-1] if timings else None,
+        "avg_queries": sum(queries) / len(queries) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+
+
+def report(results, wall, config):
+    everything = [sample for samples in results.values() for sample in samples]
+    return {
+        "config": config,
+        "wall_s": wall,
+        "scenarios": {name: summarize(samples, wall) for name, samples in results.items() if samples},
+        "total": summarize(everything, wall),
+    }
+
+
+def compare(report, baseline):
+    """p95 and query count change per scenario against an earlier report, as rows for printing."""
+    rows = []
+    for name, current in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or not before.get("p95_ms"):
+            continue
+        change = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        rows.append((name, before["p95_ms"], current["p95_ms"], change, before["avg_queries"], current["avg_queries"]))
+    return rows
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
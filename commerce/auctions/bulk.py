@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+from operator import itemgetter
+
+from django.db.models import F
+
+from . import pagecache, sharding
+from .models import Bid, Category, Listing
+from .services import ListingInvalid, clean_listing, invalidate_category_directory, update_rollup
+
+
+IMPORT_BATCH_SIZE = 1000
+# errors kept for the report, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+IMPORT_COLUMNS = ["title", "description", "category", "start_bid", "image_url", "duration_days"]
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.imported = 0
+        self.rows = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (line number, row dict) from a binary stream of CSV or JSONL.
+
+    The file is decoded and parsed a line at a time so it never has to fit
+    in memory. Lines that can't be parsed come back as a string error message,
+    and so does a file that isn't UTF-8 or valid CSV, at the line where
+    reading had to stop.
+    """
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"unknown format {fmt!r}, use csv or jsonl")
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    number = 0
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(text)
+            for row in reader:
+                number = reader.line_num
+                yield number, row
+        else:
+            for number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield number, "invalid JSON"
+                    continue
+                yield number, row if isinstance(row, dict) else "expected a JSON object"
+    except UnicodeDecodeError:
+        # decoding runs a chunk ahead of the parser, the bad bytes are at or after this line
+        yield number + 1, "the file is not UTF-8 text, nothing from this line on was read"
+    except csv.Error as e:
+        yield number + 1, f"invalid CSV ({e}), nothing from this line on was read"
+
+
+def import_listings(rows, user, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """
+    Validate rows with the create_listing rules and bulk insert them for user.
+
+    Rows are inserted batch_size at a time, each batch in its own transaction
+    (one per shard when sharded) with one count update per category, so
+    memory stays flat no matter how big the file is. progress(report) is
+    called after every batch.
+    """
+    report = ImportReport()
+    categories = {}
+    batch = []
+
+    def flush():
+        if sharding.shards():
+            # the ids pick the shards, a block of them is taken from the sequence at once
+            for listing, listing_id in zip(batch, sharding.allocate_listing_ids(len(batch))):
+                listing.id = listing_id
+        by_db = defaultdict(list)
+        for listing in batch:
+            by_db[sharding.listing_db(listing)].append(listing)
+        for db, listings in by_db.items():
+            with sharding.atomic(db):
+                Listing.objects.using(db).bulk_create(listings)
+                per_category = Counter(listing.category_id for listing in listings)
+                for category_id, count in per_category.items():
+                    Category.objects.filter(id=category_id).update(
+                        listing_count=F("listing_count") + count, active_count=F("active_count") + count
+                    )
+                    update_rollup(user.id, category_id, listing_count=count, active_count=count)
+        report.imported += len(batch)
+        batch.clear()
+        if progress:
+            progress(report)
+
+    for line, row in rows:
+        report.rows += 1
+        if isinstance(row, str):
+            report.error(line, row)
+            continue
+        try:
+            fields = clean_listing(*(
+                "" if row.get(column) is None else str(row.get(column)) for column in IMPORT_COLUMNS
+            ))
+        except ListingInvalid as e:
+            report.error(line, str(e))
+            continue
+
+        name = fields.pop("category")
+        if name not in categories:
+            categories[name] = Category.for_name(name)
+        batch.append(Listing(user=user, category=categories[name], **fields))
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    if report.imported:
+        invalidate_category_directory()
+        pagecache.purge(pagecache.INDEX, *(pagecache.category_scope(category.id) for category in categories.values()))
+    return report
+
+
+class Echo:
+    """File-like object whose write returns the value, for csv.writer into a stream."""
+
+    def write(self, value):
+        return value
+
+
+LISTING_EXPORT_FIELDS = [
+    "id", "title", "description", "category__name", "start_bid", "current_price", "image_url",
+    "user__username", "highest_bidder__username", "bid_count", "bidder_count", "is_closed", "closed_at", "ends_at",
+]
+BID_EXPORT_FIELDS = ["id", "listing_id", "listing__title", "user__username", "amount", "created"]
+
+
+def export_rows(queryset, fields, fmt, chunk_size=2000):
+    """
+    Yield CSV or JSONL lines for a queryset, streamed from the database in chunks.
+
+    fields start with id. When sharded every shard is streamed at once in id
+    order, with usernames and category names looked up on default a chunk at a time.
+    """
+    lookups, joins = sharding.default_joins(queryset.model, fields)
+    values = sharding.stream(queryset.order_by("id").values_list(*lookups), itemgetter(0), chunk_size)
+    if fmt != "jsonl":
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+    while chunk := list(islice(values, chunk_size)):
+        for row in sharding.fill_joins(chunk, joins):
+            if fmt == "jsonl":
+                yield json.dumps(dict(zip(fields, row)), default=str) + "\n"
+            else:
+                yield writer.writerow(row)
+
+
+def listings_for_export(user):
+    listings = Listing.objects.all()
+    return listings if user.is_staff else listings.filter(user=user)
+
+
+def bids_for_export(user):
+    # staff see every bid, sellers the bids on their own listings
+    bids = Bid.objects.all()
+    return bids if user.is_staff else bids.filter(listing__user=user)
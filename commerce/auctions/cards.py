@@ -0,0 +1,80 @@
+import threading
+import time
+
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+# cache alias the rendered listing cards live in, see CACHES in settings.py
+CARD_CACHE = "cards"
+# cards don't go stale (the key changes with the listing), this only frees space
+CARD_TIMEOUT = 60 * 60 * 24
+
+
+class CardCacheStats:
+    """Hit/miss counters for this process, shown on the card cache stats page."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.render_time = 0.0
+
+    def record(self, hits, misses, render_time):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.render_time += render_time
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_render = self.render_time / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "avg_render_ms": avg_render * 1000,
+                # what the hits would have cost to render at the average miss cost
+                "render_ms_saved": self.hits * avg_render * 1000,
+            }
+
+
+stats = CardCacheStats()
+
+
+def card_key(listing):
+    return f"card:{listing.id}:{listing.version}"
+
+
+def render_cards(listings):
+    """
+    Rendered card markup for a page of listings.
+
+    All cards of the page are fetched in one get_many and the misses written
+    back in one set_many, so a memcached-style backend costs two round trips.
+    """
+    cache = caches[CARD_CACHE]
+    keys = {listing.id: card_key(listing) for listing in listings}
+    cached = cache.get_many(keys.values())
+
+    html = []
+    rendered = {}
+    start = time.perf_counter()
+    for listing in listings:
+        card = cached.get(keys[listing.id])
+        if card is None:
+            card = render_to_string("auctions/listing_card.html", {"listing": listing})
+            rendered[keys[listing.id]] = card
+        html.append(card)
+    render_time = time.perf_counter() - start
+
+    if rendered:
+        cache.set_many(rendered, CARD_TIMEOUT)
+    stats.record(len(listings) - len(rendered), len(rendered), render_time)
+    return mark_safe("".join(html))
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.module_loading import import_string
+
+
+# events a slow viewer can fall behind by before newer ones are dropped for them
+SUBSCRIBER_QUEUE_SIZE = 100
+# seconds between keepalive comments on idle event streams
+KEEPALIVE = 15
+
+
+class Subscription:
+    __slots__ = ("channel", "loop", "queue")
+
+    def __init__(self, channel, loop):
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+
+class InProcessBroker:
+    """
+    Fans listing events out to viewers connected to this process.
+
+    publish() is called from the synchronous write paths (any thread), the
+    subscribers live on the ASGI event loop. Another backend (redis pub/sub
+    etc.) only needs the same subscribe/unsubscribe/publish methods and can be
+    selected with the AUCTIONS_EVENT_BROKER setting.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, asyncio.get_running_loop())
+        with self._lock:
+            self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._channels.get(channel, ()))
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+
+        # wake each event loop once for all of its subscribers instead of once per viewer
+        by_loop = defaultdict(list)
+        for subscription in subscribers:
+            by_loop[subscription.loop].append(subscription.queue)
+        for loop, queues in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, queues, event)
+            except RuntimeError:
+                # the loop was closed under a viewer that never unsubscribed
+                pass
+
+
+def _deliver(queues, event):
+    for queue in queues:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        path = getattr(settings, "AUCTIONS_EVENT_BROKER", "auctions.events.InProcessBroker")
+        _broker = import_string(path)()
+    return _broker
+
+
+def publish(listing_id, kind, **data):
+    """Push an event to everyone watching a listing page, e.g. publish(5, "bid", price="10.00")."""
+    get_broker().publish(listing_id, {"type": kind, "listing": listing_id, **data})
+
+
+def streams_events(request):
+    """
+    Whether this server can stream events, only an ASGI server can.
+
+    Under WSGI django can't consume the async event_stream, the response
+    would never send a byte and hold a worker thread for as long as the
+    page stays open.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+async def event_stream(channel):
+    """Server-sent events for one listing, unsubscribes when the viewer goes away."""
+    broker = get_broker()
+    subscription = broker.subscribe(channel)
+    try:
+        # tell the browser how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), KEEPALIVE)
+            except asyncio.TimeoutError:
+                # comment line so proxies don't time out idle viewers
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
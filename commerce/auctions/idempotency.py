@@ -0,0 +1,126 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.contrib import messages
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+from django.http.request import RawPostDataException
+
+
+# the form field and header a client sends its key in, one key per submission
+FORM_FIELD = "idempotency_key"
+HEADER = "Idempotency-Key"
+CACHE_ALIAS = "idempotency"
+# how long a finished submission is replayed for
+KEY_TTL = 24 * 60 * 60
+# a submission still running after this is assumed dead and its key freed
+PENDING_TTL = 60
+# how long a duplicate waits for the original to finish before giving up with a 409
+PENDING_WAIT = 10
+POLL_INTERVAL = 0.05
+
+PENDING = "pending"
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def slot_key(request, key):
+    # per user and url, so one client's keys can't collide with another's
+    scope = f"{request.user.pk}:{request.path}:{key}"
+    return "idempotency:" + hashlib.sha256(scope.encode()).hexdigest()
+
+
+def fingerprint(request):
+    try:
+        body = request.body
+    except RawPostDataException:
+        # a multipart post already parsed into request.POST
+        body = repr(sorted(request.POST.lists())).encode()
+    return hashlib.sha256(body).hexdigest()
+
+
+def queued_messages(request):
+    # messages added while this request runs wait in the storage until the response
+    return list(getattr(getattr(request, "_messages", None), "_queued_messages", []))
+
+
+def freeze(response, added):
+    """What's kept to replay a response: redirects with their messages, JSON as is, nothing else."""
+    if 300 <= response.status_code < 400:
+        return {
+            "status": response.status_code,
+            "location": response["Location"],
+            "messages": [(message.level, message.message, message.extra_tags) for message in added],
+        }
+    if response.get("Content-Type", "").startswith("application/json"):
+        return {"status": response.status_code, "content": response.content}
+    return None
+
+
+def thaw(request, stored):
+    if "location" in stored:
+        for level, message, extra_tags in stored["messages"]:
+            messages.add_message(request, level, message, extra_tags=extra_tags)
+        response = HttpResponse(status=stored["status"])
+        response["Location"] = stored["location"]
+    else:
+        response = HttpResponse(stored["content"], status=stored["status"], content_type="application/json")
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(view):
+    """
+    Run a POST view once per idempotency key, repeats get the first response back.
+
+    The key comes from the idempotency_key form field ({% idempotency_key %}
+    in the form) or the Idempotency-Key header. The first request claims it
+    with an atomic cache add and runs the view, duplicates never reach the
+    view (or the database): they wait for it to finish and replay the
+    redirect and its messages, or the JSON, it answered with. Requests
+    without a key, from anonymous users, or that fail run as before and
+    leave nothing behind. Reusing a key for a different body is a 422.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = None
+        if request.method == "POST":
+            key = request.headers.get(HEADER) or request.POST.get(FORM_FIELD)
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        cache = caches[CACHE_ALIAS]
+        slot = slot_key(request, key)
+        body = fingerprint(request)
+        deadline = time.monotonic() + PENDING_WAIT
+        while not cache.add(slot, (PENDING, body), PENDING_TTL):
+            stored = cache.get(slot)
+            if stored is None:
+                # the first request failed (or its claim expired) between our add and get, try again
+                continue
+            if stored[1] != body:
+                return JsonResponse({"error": "this idempotency key was used for a different request"}, status=422)
+            if stored[0] != PENDING:
+                return thaw(request, stored[0])
+            if time.monotonic() > deadline:
+                return JsonResponse({"error": "a request with this idempotency key is still running"}, status=409)
+            time.sleep(POLL_INTERVAL)
+
+        before = len(queued_messages(request))
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            cache.delete(slot)
+            raise
+        stored = freeze(response, queued_messages(request)[before:])
+        if stored is None:
+            # a form shown again with its errors wrote nothing, the retry may as well run
+            cache.delete(slot)
+        else:
+            cache.set(slot, (stored, body), KEY_TTL)
+        return response
+    return wrapper
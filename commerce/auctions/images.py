@@ -0,0 +1,280 @@
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # without Pillow the proxy still caches and serves images, just not resized
+    Image = None
+
+
+# longest side of each thumbnail in pixels, picked by name in the proxy url
+THUMBNAIL_SIZES = {
+    "card": 640,
+    "large": 1280,
+}
+# bigger source images are refused rather than downloaded
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+FETCH_TIMEOUT = 5
+# a source that couldn't be fetched is not tried again for this long, in seconds
+FAILURE_TTL = 10 * 60
+# failed sources remembered at most, the oldest are forgotten first
+MAX_FAILURES = 10000
+# eviction deletes down to this fraction of the cap, so it doesn't run on every write
+EVICT_TO = 0.9
+
+# leading bytes of the formats we pass through, anything else is not served
+SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+
+
+class ImageUnavailable(Exception):
+    """The source image couldn't be fetched or isn't an image we serve."""
+
+
+def source_key(image_url):
+    # thumbnail urls carry this so they change when the listing's image does
+    return hashlib.sha256(image_url.encode()).hexdigest()[:16]
+
+
+def image_format(data):
+    for signature, ext in SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def check_public_host(host):
+    """Refuse hosts that resolve to private, loopback or link-local addresses."""
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError):
+        raise ImageUnavailable("unknown host")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global:
+            raise ImageUnavailable("image host is not public")
+
+
+def check_source_url(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ImageUnavailable("only http and https images are proxied")
+    check_public_host(parts.hostname)
+
+
+class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows redirects only to public http(s) hosts, a public url can't bounce the proxy inside."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_source_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(PublicRedirectHandler)
+
+
+def fetch_url(url):
+    """Download an image over http(s), the default AUCTIONS_IMAGE_FETCHER."""
+    check_source_url(url)
+    request = urllib.request.Request(url, headers={"User-Agent": "commerce-image-proxy"})
+    try:
+        with _opener.open(request, timeout=FETCH_TIMEOUT) as response:
+            data = response.read(MAX_SOURCE_BYTES + 1)
+    except (OSError, ValueError) as e:
+        raise ImageUnavailable(str(e))
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ImageUnavailable("image is too big")
+    return data
+
+
+def make_thumbnail(data, size):
+    """Return (bytes, extension) of the image shrunk to fit in size x size."""
+    ext = image_format(data)
+    if ext is None:
+        raise ImageUnavailable("not an image")
+    if Image is None:
+        return data, ext
+    try:
+        image = Image.open(io.BytesIO(data))
+        # jpeg decoding can skip straight to a smaller scale
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=82, optimize=True, progressive=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ImageUnavailable("image could not be decoded")
+    return out.getvalue(), "jpg"
+
+
+class DiskImageCache:
+    """
+    Thumbnails on disk, named by a hash of the source url and size.
+
+    Reads bump the file's mtime and writes evict the least recently used
+    files once the directory grows past max_bytes. The total size is kept in
+    memory so the directory is only scanned on startup and when evicting.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def name(self, image_url, size):
+        digest = hashlib.sha256(f"{size}:{image_url}".encode()).hexdigest()
+        # two levels of fan-out keep directories small
+        return os.path.join(digest[:2], digest)
+
+    def get(self, image_url, size):
+        """Path of the cached thumbnail, or None."""
+        base = os.path.join(self.directory, self.name(image_url, size))
+        for ext in CONTENT_TYPES:
+            path = f"{base}.{ext}"
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            return path
+        return None
+
+    def put(self, image_url, size, data, ext):
+        path = os.path.join(self.directory, f"{self.name(image_url, size)}.{ext}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temp file and renamed so readers never see half a file
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self.scan()[1]
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self.evict()
+        return path
+
+    def scan(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return files, total
+
+    def evict(self):
+        files, total = self.scan()
+        files.sort()
+        target = self.max_bytes * EVICT_TO
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+class ThumbnailService:
+    """
+    Generates thumbnails in a thread pool, off the request path.
+
+    A thumbnail asked for again while it's being generated shares the
+    running job, and sources that fail are remembered for FAILURE_TTL (the
+    last MAX_FAILURES of them).
+    """
+
+    def __init__(self, cache, fetcher, workers):
+        self.cache = cache
+        self.fetcher = fetcher
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._failed = {}
+
+    def lookup(self, image_url, size):
+        return self.cache.get(image_url, size)
+
+    def schedule(self, image_url, size):
+        """Start generating a thumbnail unless it's already running or recently failed."""
+        key = (image_url, size)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            failed_at = self._failed.get(key)
+            if failed_at is not None and time.monotonic() - failed_at < FAILURE_TTL:
+                return None
+            future = self.pool.submit(self.generate, image_url, size)
+            self._pending[key] = future
+        future.add_done_callback(lambda _: self._done(key))
+        return future
+
+    def _done(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def generate(self, image_url, size):
+        try:
+            data, ext = make_thumbnail(self.fetcher(image_url), THUMBNAIL_SIZES[size])
+        except ImageUnavailable:
+            with self._lock:
+                # kept in failure order, so the first entries are the oldest
+                self._failed.pop((image_url, size), None)
+                self._failed[(image_url, size)] = time.monotonic()
+                while len(self._failed) > MAX_FAILURES:
+                    del self._failed[next(iter(self._failed))]
+            return None
+        return self.cache.put(image_url, size, data, ext)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_thumbnails():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ThumbnailService(
+                DiskImageCache(settings.AUCTIONS_IMAGE_CACHE_DIR, settings.AUCTIONS_IMAGE_CACHE_MAX_BYTES),
+                import_string(getattr(settings, "AUCTIONS_IMAGE_FETCHER", "auctions.images.fetch_url")),
+                getattr(settings, "AUCTIONS_IMAGE_WORKERS", 4),
+            )
+        return _service
+
+
+def warm_thumbnails(image_url):
+    # called after a listing is saved so the card thumbnail is usually ready before anyone asks
+    if image_url:
+        get_thumbnails().schedule(image_url, "card")
@@ -0,0 +1,53 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from auctions.benchmarks import uncached_pages
+from auctions.models import Listing
+
+
+class Command(BaseCommand):
+    help = "Compare payload size and server time of the JSON api against the html views"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+
+    def handle(self, *args, **options):
+        # anonymous html pages would come from the page cache, the api is rendered every time
+        with uncached_pages():
+            self.bench(options["requests"])
+
+    def bench(self, requests):
+        listing = Listing.objects.order_by("-id").first()
+        if listing is None:
+            raise CommandError("needs at least one listing to benchmark against")
+
+        # in-process requests, so server time is all that is measured
+        client = Client(HTTP_HOST="localhost")
+        detail_etag = client.get(reverse("api_listing", args=[listing.id]))["ETag"]
+        grid_etag = client.get(reverse("api_listings"))["ETag"]
+
+        cases = [
+            ("html index", reverse("index"), {}),
+            ("api listings", reverse("api_listings"), {}),
+            ("api listings ?fields=id,title,current_price", reverse("api_listings") + "?fields=id,title,current_price", {}),
+            ("api listings 304", reverse("api_listings"), {"HTTP_IF_NONE_MATCH": grid_etag}),
+            ("html listing", reverse("listing", args=[listing.id]), {}),
+            ("api listing", reverse("api_listing", args=[listing.id]), {}),
+            ("api listing 304", reverse("api_listing", args=[listing.id]), {"HTTP_IF_NONE_MATCH": detail_etag}),
+        ]
+
+        self.stdout.write(f"{'endpoint':<48}{'status':>7}{'bytes':>9}{'p50 ms':>9}{'mean ms':>9}")
+        for name, url, headers in cases:
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = client.get(url, **headers)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(
+                f"{name:<48}{response.status_code:>7}{len(response.content):>9}"
+                f"{statistics.median(timings) * 1000:>9.2f}{statistics.mean(timings) * 1000:>9.2f}"
+            )
@@ -0,0 +1,65 @@
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from auctions.events import InProcessBroker
+
+
+class Command(BaseCommand):
+    help = "Measure event fan-out latency and memory per idle subscriber on one listing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscribers", type=int, default=5000)
+        parser.add_argument("--events", type=int, default=20)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options["subscribers"], options["events"]))
+
+    async def run(self, count, events):
+        broker = InProcessBroker()
+        channel = 1
+        latencies = []
+        received = asyncio.Event()
+        remaining = [0]
+
+        async def viewer(subscription):
+            # stands in for one connected event stream
+            while True:
+                event = await subscription.queue.get()
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    latencies.append(time.perf_counter() - event["sent"])
+                    received.set()
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tasks = [asyncio.create_task(viewer(broker.subscribe(channel))) for _ in range(count)]
+        await asyncio.sleep(0)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+        for _ in range(events):
+            remaining[0] = count
+            received.clear()
+            # publish from another thread, like the synchronous write paths do
+            sender = threading.Thread(
+                target=lambda: broker.publish(channel, {"type": "bid", "sent": time.perf_counter()})
+            )
+            sender.start()
+            await received.wait()
+            sender.join()
+
+        for task in tasks:
+            task.cancel()
+
+        latencies.sort()
+        self.stdout.write(f"subscribers:            {count}")
+        self.stdout.write(f"events:                 {events}")
+        self.stdout.write(f"memory per subscriber:  {allocated / count:.0f} bytes")
+        self.stdout.write(f"fan-out latency p50:    {statistics.median(latencies) * 1000:.2f} ms")
+        self.stdout.write(f"fan-out latency max:    {latencies[-1] * 1000:.2f} ms")
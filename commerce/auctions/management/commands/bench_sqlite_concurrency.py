@@ -0,0 +1,105 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+
+from auctions.benchmarks import throwaway_database
+from auctions.models import Category, Listing, User
+from auctions.services import BidRejected, add_listing, place_bid
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure grid read throughput while bids are written continuously. "
+        "Runs on a throwaway database, your own is never touched"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument(
+            "--baseline", action="store_true",
+            help="run with sqlite defaults (rollback journal, no pragmas) to compare against",
+        )
+        parser.add_argument(
+            "--db", help="sqlite file for the benchmark database, kept between runs (default: a temp file)"
+        )
+
+    def handle(self, *args, **options):
+        with throwaway_database(options["db"]):
+            self.bench(options)
+
+    def bench(self, options):
+        if options["baseline"]:
+            # new connections pick the options up, the journal mode sticks to the file
+            connection.settings_dict["OPTIONS"] = {"timeout": 5}
+            connections.close_all()
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode=DELETE")
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+
+        seller = User.objects.get_or_create(username="bench_seller")[0]
+        listing = add_listing(Listing(
+            title="bench listing", current_price=Decimal("0.01"),
+            category=Category.for_name("bench"), user=seller,
+        ))
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        counts = {"reads": 0, "writes": 0, "stale": 0, "locked": 0}
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    try:
+                        # what the index grid does
+                        list(Listing.objects.filter(is_closed=False).order_by("-id")[:25])
+                        count("reads")
+                    except OperationalError:
+                        count("locked")
+            finally:
+                connection.close()
+
+        def writer(user):
+            try:
+                while not stop.is_set():
+                    current = Listing.objects.values_list("current_price", flat=True).get(id=listing.id)
+                    try:
+                        place_bid(listing, user, current + Decimal("0.01"))
+                        count("writes")
+                    except BidRejected:
+                        count("stale")
+                    except OperationalError:
+                        count("locked")
+            finally:
+                connection.close()
+
+        writers = [
+            threading.Thread(target=writer, args=(User.objects.get_or_create(username=f"bench_bidder_{i}")[0],))
+            for i in range(options["writers"])
+        ]
+        readers = [threading.Thread(target=reader) for _ in range(options["readers"])]
+        for thread in writers + readers:
+            thread.start()
+        time.sleep(options["seconds"])
+        stop.set()
+        for thread in writers + readers:
+            thread.join()
+
+        seconds = options["seconds"]
+        self.stdout.write(f"journal mode:     {journal_mode}")
+        self.stdout.write(f"readers/writers:  {options['readers']}/{options['writers']}")
+        self.stdout.write(f"reads/sec:        {counts['reads'] / seconds:.0f}")
+        self.stdout.write(f"bids/sec:         {counts['writes'] / seconds:.0f}")
+        self.stdout.write(f"stale bids:       {counts['stale']}")
+        self.stdout.write(f"locked errors:    {counts['locked']}")
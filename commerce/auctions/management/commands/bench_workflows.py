@@ -0,0 +1,95 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions import benchmarks
+from auctions.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with a realistic dataset and benchmark the index, category, "
+        "listing, bid, comment and watchlist flows. Your own database is never touched"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--listings", type=int, default=5000)
+        parser.add_argument("--bids", type=int, default=50000)
+        parser.add_argument("--comments", type=int, default=10000)
+        parser.add_argument("--watchlists", type=int, default=10000)
+        parser.add_argument("--requests", type=int, default=2000, help="requests across all scenarios")
+        parser.add_argument("--concurrency", type=int, default=4, help="client threads")
+        parser.add_argument(
+            "--mix", default="",
+            help="scenario weights like index=1,listing=3 (default: %s)"
+            % ",".join(f"{name}={weight}" for name, weight in benchmarks.DEFAULT_MIX.items()),
+        )
+        parser.add_argument("--seed", type=int, default=0, help="random seed for the data and the traffic")
+        parser.add_argument("--json", help="write the report to this file")
+        parser.add_argument("--baseline", help="an earlier --json report to compare against")
+        parser.add_argument(
+            "--db", help="sqlite file for the benchmark database, kept between runs (default: a temp file)"
+        )
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options["mix"])
+        with benchmarks.throwaway_database(options["db"]):
+            if not User.objects.filter(username__startswith="bench_").exists():
+                start = time.perf_counter()
+                seeded = benchmarks.seed(
+                    users=options["users"], listings=options["listings"], bids=options["bids"],
+                    comments=options["comments"], watchlists=options["watchlists"],
+                    rng=random.Random(options["seed"]),
+                )
+                self.stdout.write(
+                    f"seeded {', '.join(f'{count} {name}' for name, count in seeded.items())} "
+                    f"in {time.perf_counter() - start:.1f}s"
+                )
+            result = benchmarks.run(
+                mix=mix, requests=options["requests"], concurrency=options["concurrency"],
+                rng_seed=options["seed"],
+            )
+
+        self.print_report(result)
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f"report written to {options['json']}")
+        if options["baseline"]:
+            self.print_comparison(result, benchmarks.load_report(options["baseline"]))
+
+    def parse_mix(self, value):
+        if not value:
+            return None
+        mix = {}
+        for part in value.split(","):
+            name, _, weight = part.partition("=")
+            if name not in benchmarks.SCENARIOS or not weight.isdigit():
+                raise CommandError(f"bad --mix entry {part!r}, scenarios are {', '.join(benchmarks.SCENARIOS)}")
+            mix[name] = int(weight)
+        return mix
+
+    def print_report(self, result):
+        self.stdout.write(
+            f"{'scenario':<12}{'requests':>9}{'errors':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'p99 ms':>9}{'queries':>9}{'max q':>7}"
+        )
+        rows = list(result["scenarios"].items()) + [("total", result["total"])]
+        for name, row in rows:
+            self.stdout.write(
+                f"{name:<12}{row['requests']:>9}{row['errors']:>7}{row['throughput']:>9.1f}"
+                f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+                f"{row['avg_queries']:>9.1f}{row['max_queries']:>7}"
+            )
+        for message, count in result["exceptions"].items():
+            self.stderr.write(f"{count}x {message}")
+
+    def print_comparison(self, result, baseline):
+        self.stdout.write(f"\n{'scenario':<12}{'p95 before':>12}{'p95 now':>10}{'change':>9}{'queries':>16}")
+        for name, before, now, change, queries_before, queries_now in benchmarks.compare(result, baseline):
+            self.stdout.write(
+                f"{name:<12}{before:>12.2f}{now:>10.2f}{change:>+8.1f}%{queries_before:>8.1f} -> {queries_now:.1f}"
+            )
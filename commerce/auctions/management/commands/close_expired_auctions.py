@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.services import close_expired
+
+
+class Command(BaseCommand):
+    help = "Close every auction past its end time, in batches. --loop keeps running as a scheduler"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--pause", type=float, default=0.01,
+            help="seconds to sleep between batches so bidders can get the write lock",
+        )
+        parser.add_argument("--loop", action="store_true", help="keep checking for expired auctions")
+        parser.add_argument("--interval", type=float, default=30, help="seconds between checks with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            total = 0
+            while True:
+                closed = close_expired(batch_size=options["batch_size"])
+                if not closed:
+                    break
+                total += closed
+                time.sleep(options["pause"])
+
+            if total:
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"closed {total} auctions in {elapsed:.2f}s ({total / elapsed * 60:.0f}/min)"
+                )
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
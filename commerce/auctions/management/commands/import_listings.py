@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.bulk import IMPORT_BATCH_SIZE, import_listings, read_rows
+from auctions.models import User
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or JSONL file of listings into the database for one seller"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True, help="username of the seller")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"no user named {options['user']}")
+        fmt = options["format"] or ("jsonl" if options["path"].endswith((".jsonl", ".json")) else "csv")
+
+        start = time.perf_counter()
+
+        def progress(report):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"\r{report.imported} imported, {report.error_count} errors, "
+                f"{report.rows / elapsed:.0f} rows/s",
+                ending="",
+            )
+            self.stdout.flush()
+
+        with open(options["path"], "rb") as stream:
+            report = import_listings(read_rows(stream, fmt), user, options["batch_size"], progress)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write("")
+        self.stdout.write(f"imported {report.imported} of {report.rows} rows in {elapsed:.1f}s")
+        for line, message in report.errors:
+            self.stdout.write(f"  line {line}: {message}")
+        if report.error_count > len(report.errors):
+            self.stdout.write(f"  ...and {report.error_count - len(report.errors)} more errors")
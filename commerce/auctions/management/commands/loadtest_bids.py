@@ -0,0 +1,80 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from auctions.benchmarks import throwaway_database
+from auctions.models import Category, Listing, User
+from auctions.services import BidRejected, add_listing, place_bid
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer one hot listing with bids from many threads and report throughput. "
+        "Runs on a throwaway database, your own is never touched"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--bids", type=int, default=100, help="bids per thread")
+        parser.add_argument(
+            "--db", help="sqlite file for the load test database, kept between runs (default: a temp file)"
+        )
+
+    def handle(self, *args, **options):
+        with throwaway_database(options["db"]):
+            self.load_test(options["threads"], options["bids"])
+
+    def load_test(self, threads, per_thread):
+        users = [
+            User.objects.get_or_create(username=f"loadtest_bidder_{i}")[0]
+            for i in range(threads)
+        ]
+        # through the service like the create form, so counts and rollups match the bids
+        listing = add_listing(Listing(
+            title="load test listing",
+            start_bid=Decimal("0.01"),
+            current_price=Decimal("0.01"),
+            category=Category.for_name("load test"),
+            user=users[0],
+        ))
+
+        lock = threading.Lock()
+        counts = {"placed": 0, "stale": 0, "other": 0}
+
+        def bidder(user):
+            try:
+                for _ in range(per_thread):
+                    # read the price, then bid just above it like a real user would
+                    current = Listing.objects.values_list("current_price", flat=True).get(id=listing.id)
+                    try:
+                        place_bid(listing, user, current + Decimal("0.01"))
+                        result = "placed"
+                    except BidRejected as e:
+                        result = "stale" if "higher than the highest" in str(e) else "other"
+                    with lock:
+                        counts[result] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=bidder, args=(user,)) for user in users]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        listing.refresh_from_db()
+        total = threads * per_thread
+        self.stdout.write(f"threads:          {threads}")
+        self.stdout.write(f"attempts:         {total}")
+        self.stdout.write(f"bids placed:      {counts['placed']}")
+        self.stdout.write(f"stale rejections: {counts['stale']}")
+        self.stdout.write(f"other rejections: {counts['other']}")
+        self.stdout.write(f"elapsed:          {elapsed:.2f}s")
+        self.stdout.write(f"bids/sec:         {counts['placed'] / elapsed:.1f}")
+        self.stdout.write(f"attempts/sec:     {total / elapsed:.1f}")
+        self.stdout.write(f"final price:      {listing.current_price}")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from auctions import middleware
+
+
+class Command(BaseCommand):
+    help = "Request pages in-process with the performance middleware on and print the per-view report"
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="*", default=["/", "/categories"])
+        parser.add_argument("--requests", type=int, default=20, help="requests per url")
+        parser.add_argument("--user", help="log in as this username first")
+
+    def handle(self, *args, **options):
+        middleware.registry.reset()
+        with override_settings(AUCTIONS_PERF_ENABLED=True):
+            client = Client(HTTP_HOST="localhost")
+            if options["user"]:
+                from auctions.models import User
+                client.force_login(User.objects.get(username=options["user"]))
+            for url in options["urls"]:
+                for _ in range(options["requests"]):
+                    client.get(url)
+
+        for view, stats in middleware.registry.report().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(view))
+            self.stdout.write(
+                f"  requests {stats['requests']}  avg {stats['avg_ms']:.2f}ms  max {stats['max_ms']:.2f}ms"
+            )
+            self.stdout.write(
+                f"  queries avg {stats['avg_queries']:.1f} max {stats['max_queries']}"
+                f"  duplicates {stats['duplicate_queries']}"
+            )
+            self.stdout.write(
+                f"  db avg {stats['avg_db_ms']:.2f}ms  templates avg {stats['avg_template_ms']:.2f}ms"
+            )
+            self.stdout.write(f"  latency ms {stats['latency_ms']}")
+            self.stdout.write(f"  queries    {stats['queries']}")
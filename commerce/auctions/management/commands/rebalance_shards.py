@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+
+from auctions import sharding
+from auctions.models import Bid, Closed, Comment, Listing, ListingSequence, OutboxEvent, PriceBucket, ProxyBid, Watchlist
+
+
+# the rows stored with their listing, they move along with it
+DEPENDENTS = [Bid, ProxyBid, PriceBucket, Comment, Watchlist, Closed, OutboxEvent]
+
+
+class Command(BaseCommand):
+    help = (
+        "Move listings, with their bids, comments and the rest, to the shard their id hashes to. Run it "
+        "after adding a shard, or with --from default to split up a database from before sharding"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="source", help="only move listings off this database, e.g. default")
+        parser.add_argument("--batch-size", type=int, default=200, help="listings moved per transaction")
+
+    def handle(self, *args, **options):
+        if not sharding.shards():
+            raise CommandError("AUCTIONS_SHARDS isn't set, there are no shards to move listings to")
+        source = options["source"]
+        if source is not None and source not in connections.databases:
+            raise CommandError(f"no database called {source}")
+        if source == DEFAULT_DB_ALIAS:
+            seed_sequence()
+
+        for db in [source] if source else sharding.shards():
+            moved = 0
+            last_id = 0
+            while True:
+                ids = list(
+                    Listing.objects.using(db).filter(id__gt=last_id).order_by("id")
+                    .values_list("id", flat=True)[:options["batch_size"]]
+                )
+                if not ids:
+                    break
+                last_id = ids[-1]
+                targets = defaultdict(list)
+                for listing_id in ids:
+                    target = sharding.shard_for(listing_id)
+                    if target != db:
+                        targets[target].append(listing_id)
+                for target, listing_ids in targets.items():
+                    move(listing_ids, db, target)
+                    moved += len(listing_ids)
+            self.stdout.write(f"{db}: moved {moved} listings")
+
+
+def seed_sequence():
+    # listings created from now on have to get ids above the ones coming off default
+    highest = Listing.objects.using(DEFAULT_DB_ALIAS).aggregate(highest=Max("id"))["highest"] or 0
+    if highest > (ListingSequence.objects.aggregate(highest=Max("id"))["highest"] or 0):
+        ListingSequence.objects.create(id=highest)
+
+
+def move(listing_ids, source, target):
+    """
+    Copy listings and their rows from source to target, then delete them from source.
+
+    The target commits first, so a run that dies in between leaves copies
+    rather than losing rows, and the next run replaces those copies.
+    """
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        delete_rows(target, listing_ids)
+        Listing.objects.using(target).bulk_create(
+            Listing.objects.using(source).filter(id__in=listing_ids).order_by("id")
+        )
+        for model in DEPENDENTS:
+            rows = list(model.objects.using(source).filter(listing_id__in=listing_ids).order_by("id"))
+            for row in rows:
+                # only listing ids are unique across shards, the rest get new ids in the same order
+                row.pk = None
+            model.objects.using(target).bulk_create(rows, batch_size=500)
+        delete_rows(source, listing_ids)
+
+
+def delete_rows(db, listing_ids):
+    # plain deletes, the orm's cascade would look for the listings' notifications on
+    # this database (they're on default) and delete them on default
+    connection = connections[db]
+    placeholders = ", ".join(["%s"] * len(listing_ids))
+    with connection.cursor() as cursor:
+        for model in DEPENDENTS + [Listing]:
+            column = "id" if model is Listing else "listing_id"
+            cursor.execute(
+                f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)} "
+                f"WHERE {column} IN ({placeholders})",
+                listing_ids,
+            )
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.services import rebuild_bid_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute bidder counts, last bid times and price timelines from the bids table"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rebuild_bid_stats()
+        self.stdout.write(f"rebuilt bid stats in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text listing search index from the listings table, on every shard when sharded"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = rebuild_index()
+        self.stdout.write(f"indexed {count} listings in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.services import ROLLUP_BATCH, rebuild_seller_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the seller dashboard rollups from the listings, a batch of sellers per transaction. "
+        "Migration 0023 fills them in, run this after migrating a sharded install where it can't"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=ROLLUP_BATCH, help="sellers per transaction")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def progress(sellers):
+            self.stdout.write(f"\r{sellers} sellers, {sellers / (time.perf_counter() - start):.0f}/s", ending="")
+            self.stdout.flush()
+
+        sellers = rebuild_seller_rollups(options["batch_size"], progress)
+        self.stdout.write("")
+        self.stdout.write(f"rebuilt rollups for {sellers} sellers in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.notifications import OUTBOX_BATCH, deliver_notifications
+
+
+class Command(BaseCommand):
+    help = "Send outbid and auction closed notifications from the outbox. --loop keeps running as a worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH)
+        parser.add_argument("--loop", action="store_true", help="keep checking the outbox")
+        parser.add_argument("--interval", type=float, default=2, help="seconds between checks with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            total = 0
+            while True:
+                handled = deliver_notifications(batch_size=options["batch_size"])
+                if not handled:
+                    break
+                total += handled
+
+            if total:
+                self.stdout.write(f"sent {total} events in {time.perf_counter() - start:.2f}s")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,46 @@
+import base64
+import hashlib
+import os
+import re
+import urllib.request
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.staticfiles import VENDOR_ASSETS
+
+
+# the manifest storage rewrites source map references and collectstatic fails
+# on a map that isn't there, we don't ship the maps
+SOURCE_MAP = re.compile(rb"\s*/\*# sourceMappingURL=[^*]*\*/\s*$")
+
+
+class Command(BaseCommand):
+    help = (
+        "Download the third party css into auctions/static so it's served with the rest of the static "
+        "files, checked against its subresource integrity hash. Commit the files it writes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="download again even if the file is there")
+
+    def handle(self, *args, **options):
+        static_dir = os.path.join(apps.get_app_config("auctions").path, "static")
+        for name, asset in VENDOR_ASSETS.items():
+            path = os.path.join(static_dir, asset["path"])
+            if os.path.exists(path) and not options["force"]:
+                self.stdout.write(f"{name}: {asset['path']} already vendored")
+                continue
+            try:
+                with urllib.request.urlopen(asset["url"], timeout=30) as response:
+                    data = response.read()
+            except OSError as e:
+                raise CommandError(f"{name}: couldn't download {asset['url']}: {e}")
+            algorithm, _, expected = asset["integrity"].partition("-")
+            digest = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+            if digest != expected:
+                raise CommandError(f"{name}: {asset['url']} doesn't match its integrity hash, not written")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(SOURCE_MAP.sub(b"\n", data))
+            self.stdout.write(f"{name}: wrote {asset['path']} ({len(data)} bytes)")
@@ -0,0 +1,245 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.template.backends.django import Template
+from django.utils.cache import patch_vary_headers
+
+from .staticfiles import index_static_root
+
+
+# histogram bucket upper bounds, the last bucket catches everything above
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+# stats of the request being handled on this thread/task
+_current = ContextVar("auctions_perf_request", default=None)
+
+
+class Histogram:
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return dict(zip(labels, self.counts))
+
+
+class RequestStats:
+    """What one request cost, filled in by the query wrapper and template hook."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # django.db execute_wrapper, sees every query on the connection
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        # same statement with the same parameters run more than once, a sign of an N+1
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+
+class ViewStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.duplicates = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.query_counts = Histogram(QUERY_BUCKETS)
+
+    def add(self, stats, elapsed):
+        self.requests += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.queries += stats.queries
+        self.max_queries = max(self.max_queries, stats.queries)
+        self.duplicates += stats.duplicates
+        self.db_time += stats.db_time
+        self.template_time += stats.template_time
+        self.latency.add(elapsed * 1000)
+        self.query_counts.add(stats.queries)
+
+    def as_dict(self):
+        n = self.requests
+        return {
+            "requests": n,
+            "avg_ms": self.total_time / n * 1000,
+            "max_ms": self.max_time * 1000,
+            "avg_queries": self.queries / n,
+            "max_queries": self.max_queries,
+            "duplicate_queries": self.duplicates,
+            "avg_db_ms": self.db_time / n * 1000,
+            "avg_template_ms": self.template_time / n * 1000,
+            "latency_ms": self.latency.as_dict(),
+            "queries": self.query_counts.as_dict(),
+        }
+
+
+class PerfRegistry:
+    """Per-view aggregates for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, stats, elapsed):
+        with self._lock:
+            if view not in self._views:
+                self._views[view] = ViewStats()
+            self._views[view].add(stats, elapsed)
+
+    def report(self):
+        with self._lock:
+            return {view: stats.as_dict() for view, stats in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = PerfRegistry()
+
+_template_hook_lock = threading.Lock()
+_template_hook_installed = False
+
+
+def install_template_hook():
+    """
+    Time template rendering by wrapping the django backend's Template.render.
+
+    Only the outermost render of a request is timed so includes and the
+    listing cards rendered inside a page aren't counted twice.
+    """
+    global _template_hook_installed
+    with _template_hook_lock:
+        if _template_hook_installed:
+            return
+        original = Template.render
+
+        def render(self, context=None, request=None):
+            stats = _current.get()
+            if stats is None:
+                return original(self, context, request)
+            stats.template_depth += 1
+            start = time.perf_counter()
+            try:
+                return original(self, context, request)
+            finally:
+                stats.template_depth -= 1
+                if stats.template_depth == 0:
+                    stats.template_time += time.perf_counter() - start
+
+        Template.render = render
+        _template_hook_installed = True
+
+
+class PerformanceMiddleware:
+    """
+    Opt-in per-view query count, duplicate query, db time, template time and
+    latency recording. Turned on with AUCTIONS_PERF_ENABLED, when it's off
+    django drops the middleware at startup so it costs nothing.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "AUCTIONS_PERF_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_template_hook()
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        elapsed = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        view = (match.view_name if match else None) or "unresolved"
+        registry.record(view, stats, elapsed)
+        return response
+
+
+class StaticFilesMiddleware:
+    """
+    Serves the collectstatic output in STATIC_ROOT from the app itself, so
+    gunicorn/uvicorn need no separate static file server.
+
+    STATIC_ROOT is indexed once at startup, restart the app after a
+    collectstatic. Each request then only picks the precompressed variant
+    the client accepts and streams it with FileResponse (sendfile where the
+    server supports wsgi.file_wrapper). Off with DEBUG, runserver serves the
+    source files then.
+    """
+
+    def __init__(self, get_response):
+        if settings.DEBUG or not settings.STATIC_ROOT or not settings.STATIC_URL:
+            raise MiddlewareNotUsed
+        self.files = index_static_root(settings.STATIC_ROOT)
+        if not self.files:
+            # nothing collected yet, leave static urls to the rest of the stack
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+
+    def __call__(self, request):
+        if request.method in ("GET", "HEAD") and request.path.startswith(self.prefix):
+            static = self.files.get(request.path[len(self.prefix):])
+            if static is not None:
+                return self.serve(request, static)
+        return self.get_response(request)
+
+    def serve(self, request, static):
+        if request.headers.get("If-None-Match") == static.etag:
+            response = HttpResponseNotModified()
+        else:
+            path, size, encoding = static.pick(request.headers.get("Accept-Encoding"))
+            if request.method == "HEAD":
+                response = HttpResponse(content_type=static.content_type)
+            else:
+                response = FileResponse(open(path, "rb"), content_type=static.content_type)
+                # FileResponse names the download after the .gz/.br file, it's shown inline anyway
+                del response["Content-Disposition"]
+            response["Content-Length"] = size
+            if encoding:
+                response["Content-Encoding"] = encoding
+        response["ETag"] = static.etag
+        response["Cache-Control"] = static.cache_control
+        if static.variants:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
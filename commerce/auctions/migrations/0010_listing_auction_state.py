@@ -0,0 +1,73 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def backfill_auction_state(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    Bid = apps.get_model('auctions', 'Bid')
+    Comment = apps.get_model('auctions', 'Comment')
+    Closed = apps.get_model('auctions', 'Closed')
+
+    def count_of(model):
+        counts = (
+            model.objects.filter(listing=OuterRef('pk'))
+            .order_by()
+            .values('listing')
+            .annotate(n=Count('id'))
+            .values('n')
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    # one set-based update instead of a query per listing
+    Listing.objects.update(
+        highest_bidder=Subquery(
+            Bid.objects.filter(listing=OuterRef('pk')).order_by('-amount').values('user')[:1]
+        ),
+        bid_count=count_of(Bid),
+        comment_count=count_of(Comment),
+        is_closed=Exists(Closed.objects.filter(listing=OuterRef('pk'))),
+    )
+    # closes weren't timed until now, old ones get the migration time
+    Listing.objects.filter(is_closed=True).update(closed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0009_alter_listing_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='bid_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='highest_bidder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leading_listings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='is_closed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_auction_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils.text import slugify
+
+
+def categories_from_text(apps, schema_editor):
+    Category = apps.get_model('auctions', 'Category')
+    Listing = apps.get_model('auctions', 'Listing')
+
+    # one update per distinct category string, not per listing
+    raw_names = Listing.objects.order_by().values_list('category', flat=True).distinct()
+    for raw_name in raw_names:
+        # the old form saved the text as typed, "Lamps " goes in the same category as "lamps"
+        name = raw_name.strip()
+        category, _ = Category.objects.get_or_create(
+            slug=slugify(name) or 'uncategorized', defaults={'name': name}
+        )
+        Listing.objects.filter(category=raw_name).update(category_ref=category)
+
+    counts = Listing.objects.order_by().values('category_ref').annotate(
+        total=Count('id'), active=Count('id', filter=Q(is_closed=False))
+    )
+    for row in counts:
+        Category.objects.filter(id=row['category_ref']).update(
+            listing_count=row['total'], active_count=row['active']
+        )
+
+
+def categories_to_text(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    for listing in Listing.objects.select_related('category_ref'):
+        listing.category = listing.category_ref.name
+        listing.save(update_fields=['category'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0011_grid_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=60, unique=True)),
+                ('name', models.CharField(max_length=50)),
+                ('listing_count', models.PositiveIntegerField(default=0)),
+                ('active_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='listing_category_idx',
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='category_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='auctions.category'),
+        ),
+        migrations.RunPython(categories_from_text, categories_to_text),
+        migrations.RemoveField(
+            model_name='listing',
+            name='category',
+        ),
+        migrations.RenameField(
+            model_name='listing',
+            old_name='category_ref',
+            new_name='category',
+        ),
+        migrations.AlterField(
+            model_name='listing',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='listings', to='auctions.category'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['category', 'is_closed', '-id'], name='listing_category_idx'),
+        ),
+    ]
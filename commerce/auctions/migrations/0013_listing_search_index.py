@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+# fts5 table mirroring the searchable listing columns, rowid is the listing id.
+# the bm25 weights rank title matches over category over description
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE auctions_listing_fts USING fts5(
+        title, description, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    "INSERT INTO auctions_listing_fts(auctions_listing_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0)')",
+    """
+    CREATE TRIGGER auctions_listing_fts_insert AFTER INSERT ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(rowid, title, description, category)
+        SELECT new.id, new.title, new.description, name FROM auctions_category WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER auctions_listing_fts_update AFTER UPDATE OF title, description, category_id ON auctions_listing BEGIN
+        DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+        INSERT INTO auctions_listing_fts(rowid, title, description, category)
+        SELECT new.id, new.title, new.description, name FROM auctions_category WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER auctions_listing_fts_delete AFTER DELETE ON auctions_listing BEGIN
+        DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    INSERT INTO auctions_listing_fts(rowid, title, description, category)
+    SELECT l.id, l.title, l.description, c.name
+    FROM auctions_listing l JOIN auctions_category c ON c.id = l.category_id
+    """,
+]
+
+DROP_INDEX = [
+    "DROP TRIGGER auctions_listing_fts_insert",
+    "DROP TRIGGER auctions_listing_fts_update",
+    "DROP TRIGGER auctions_listing_fts_delete",
+    "DROP TABLE auctions_listing_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0012_category'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_winners(apps, schema_editor):
+    Closed = apps.get_model('auctions', 'Closed')
+    Listing = apps.get_model('auctions', 'Listing')
+    listing = Listing.objects.filter(id=OuterRef('listing_id'))
+    Closed.objects.update(
+        winner=Subquery(listing.values('highest_bidder')[:1]),
+        price=Subquery(listing.values('current_price')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0015_listing_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='closed',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='closed',
+            name='winner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['is_closed', 'ends_at'], name='listing_expiry_idx'),
+        ),
+        migrations.RunPython(backfill_winners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:53
+
+import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncHour
+
+
+def backfill_bid_stats(apps, schema_editor):
+    # same as services.rebuild_bid_stats. old bids get the migration time as created
+    Bid = apps.get_model('auctions', 'Bid')
+    Listing = apps.get_model('auctions', 'Listing')
+    PriceBucket = apps.get_model('auctions', 'PriceBucket')
+    bids = Bid.objects.filter(listing=OuterRef('pk')).order_by().values('listing')
+    Listing.objects.update(
+        bidder_count=Coalesce(Subquery(bids.annotate(n=Count('user', distinct=True)).values('n')), 0),
+        last_bid_at=Subquery(bids.annotate(last=Max('created')).values('last')),
+    )
+    buckets = (
+        Bid.objects.annotate(start=TruncHour('created', tzinfo=datetime.timezone.utc))
+        .order_by()
+        .values('listing_id', 'start')
+        .annotate(open=Min('amount'), close=Max('amount'), bids=Count('id'))
+    )
+    PriceBucket.objects.bulk_create([PriceBucket(**bucket) for bucket in buckets], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0016_auction_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('close', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('bids', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bid',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='bidder_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='last_bid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', '-amount'], name='bid_listing_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', 'created'], name='bid_listing_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', 'user'], name='bid_listing_user_idx'),
+        ),
+        migrations.AddField(
+            model_name='pricebucket',
+            name='listing',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_buckets', to='auctions.listing'),
+        ),
+        migrations.AddConstraint(
+            model_name='pricebucket',
+            constraint=models.UniqueConstraint(fields=('listing', 'start'), name='price_bucket_listing_start_uniq'),
+        ),
+        migrations.RunPython(backfill_bid_stats, migrations.RunPython.noop),
+    ]
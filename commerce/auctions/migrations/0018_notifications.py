@@ -0,0 +1,69 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0017_bid_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('outbid', 'outbid'), ('new_bid', 'new bid'), ('closed', 'closed')], max_length=10)),
+                ('message', models.CharField(max_length=200)),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('read', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bid', 'bid'), ('closed', 'closed')], max_length=10)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(fields=['listing', 'user'], name='watchlist_listing_user_idx'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='listing',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='auctions.listing'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='actor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='listing',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='auctions.listing'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-id'], name='notification_inbox_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('read', False)), fields=('user', 'listing', 'kind'), name='notification_unread_uniq'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:11
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0018_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:23
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_watchlists(apps, schema_editor):
+    # the old exists()-then-insert could save a listing twice, keep the first entry
+    Watchlist = apps.get_model('auctions', 'Watchlist')
+    duplicates = (
+        Watchlist.objects.order_by().values('user_id', 'listing_id')
+        .annotate(n=Count('id'), keep=Min('id')).filter(n__gt=1)
+    )
+    for row in duplicates:
+        Watchlist.objects.filter(user_id=row['user_id'], listing_id=row['listing_id']).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0020_proxy_bids'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='bid',
+            name='bid_listing_user_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='watchlist',
+            name='watchlist_user_listing_idx',
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', 'user', '-amount'], name='bid_listing_user_amount_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_watchlists, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='watchlist',
+            constraint=models.UniqueConstraint(fields=('user', 'listing'), name='watchlist_user_listing_uniq'),
+        ),
+    ]
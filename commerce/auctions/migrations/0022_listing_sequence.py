@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0021_unique_watchlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+    ]
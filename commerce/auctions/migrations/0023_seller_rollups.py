@@ -0,0 +1,72 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:37
+
+import django.db.models.deletion
+from django.conf import settings
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_seller_rollups(apps, schema_editor):
+    # same grouped query as services.rebuild_seller_rollups, in one go
+    Listing = apps.get_model('auctions', 'Listing')
+    SellerRollup = apps.get_model('auctions', 'SellerRollup')
+    sold = Q(is_closed=True, highest_bidder__isnull=False)
+    rows = (
+        Listing.objects.order_by()
+        .values('user_id', 'category_id')
+        .annotate(
+            listing_count=Count('id'),
+            active_count=Count('id', filter=Q(is_closed=False)),
+            closed_count=Count('id', filter=Q(is_closed=True)),
+            sold_count=Count('id', filter=sold),
+            revenue=Coalesce(Sum('current_price', filter=sold), Decimal(0)),
+            bid_count=Sum('bid_count'),
+        )
+    )
+    SellerRollup.objects.bulk_create(
+        [SellerRollup(seller_id=row.pop('user_id'), **row) for row in rows], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0022_listing_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing_count', models.PositiveIntegerField(default=0)),
+                ('active_count', models.PositiveIntegerField(default=0)),
+                ('closed_count', models.PositiveIntegerField(default=0)),
+                ('sold_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('bid_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['user', '-id'], name='listing_seller_idx'),
+        ),
+        migrations.AddField(
+            model_name='sellerrollup',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='auctions.category'),
+        ),
+        migrations.AddField(
+            model_name='sellerrollup',
+            name='seller',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='sellerrollup',
+            constraint=models.UniqueConstraint(fields=('seller', 'category'), name='seller_rollup_uniq'),
+        ),
+        migrations.RunPython(backfill_seller_rollups, migrations.RunPython.noop),
+    ]
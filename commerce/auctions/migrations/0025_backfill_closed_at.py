@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:45
+
+from django.db import migrations
+from django.db.models import F
+
+
+def backfill_closed_at(apps, schema_editor):
+    # listings closed before 0010 timed closes were left without a close time,
+    # the last time the listing changed is the closest thing to it
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(is_closed=True, closed_at__isnull=True).update(closed_at=F('modified'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0024_api_tokens'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_closed_at, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,33 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+from django.utils.text import slugify
 
 
 class User(AbstractUser):
     pass
 
+class Category(models.Model):
+    slug = models.SlugField(max_length=60, unique=True)
+    name = models.CharField(max_length=50)
+
+    # kept up to date by the write paths in services.py for the category directory
+    listing_count = models.PositiveIntegerField(default=0)
+    active_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def for_name(cls, name):
+        # "Lamps" and "lamps " end up in the same category
+        name = name.strip()
+        category, _ = cls.objects.get_or_create(
+            slug=slugify(name) or "uncategorized", defaults={"name": name}
+            )
+        return category
+
 class Listing(models.Model):
     title = models.CharField(max_length=50)
     start_bid = models.DecimalField(
@@ -20,15 +42,60 @@ class Listing(models.Model):
         decimal_places=2
         )
     
-    category = models.TextField(max_length=50, default="thing")
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name="listings")
     description = models.TextField(max_length=500, default="")
     image_url = models.TextField(max_length=500, default="")
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    # auction state kept in sync by the write paths in services.py so the
+    # listing page doesn't need to query bids, comments and closes to render
+    highest_bidder = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="leading_listings"
+        )
+    bid_count = models.PositiveIntegerField(default=0)
+    bidder_count = models.PositiveIntegerField(default=0)
+    last_bid_at = models.DateTimeField(null=True, blank=True)
+    comment_count = models.PositiveIntegerField(default=0)
+    is_closed = models.BooleanField(default=False)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    # auctions without an end time stay open until the seller closes them
+    ends_at = models.DateTimeField(null=True, blank=True)
+    # bumped whenever what the listing card shows changes, part of the card cache key
+    version = models.PositiveIntegerField(default=1)
+    # last bid, comment, close or edit, served as Last-Modified by the api
+    modified = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # keyset pagination on the index and category grids, active listings first
+            models.Index(fields=["is_closed", "-id"], name="listing_active_idx"),
+            models.Index(fields=["category", "is_closed", "-id"], name="listing_category_idx"),
+            # the expiry job scans open listings by end time
+            models.Index(fields=["is_closed", "ends_at"], name="listing_expiry_idx"),
+            # a seller's listings on the dashboard, newest first
+            models.Index(fields=["user", "-id"], name="listing_seller_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
+    @property
+    def winner(self):
+        # with no bids the seller keeps the item, same as the old placeholder bid
+        return self.highest_bidder or self.user
+
+class ListingSequence(models.Model):
+    """
+    Hands out listing ids when listings are sharded, see sharding.allocate_listing_id.
+
+    Lives on default so ids stay unique and in creation order across shards.
+    """
+
 class Bid(models.Model):
     amount = models.DecimalField(
         max_digits=10,
@@ -36,25 +103,189 @@ class Bid(models.Model):
         )
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # top bids and bids over time on one listing, without scanning all its bids
+            models.Index(fields=["listing", "-amount"], name="bid_listing_amount_idx"),
+            models.Index(fields=["listing", "created"], name="bid_listing_created_idx"),
+            # place_bid checks whether this is the user's first bid on the listing,
+            # the watchlist reads each user's top bid straight off the index
+            models.Index(fields=["listing", "user", "-amount"], name="bid_listing_user_amount_idx"),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.amount}'
+
+class ProxyBid(models.Model):
+    """
+    The most a user is willing to pay for a listing, bid for them by the engine in services.py.
+
+    The maximum itself is never shown, only the Bid rows it leads to. Only
+    the leader's maximum can be above the current price, every other one has
+    been bid up to its limit and lost.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="proxy_bids")
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # ties between equal maximums go to whoever set theirs first
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # the two highest maximums of a listing, without reading the others
+            models.Index(fields=["listing", "-max_amount", "created"], name="proxy_bid_top_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["listing", "user"], name="proxy_bid_listing_user_uniq"),
+        ]
+
+    def __str__(self):
+        return f'{self.user} up to {self.max_amount} on {self.listing}'
+
+class PriceBucket(models.Model):
+    """
+    Price movement of a listing over one time bucket, for the price timeline.
+
+    Updated by place_bid with every bid. Bids only ever raise the price so
+    the opening price is also the low and the closing price the high.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="price_buckets")
+    start = models.DateTimeField()
+    open = models.DecimalField(max_digits=10, decimal_places=2)
+    close = models.DecimalField(max_digits=10, decimal_places=2)
+    bids = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["listing", "start"], name="price_bucket_listing_start_uniq"),
+        ]
 
     def __str__(self):
-        return f'{self.user} - {self.bid}'
+        return f'{self.listing} {self.start}: {self.open} - {self.close}'
 
 class Comment(models.Model):
     text = models.TextField(max_length=500, default="")
 
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.user} on {self.listing}'
 
 class Watchlist(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # the notification worker walks a listing's watchers in user order
+            models.Index(fields=["listing", "user"], name="watchlist_listing_user_idx"),
+        ]
+        constraints = [
+            # a listing is watched once, this is also the index the watchlist page walks
+            models.UniqueConstraint(fields=["user", "listing"], name="watchlist_user_listing_uniq"),
+        ]
+
     def __str__(self):
         return f'{self.user} - {self.listing}'
     
 class Closed(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
+    # who won and for how much, null winner means there were no bids
+    winner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    def __str__(self):
+        return f'closed {self.listing}'
+
+class OutboxEvent(models.Model):
+    """
+    A bid or close waiting to be turned into notifications.
+
+    Written in the same transaction as the Bid or Closed row, so an event is
+    only ever recorded for writes that committed. The send_notifications
+    worker fans them out and deletes them.
+    """
+    BID = "bid"
+    CLOSED = "closed"
+    KINDS = [(BID, "bid"), (CLOSED, "closed")]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    # set when a worker picks the event up, claims of crashed workers expire
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+class Notification(models.Model):
+    OUTBID = "outbid"
+    NEW_BID = "new_bid"
+    CLOSED = "closed"
+    KINDS = [(OUTBID, "outbid"), (NEW_BID, "new bid"), (CLOSED, "closed")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    message = models.CharField(max_length=200)
+    # repeats of an unread notification update it in place and bump count
+    count = models.PositiveIntegerField(default=1)
+    created = models.DateTimeField(default=timezone.now)
+    read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-id"], name="notification_inbox_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "listing", "kind"], condition=models.Q(read=False), name="notification_unread_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.message}'
+
+class SellerRollup(models.Model):
+    """
+    One seller's listings, bids and sales in one category, for the seller dashboard.
+
+    Kept up to date by the write paths in services.py in the same
+    transaction as the change, so the dashboard reads a few rows instead of
+    going over the seller's listings. rebuild_seller_rollups recomputes them.
+    """
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="rollups")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    listing_count = models.PositiveIntegerField(default=0)
+    active_count = models.PositiveIntegerField(default=0)
+    closed_count = models.PositiveIntegerField(default=0)
+    # closed with a winning bid, and what those bids add up to
+    sold_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    bid_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["seller", "category"], name="seller_rollup_uniq"),
+        ]
+
+    def __str__(self):
+        return f'{self.seller} in {self.category}'
+
+class ApiToken(models.Model):
+    """
+    A key for the json api, sent as "Authorization: Token <key>".
+
+    Only a hash of the key is kept, the key itself is shown once by
+    POST /api/v1/tokens. Requests carrying one need no session cookie and
+    so no csrf token either.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="api_tokens")
+    key_hash = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
-        return f'closed {self.listing}'
\ No newline at end of file
+        return f'api token for {self.user}'
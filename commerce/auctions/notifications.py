@@ -0,0 +1,149 @@
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Bid, Notification, OutboxEvent, User, Watchlist
+from .sharding import listing_databases, on_shard, with_users
+
+
+# outbox events a worker takes at once. a burst of bids on one listing
+# inside a batch is sent as a single notification with the latest price
+OUTBOX_BATCH = 200
+# recipients written per transaction, bidders get the write lock back in between
+RECIPIENT_CHUNK = 1000
+# claims older than this belong to a crashed worker and are picked up again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def claim_events(db, batch_size, now):
+    with transaction.atomic(using=db):
+        ids = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_TIMEOUT))
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        OutboxEvent.objects.filter(id__in=ids).update(claimed_at=now)
+    events = OutboxEvent.objects.filter(id__in=ids).select_related("listing").order_by("id")
+    return list(with_users(events, "listing__user", "actor"))
+
+
+def coalesce(events):
+    """The latest event per listing and kind, bids on listings that closed in the same batch are dropped."""
+    closed = {event.listing_id for event in events if event.kind == OutboxEvent.CLOSED}
+    latest = {}
+    for event in events:
+        if event.kind == OutboxEvent.BID and event.listing_id in closed:
+            continue
+        latest[(event.listing_id, event.kind)] = event
+    return list(latest.values())
+
+
+def deliver_notifications(batch_size=OUTBOX_BATCH, now=None):
+    """
+    Turn one batch of outbox events into notifications, returns how many events were handled.
+
+    Events are only deleted after their notifications are written, so a
+    worker that dies halfway leaves them to be claimed again. Sending an
+    event twice is harmless, the repeat is folded into the unread notification.
+    When sharded the outbox of every shard gets a batch of its own.
+    """
+    now = now or timezone.now()
+    handled = 0
+    for db in listing_databases():
+        with on_shard(db):
+            events = claim_events(db, batch_size, now)
+            if not events:
+                continue
+            for event in coalesce(events):
+                send_event(event)
+            OutboxEvent.objects.filter(id__in=[event.id for event in events]).delete()
+            handled += len(events)
+    return handled
+
+
+def send_event(event):
+    listing = event.listing
+    watchers = Watchlist.objects.filter(listing_id=listing.id)
+    bidders = Bid.objects.filter(listing_id=listing.id)
+
+    if event.kind == OutboxEvent.BID:
+        # earlier bidders are outbid, watchers who never bid just hear about it
+        fan_out(
+            listing, Notification.OUTBID, bidders,
+            f"you've been outbid on {listing.title}, it's now ${event.price}",
+            skip_user=event.actor_id,
+        )
+        fan_out(
+            listing, Notification.NEW_BID, watchers,
+            f"new bid of ${event.price} on {listing.title}",
+            skip_user=event.actor_id, skip_bidders=True,
+        )
+    else:
+        if event.actor_id:
+            message = f"{listing.title} closed, {event.actor} won at ${event.price}"
+        else:
+            message = f"{listing.title} closed with no bids"
+        fan_out(listing, Notification.CLOSED, bidders, message)
+        fan_out(listing, Notification.CLOSED, watchers, message, skip_bidders=True)
+
+
+def fan_out(listing, kind, rows, message, skip_user=None, skip_bidders=False):
+    """
+    Notify the users of rows (a listing's Watchlist or Bid queryset), RECIPIENT_CHUNK at a time.
+
+    rows are walked in user order on their (listing, user) index, so every
+    chunk is an index range scan however many watchers the listing has.
+    Users who still have an unread notification of this kind for the
+    listing get it updated in place (newest message, count + 1) instead of
+    a new row or another email. Returns how many users were notified.
+    """
+    notified = 0
+    last_id = 0
+    while True:
+        chunk = list(
+            rows.filter(user_id__gt=last_id).order_by("user_id")
+            .values_list("user_id", flat=True).distinct()[:RECIPIENT_CHUNK]
+        )
+        if not chunk:
+            break
+        last_id = chunk[-1]
+        skip = {skip_user}
+        if skip_bidders:
+            skip.update(Bid.objects.filter(
+                listing_id=listing.id, user_id__in=chunk
+            ).values_list("user_id", flat=True))
+        chunk = [user_id for user_id in chunk if user_id not in skip]
+        if not chunk:
+            continue
+        now = timezone.now()
+
+        with transaction.atomic():
+            unread = Notification.objects.filter(listing=listing, kind=kind, read=False, user_id__in=chunk)
+            repeats = set(unread.values_list("user_id", flat=True))
+            unread.update(message=message, count=F("count") + 1, created=now)
+            fresh = [user_id for user_id in chunk if user_id not in repeats]
+            Notification.objects.bulk_create(
+                [Notification(user_id=user_id, listing=listing, kind=kind, message=message, created=now)
+                 for user_id in fresh],
+                ignore_conflicts=True,
+            )
+
+        # users with an unread notification were already emailed about it. the users
+        # table isn't joined to rows, it's on another database when sharded
+        emails = User.objects.filter(id__in=fresh).exclude(email="").order_by("id").values_list("email", flat=True)
+        send_emails(list(emails), message)
+        notified += len(chunk)
+    return notified
+
+
+def send_emails(addresses, message):
+    if not addresses:
+        return
+    # one message per address so recipients don't see each other, over one connection
+    get_connection().send_messages([
+        EmailMessage(f"Auctions: {message}", message, to=[address]) for address in addresses
+    ])
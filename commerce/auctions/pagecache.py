@@ -0,0 +1,131 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+
+CACHE_ALIAS = "pages"
+# rendered pages are purged by their scopes, this only bounds what a missed purge (an admin edit) can serve
+PAGE_TTL = 10 * 60
+CACHE_CONTROL = "public, no-cache"
+
+# scopes, each a part of the data pages are rendered from. a page is cached under the
+# last change time of the scopes it shows, the write paths purge by bumping those
+INDEX = "index"
+CATEGORIES = "categories"
+
+
+def listing_scope(listing_id):
+    return f"listing:{listing_id}"
+
+
+def category_scope(category_id):
+    return f"category:{category_id}"
+
+
+def changed_key(scope):
+    return f"pages:changed:{scope}"
+
+
+def changed_at(scopes):
+    """scope -> when it last changed, in nanoseconds. Scopes the cache doesn't know start now."""
+    cache = caches[CACHE_ALIAS]
+    keys = {changed_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    now = time.time_ns()
+    for key in keys.keys() - found.keys():
+        # evicted or never purged, anything cached under the old time is unreachable from here on.
+        # a cache that keeps nothing (DummyCache) makes every request a change
+        found[key] = now if cache.add(key, now, None) else cache.get(key, now)
+    return {scope: found[key] for key, scope in keys.items()}
+
+
+def purge(*scopes):
+    """Mark scopes as changed, every cached page showing one of them is rendered again."""
+    now = time.time_ns()
+    caches[CACHE_ALIAS].set_many({changed_key(scope): now for scope in scopes}, None)
+
+
+def purge_listing(listing_id, category_id):
+    # what a bid or a close changes: the listing page and the grids showing its card
+    purge(listing_scope(listing_id), category_scope(category_id), INDEX)
+
+
+def is_anonymous(request):
+    # decided from the cookies alone, so a cache hit doesn't load a session. a pending
+    # flash message is in the messages cookie and shows up on the page
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES and CookieStorage.cookie_name not in request.COOKIES
+
+
+def cacheable(request, response):
+    # a page that used a csrf token or set a cookie belongs to this visitor only
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+    )
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        return etag in if_none_match
+    if_modified_since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def cache_anonymous(scopes):
+    """
+    Serve a GET view to anonymous visitors from the page cache, with ETag and Last-Modified.
+
+    scopes(request, *args, **kwargs) names the scopes the page is rendered
+    from (or returns None to render it as usual). The ETag is a hash of the
+    url and the last change of each scope, which is a couple of cache reads:
+    a revalidation with a matching If-None-Match is a 304 and a repeat visit
+    is a cache hit, neither touches the database. Logged in visitors, and
+    anyone with a pending message, get the page rendered for them.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            names = None
+            if request.method in ("GET", "HEAD") and is_anonymous(request):
+                names = scopes(request, *args, **kwargs)
+            if names is None:
+                response = view(request, *args, **kwargs)
+                patch_vary_headers(response, ("Cookie",))
+                return response
+
+            changed = changed_at(names)
+            key = f"{request.get_full_path()}|{sorted(changed.items())}"
+            digest = hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+            etag = f'"{digest}"'
+            last_modified = max(changed.values()) // 1_000_000_000
+
+            if not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+            else:
+                cache = caches[CACHE_ALIAS]
+                stored = cache.get(f"pages:{digest}")
+                if stored is not None:
+                    response = HttpResponse(stored[0], content_type=stored[1])
+                else:
+                    response = view(request, *args, **kwargs)
+                    if not cacheable(request, response):
+                        patch_vary_headers(response, ("Cookie",))
+                        return response
+                    cache.set(f"pages:{digest}", (response.content, response["Content-Type"]), PAGE_TTL)
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            response["Cache-Control"] = CACHE_CONTROL
+            patch_vary_headers(response, ("Cookie",))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,41 @@
+from .sharding import fan_out
+
+
+# number of listing cards shown per page on the grids
+PAGE_SIZE = 24
+
+
+def keyset_page(queryset, request, page_size=PAGE_SIZE, order="-id"):
+    """
+    Return one page of a queryset, newest first, and the query string for the next page.
+
+    Pages are keyed on id (ids are handed out in creation order) instead of
+    OFFSET, so every page is an index range scan no matter how deep you go.
+    The cursor is passed back as ?before=<id>. order can name another column
+    holding the same value as id, like the listing_id of a joined row whose
+    index the database can walk in order without sorting.
+    """
+    queryset = queryset.order_by(order)
+
+    try:
+        before = int(request.GET.get("before", ""))
+    except ValueError:
+        before = None
+    if before is not None:
+        queryset = queryset.filter(id__lt=before)
+
+    # fetch one extra row to know whether there is a next page without a COUNT,
+    # from every shard when the listings are sharded
+    items = fan_out(queryset, page_size + 1)
+    if len(items) <= page_size:
+        return items, None
+
+    items = items[:page_size]
+    params = request.GET.copy()
+    params["before"] = items[-1].id
+    return items, params.urlencode()
+
+
+def show_closed(request):
+    # grids only show active auctions unless ?all=1 is passed
+    return request.GET.get("all") == "1"
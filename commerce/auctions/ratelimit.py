@@ -0,0 +1,40 @@
+import math
+import time
+
+from django.core.cache import caches
+
+
+class TokenBucket:
+    """
+    Per-key token bucket kept in a cache, e.g. TokenBucket("comments", capacity=5, rate=5 / 60).
+
+    A key can spend up to capacity tokens in a burst and gets rate tokens
+    back per second. The state is one small cache entry per key that
+    expires once the bucket would be full again, so idle keys cost nothing.
+    Reads and writes aren't atomic, two requests racing on one key can both
+    take the last token. That's fine for throttling floods.
+    """
+
+    def __init__(self, name, capacity, rate, cache_alias="default"):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self.cache_alias = cache_alias
+
+    def key(self, key):
+        return f"ratelimit:{self.name}:{key}"
+
+    def allow(self, key, cost=1):
+        """Take cost tokens for key, returns False (and takes nothing) if there aren't enough."""
+        cache = caches[self.cache_alias]
+        now = time.time()
+        tokens, updated = cache.get(self.key(key), (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        cache.set(self.key(key), (tokens, now), math.ceil(self.capacity / self.rate))
+        return allowed
+
+    def reset(self, key):
+        caches[self.cache_alias].delete(self.key(key))
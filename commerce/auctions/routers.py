@@ -0,0 +1,50 @@
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+
+REPLICA = "replica"
+
+# set while a view decorated with @use_replica is running
+_read_only = ContextVar("auctions_read_only", default=False)
+
+
+def use_replica(view):
+    """Send this view's reads to the replica database, when one is configured."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_only.reset(token)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    """
+    Routes reads made inside @use_replica views to the "replica" alias.
+
+    Everything else, and every write, stays on default. Without a replica
+    configured this router changes nothing.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _read_only.get() or REPLICA not in settings.DATABASES:
+            return None
+        # sessions and users stay on default so a fresh login isn't lost to replica lag
+        if model._meta.app_label != "auctions" or model._meta.label == settings.AUTH_USER_MODEL:
+            return None
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is a copy of default, it's never migrated directly
+        return db != REPLICA
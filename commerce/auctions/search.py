@@ -0,0 +1,201 @@
+import heapq
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import Category, Listing
+from .sharding import listing_databases, shards
+
+
+# results per page on the search page
+SEARCH_PAGE_SIZE = 24
+# deepest page we'll serve, ranked results can't be keyset paginated cheaply
+SEARCH_MAX_PAGE = 50
+
+WORD_RE = re.compile(r"\w+")
+
+# the index and its ranking, as created by migration 0013. migrations don't run
+# on shards, ensure_index_triggers creates them there
+INDEX_TABLE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS auctions_listing_fts USING fts5(
+        title, description, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    "INSERT INTO auctions_listing_fts(auctions_listing_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0)')",
+]
+
+# triggers can only read tables of their own database, and categories live on
+# default. each shard keeps a copy of the category names for them, see mirror_category
+CATEGORY_NAMES = "auctions_listing_fts_category"
+CATEGORY_NAMES_TABLE = f"CREATE TABLE IF NOT EXISTS {CATEGORY_NAMES} (id integer PRIMARY KEY, name text NOT NULL)"
+
+# same triggers as migration 0013. sqlite drops them whenever a migration
+# rebuilds auctions_listing, so they are recreated after every migrate
+INDEX_TRIGGERS = {
+    "auctions_listing_fts_insert": """
+        CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_insert AFTER INSERT ON auctions_listing BEGIN
+            INSERT INTO auctions_listing_fts(rowid, title, description, category)
+            SELECT new.id, new.title, new.description, name FROM {categories} WHERE id = new.category_id;
+        END
+    """,
+    "auctions_listing_fts_update": """
+        CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_update
+        AFTER UPDATE OF title, description, category_id ON auctions_listing BEGIN
+            DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+            INSERT INTO auctions_listing_fts(rowid, title, description, category)
+            SELECT new.id, new.title, new.description, name FROM {categories} WHERE id = new.category_id;
+        END
+    """,
+    "auctions_listing_fts_delete": """
+        CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_delete AFTER DELETE ON auctions_listing BEGIN
+            DELETE FROM auctions_listing_fts WHERE rowid = old.id;
+        END
+    """,
+}
+
+
+def categories_table(using):
+    # the table the triggers and rebuild_index read category names from
+    return CATEGORY_NAMES if using in shards() else "auctions_category"
+
+
+def match_expression(query):
+    """
+    Turn what the user typed into a safe fts5 MATCH expression.
+
+    Every word becomes a quoted prefix term so "desk lam" finds "desk lamp",
+    and quotes, operators or column filters typed by the user can't break the
+    query. Returns None if there is nothing to search for.
+    """
+    words = WORD_RE.findall(query.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words[:10])
+
+
+def search_listings(query, category=None, min_price=None, max_price=None,
+                    include_closed=False, page=1, page_size=SEARCH_PAGE_SIZE):
+    """
+    Return (listings, has_next) for one page of ranked search results.
+
+    Matching and bm25 ranking happen inside the fts5 index and only the ids
+    of one page come back, the Listing rows are then fetched by primary key.
+    When sharded each shard ranks its own listings and the best of all of
+    them make the page (bm25 weighs terms by each shard's own counts, close
+    enough with listings spread evenly).
+    """
+    match = match_expression(query)
+    if match is None:
+        return [], False
+
+    sql = [
+        "SELECT l.id, f.rank FROM auctions_listing_fts f",
+        "JOIN auctions_listing l ON l.id = f.rowid",
+        "WHERE auctions_listing_fts MATCH %s",
+    ]
+    params = [match]
+    if not include_closed:
+        sql.append("AND l.is_closed = 0")
+    if category is not None:
+        sql.append("AND l.category_id = %s")
+        params.append(category.id)
+    if min_price is not None:
+        sql.append("AND l.current_price >= %s")
+        params.append(str(min_price))
+    if max_price is not None:
+        sql.append("AND l.current_price <= %s")
+        params.append(str(max_price))
+    sql.append("ORDER BY f.rank LIMIT %s OFFSET %s")
+
+    databases = listing_databases()
+    offset = (page - 1) * page_size
+    # one extra row tells us if there is a next page. the page of every shard
+    # could be anywhere in the merged ranking, so shards skip nothing
+    limit, skip = (page_size + 1, offset) if len(databases) == 1 else (offset + page_size + 1, 0)
+    ranked = []
+    for using in databases:
+        with connections[using].cursor() as cursor:
+            cursor.execute(" ".join(sql), params + [limit, skip])
+            ranked.append([(rank, listing_id, using) for listing_id, rank in cursor.fetchall()])
+    hits = list(heapq.merge(*ranked))
+    if len(databases) > 1:
+        hits = hits[offset:]
+
+    has_next = len(hits) > page_size
+    hits = hits[:page_size]
+    found = {}
+    for using in databases:
+        found.update(Listing.objects.using(using).in_bulk([i for _, i, db in hits if db == using]))
+    return [found[i] for _, i, _ in hits if i in found], has_next
+
+
+def sync_categories(using):
+    """Copy the category names from default into a shard's table for the search triggers."""
+    if "auctions_category" not in connections[DEFAULT_DB_ALIAS].introspection.table_names():
+        # default isn't migrated yet, mirror_category fills the names in as categories are made
+        return
+    names = list(Category.objects.using(DEFAULT_DB_ALIAS).values_list("id", "name"))
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {CATEGORY_NAMES}")
+        cursor.executemany(f"INSERT INTO {CATEGORY_NAMES}(id, name) VALUES (%s, %s)", names)
+
+
+def mirror_category(sender, instance, raw=False, **kwargs):
+    """post_save hook for Category, a new or renamed category reaches the search triggers of every shard."""
+    for using in shards():
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {CATEGORY_NAMES}(id, name) VALUES (%s, %s) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+                [instance.id, instance.name],
+            )
+
+
+def rebuild_index(using=None):
+    """Repopulate the search index from scratch in a couple of bulk statements, on every shard without using."""
+    if using is None:
+        return sum(rebuild_index(using) for using in listing_databases())
+    with transaction.atomic(using):
+        if using in shards():
+            sync_categories(using)
+        with connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM auctions_listing_fts")
+            cursor.execute(
+                "INSERT INTO auctions_listing_fts(rowid, title, description, category) "
+                "SELECT l.id, l.title, l.description, c.name "
+                f"FROM auctions_listing l JOIN {categories_table(using)} c ON c.id = l.category_id"
+            )
+            count = cursor.rowcount
+            # merge the index b-trees so queries touch as few pages as possible
+            cursor.execute("INSERT INTO auctions_listing_fts(auctions_listing_fts) VALUES ('optimize')")
+    return count
+
+
+def ensure_index_triggers(using="default", **kwargs):
+    """
+    post_migrate hook, puts back search triggers a table rebuild dropped.
+
+    Rows written while the triggers were missing aren't in the index, so it
+    is rebuilt whenever a trigger had to be recreated. Shards, which
+    migrations only give the sharded tables, get the index itself here too.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if using in shards():
+            cursor.execute(CATEGORY_NAMES_TABLE)
+            for statement in INDEX_TABLE:
+                cursor.execute(statement)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'auctions_listing_fts'")
+        if cursor.fetchone() is None:
+            # migrated back to before the search index existed
+            return
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [name for name in INDEX_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(INDEX_TRIGGERS[name].format(categories=categories_table(using)))
+    if missing:
+        rebuild_index(using)
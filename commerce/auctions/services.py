@@ -0,0 +1,683 @@
+import random
+import time
+from bisect import bisect_right
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, TruncHour
+from django.utils import timezone
+
+from . import pagecache, sharding
+from .events import publish
+from .images import warm_thumbnails
+from .models import Bid, Category, Closed, Comment, Listing, OutboxEvent, PriceBucket, ProxyBid, SellerRollup, User
+from .ratelimit import TokenBucket
+from .sharding import listing_databases, listing_db, with_users
+
+
+# how many times to retry a bid when sqlite reports the database as locked
+BID_RETRIES = 5
+# base delay in seconds for the exponential backoff between retries
+BID_BACKOFF = 0.01
+CENT = Decimal("0.01")
+# the most a price column (max_digits=10, decimal_places=2) can hold
+MAX_PRICE = Decimal("99999999.99")
+# cache key for the category directory shown on the categories page
+CATEGORY_DIRECTORY_KEY = "auctions:category_directory"
+
+
+# longest auction a seller can pick when creating a listing
+MAX_AUCTION_DAYS = 30
+
+# sellers whose rollups are rebuilt per transaction by rebuild_seller_rollups
+ROLLUP_BATCH = 500
+
+# a burst of 5 comments, then one every 12 seconds per user
+comment_limit = TokenBucket("comments", capacity=5, rate=1 / 12)
+
+
+class BidRejected(Exception):
+    """Raised when a bid can't be placed, the message is safe to show the user."""
+
+
+class ListingInvalid(Exception):
+    """Raised by clean_listing, the message is safe to show the user."""
+
+
+class CommentRejected(Exception):
+    """Raised by add_comment when a user comments too fast, the message is safe to show."""
+
+
+def clean_listing(title, description, category, start_bid, image_url, duration_days=""):
+    """
+    Validate the fields of a new listing, shared by the create form and bulk import.
+
+    Returns the cleaned values as keyword arguments for Listing, with the
+    category still as a name. Raises ListingInvalid.
+    """
+    title = (title or "").strip()
+    category = (category or "").strip()
+    start_bid = (start_bid or "").strip()
+    duration_days = (duration_days or "").strip()
+
+    if title == "":
+        raise ListingInvalid("title cannot be blank")
+    if len(title) > Listing._meta.get_field("title").max_length:
+        raise ListingInvalid("title is too long")
+    if category == "":
+        raise ListingInvalid("category cannot be blank")
+
+    if start_bid == "":
+        start_bid = CENT
+    else:
+        try:
+            start_bid = Decimal(start_bid)
+        except ArithmeticError:
+            raise ListingInvalid("an issue with the starting bid format")
+        if not start_bid.is_finite() or not CENT <= start_bid <= MAX_PRICE:
+            raise ListingInvalid("an issue with the starting bid format")
+        start_bid = start_bid.quantize(CENT)
+
+    #optional auction length, closed automatically by the close_expired_auctions job
+    ends_at = None
+    if duration_days != "":
+        if not duration_days.isdigit() or not 1 <= int(duration_days) <= MAX_AUCTION_DAYS:
+            raise ListingInvalid(f"duration must be between 1 and {MAX_AUCTION_DAYS} days")
+        ends_at = timezone.now() + timedelta(days=int(duration_days))
+
+    return {
+        "title": title,
+        "description": description or "",
+        "category": category,
+        "start_bid": start_bid,
+        "current_price": start_bid,
+        "image_url": (image_url or "").strip(),
+        "ends_at": ends_at,
+    }
+
+
+def clean_amount(amount):
+    """A bid amount from user input as Decimal cents, raises BidRejected if it isn't one."""
+    try:
+        amount = Decimal(amount)
+    except (TypeError, ValueError, ArithmeticError):
+        raise BidRejected("invalid bid")
+
+    if not amount.is_finite() or amount <= 0:
+        raise BidRejected("Enter a valid bid greater than zero.")
+    if amount > MAX_PRICE:
+        raise BidRejected("invalid bid")
+    # prices are stored in cents
+    return amount.quantize(CENT)
+
+
+def bid_increment(price):
+    """How far a max bid goes over the price it has to beat, from AUCTIONS_BID_INCREMENTS."""
+    tiers = settings.AUCTIONS_BID_INCREMENTS
+    tier = bisect_right([Decimal(start) for start, _ in tiers], price) - 1
+    return Decimal(tiers[max(tier, 0)][1])
+
+
+def minimum_bid(listing):
+    """The lowest maximum someone other than the leader can set: the start bid, then an increment over the price."""
+    if listing.highest_bidder_id is None:
+        return listing.start_bid
+    return listing.current_price + bid_increment(listing.current_price)
+
+
+def retry_locked(attempt):
+    """Run attempt, again with backoff while sqlite reports the database as locked."""
+    for retry in range(BID_RETRIES):
+        try:
+            return attempt()
+        except OperationalError as e:
+            # sqlite raises "database is locked" when another writer holds the lock
+            if "locked" not in str(e) or retry == BID_RETRIES - 1:
+                raise
+            time.sleep(BID_BACKOFF * (2 ** retry) * (1 + random.random()))
+
+
+def record_bid(listing, user, amount, now):
+    """Insert a visible bid and its timeline bucket, part of the caller's transaction."""
+    # checked while holding the write lock, so two first bids can't both count
+    if not Bid.objects.filter(listing=listing, user=user).exists():
+        Listing.objects.filter(id=listing.id).update(bidder_count=F("bidder_count") + 1)
+    bid = Bid.objects.create(amount=amount, listing=listing, user=user, created=now)
+    record_price(listing.id, now, amount)
+    update_rollup(listing.user_id, listing.category_id, bid_count=1)
+    return bid
+
+
+def announce_bid(listing, user, amount, now):
+    # one row however many people watch, the send_notifications worker does the fan-out
+    OutboxEvent.objects.create(kind=OutboxEvent.BID, listing=listing, actor=user, price=amount, created=now)
+
+    def after_commit():
+        pagecache.purge_listing(listing.id, listing.category_id)
+        publish(listing.id, "bid", price=str(amount), bidder=user.username)
+    transaction.on_commit(after_commit, using=listing_db(listing))
+
+
+def resolve_proxies(listing, leader, price, now):
+    """
+    Bid the max bids on a listing against each other, part of the caller's transaction.
+
+    leader and price are the listing's highest bidder and price as they are
+    now (no leader and the start bid before the first bid). Once resolved
+    every maximum but the leader's is at or below the price, so only the two
+    highest can change anything and they come off proxy_bid_top_idx: one
+    index lookup however many max bids a listing has. The winner pays one
+    increment over whatever it had to beat, capped at its own maximum, and at
+    most two Bid rows are written: the runner-up at its maximum and the
+    winner at the new price. Returns the new (leader, price).
+    """
+    top = list(
+        with_users(ProxyBid.objects.filter(listing_id=listing.id), "user")
+        .order_by("-max_amount", "created", "id")[:2]
+    )
+    if not top:
+        return leader, price
+    first = top[0]
+    leader_id = leader.id if leader is not None else None
+    if leader_id is not None and first.user_id != leader_id and first.max_amount < price:
+        # the leader's bid is above every maximum. a plain bid equal to the top maximum
+        # came later and loses the tie, the maximum takes the lead at that price below
+        return leader, price
+
+    # a runner-up still above the price bids up to its maximum
+    runner_up = None
+    if len(top) > 1 and (leader_id is None or top[1].max_amount > price):
+        runner_up = top[1]
+    rival = runner_up.max_amount if runner_up is not None else None
+    if leader_id is not None and leader_id != first.user_id:
+        # a plain bid the top maximum has to beat
+        rival = price if rival is None else max(rival, price)
+
+    if rival is None:
+        if leader_id == first.user_id:
+            # the leader raised its own maximum, the price stays
+            return leader, price
+        # the first bid on the listing opens at the start bid
+        new_price = price
+    else:
+        new_price = max(price, min(first.max_amount, rival + bid_increment(rival)))
+
+    bids = 0
+    if runner_up is not None:
+        record_bid(listing, runner_up.user, runner_up.max_amount, now)
+        bids += 1
+    record_bid(listing, first.user, new_price, now)
+    bids += 1
+    Listing.objects.filter(id=listing.id).update(
+        current_price=new_price,
+        highest_bidder=first.user,
+        bid_count=F("bid_count") + bids,
+        version=F("version") + 1,
+        modified=now,
+        last_bid_at=now,
+    )
+    return first.user, new_price
+
+
+def place_bid(listing, user, amount):
+    """
+    Place a bid on a listing and return the saved Bid.
+
+    The price check and the price update are a single conditional UPDATE on
+    Listing.current_price (compare-and-set), so two bidders racing on the same
+    listing can never both win with stale prices. The Bid insert happens in
+    the same short transaction, as does the answer of any max bid above it.
+    Raises BidRejected if the bid is invalid or was beaten by a concurrent bid.
+    """
+    amount = clean_amount(amount)
+    if amount < listing.start_bid:
+        raise BidRejected("your bid isn't higher than the minimum bid")
+
+    def attempt():
+        with sharding.atomic(listing_db(listing)):
+            # only succeeds if nobody has bid this amount or higher in the meantime
+            now = timezone.now()
+            updated = Listing.objects.filter(
+                Q(ends_at__isnull=True) | Q(ends_at__gt=now),
+                id=listing.id,
+                current_price__lt=amount,
+                is_closed=False,
+            ).update(
+                current_price=amount,
+                highest_bidder=user,
+                bid_count=F("bid_count") + 1,
+                version=F("version") + 1,
+                modified=now,
+                last_bid_at=now,
+            )
+
+            if not updated:
+                return None
+
+            bid = record_bid(listing, user, amount, now)
+            # a higher max bid answers straight away
+            leader, price = resolve_proxies(listing, user, amount, now)
+            announce_bid(listing, leader, price, now)
+            return bid, leader, price
+
+    placed = retry_locked(attempt)
+    if placed is not None:
+        bid, listing.highest_bidder, listing.current_price = placed
+        return bid
+
+    # the update matched nothing, work out why for the error message
+    listing.refresh_from_db(fields=["current_price", "is_closed", "ends_at"])
+    if listing.is_closed:
+        raise BidRejected("this auction is closed")
+    if listing.ends_at is not None and listing.ends_at <= timezone.now():
+        raise BidRejected("this auction has ended")
+    raise BidRejected("your bid must be higher than the highest bid")
+
+
+def place_max_bid(listing, user, max_amount):
+    """
+    Set the most user will pay for a listing and bid for them up to it, returns the ProxyBid.
+
+    The price only goes one increment over the runner-up, so setting a high
+    maximum early is safe. Setting one again replaces it, the leader can only
+    raise theirs. Raises BidRejected like place_bid.
+    """
+    max_amount = clean_amount(max_amount)
+
+    def attempt():
+        with sharding.atomic(listing_db(listing)):
+            now = timezone.now()
+            # the write lock is held from here (an IMMEDIATE transaction on sqlite, the row lock elsewhere)
+            # so nothing changes the price between this read and the resolve
+            state = with_users(Listing.objects.select_for_update(of=("self",)), "highest_bidder").get(id=listing.id)
+            if state.is_closed:
+                raise BidRejected("this auction is closed")
+            if state.ends_at is not None and state.ends_at <= now:
+                raise BidRejected("this auction has ended")
+
+            if state.highest_bidder_id == user.id:
+                current = ProxyBid.objects.filter(listing=state, user=user).values_list("max_amount", flat=True).first()
+                if max_amount <= (current or state.current_price):
+                    raise BidRejected("you're already the highest bidder, a new maximum has to be higher")
+            elif max_amount < minimum_bid(state):
+                raise BidRejected(f"your maximum bid must be at least ${minimum_bid(state)}")
+
+            proxy, _ = ProxyBid.objects.update_or_create(
+                listing=state, user=user, defaults={"max_amount": max_amount, "created": now}
+            )
+            leader, price = resolve_proxies(state, state.highest_bidder, state.current_price, now)
+            if leader != state.highest_bidder or price != state.current_price:
+                announce_bid(state, leader, price, now)
+            return proxy, leader, price
+
+    proxy, listing.highest_bidder, listing.current_price = retry_locked(attempt)
+    return proxy
+
+
+def bucket_start(moment):
+    # price timeline buckets are one hour wide, in UTC
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def record_price(listing_id, moment, amount):
+    """
+    Add a bid to the listing's price timeline bucket, creating the bucket if needed.
+
+    Called inside place_bid's transaction after the price update, which
+    serializes bids on the listing, so the update-or-create can't race.
+    """
+    start = bucket_start(moment)
+    updated = PriceBucket.objects.filter(listing_id=listing_id, start=start).update(
+        close=amount, bids=F("bids") + 1
+    )
+    if not updated:
+        PriceBucket.objects.create(listing_id=listing_id, start=start, open=amount, close=amount, bids=1)
+
+
+def rebuild_bid_stats():
+    """
+    Recompute bidder counts, last bid times and price timelines from the bids.
+
+    place_bid keeps these up to date one bid at a time, this is for repairs
+    and bids loaded outside of it. Everything is done with a few set-based
+    statements.
+    """
+    bids = Bid.objects.filter(listing=OuterRef("pk")).order_by().values("listing")
+    # one database at a time when sharded, bids are stored with their listing
+    for db in listing_databases():
+        with sharding.atomic(db):
+            Listing.objects.update(
+                bidder_count=Coalesce(Subquery(bids.annotate(n=Count("user", distinct=True)).values("n")), 0),
+                last_bid_at=Subquery(bids.annotate(last=Max("created")).values("last")),
+            )
+
+            PriceBucket.objects.all().delete()
+            buckets = (
+                Bid.objects.annotate(start=TruncHour("created", tzinfo=dt_timezone.utc))
+                .order_by()
+                .values("listing_id", "start")
+                .annotate(open=Min("amount"), close=Max("amount"), bids=Count("id"))
+            )
+            PriceBucket.objects.bulk_create(
+                (PriceBucket(**bucket) for bucket in buckets.iterator()), batch_size=1000
+            )
+
+
+def close_listing(listing):
+    """
+    Close an auction, returns False if it was already closed.
+
+    The closed flag is flipped with a conditional update so closing twice
+    (double click, two tabs) only records one Closed row.
+    """
+    db = listing_db(listing)
+    with sharding.atomic(db):
+        closed_at = timezone.now()
+        updated = Listing.objects.filter(id=listing.id, is_closed=False).update(
+            is_closed=True, closed_at=closed_at, version=F("version") + 1, modified=closed_at
+        )
+        if not updated:
+            return False
+        # read back under the write lock, no bid can sneak in after this
+        winner_id, price = Listing.objects.values_list("highest_bidder_id", "current_price").get(id=listing.id)
+        # the caller's copy may predate the last bid, listing.winner is shown and published from it
+        listing.highest_bidder_id, listing.current_price = winner_id, price
+        Closed.objects.create(listing=listing, winner_id=winner_id, price=price)
+        OutboxEvent.objects.create(
+            kind=OutboxEvent.CLOSED, listing=listing, actor_id=winner_id, price=price, created=closed_at
+        )
+        Category.objects.filter(id=listing.category_id).update(active_count=F("active_count") - 1)
+        sold = winner_id is not None
+        update_rollup(
+            listing.user_id, listing.category_id, active_count=-1, closed_count=1,
+            sold_count=int(sold), revenue=price if sold else 0,
+        )
+        transaction.on_commit(invalidate_category_directory, using=db)
+        transaction.on_commit(lambda: pagecache.purge_listing(listing.id, listing.category_id), using=db)
+        transaction.on_commit(lambda: publish(listing.id, "closed", winner=str(listing.winner)), using=db)
+
+    listing.is_closed = True
+    listing.closed_at = closed_at
+    return True
+
+
+def close_expired(now=None, batch_size=500):
+    """
+    Close one batch of auctions past their end time, returns how many were closed.
+
+    Each batch is a handful of set-based statements in one short transaction:
+    one update flips the listings, one query reads the winners (kept on the
+    listing by place_bid, no per-listing bid lookups), one bulk insert records
+    them, and the category counts are adjusted per category. Call it in a loop
+    until it returns 0, bidders get the write lock back between batches.
+    When sharded every shard closes a batch of its own.
+    """
+    now = now or timezone.now()
+    return sum(close_expired_on(db, now, batch_size) for db in listing_databases())
+
+
+def close_expired_on(db, now, batch_size):
+    with sharding.atomic(db):
+        # skip_locked lets several workers share the backlog on databases with row locks
+        ids = list(
+            Listing.objects.select_for_update(skip_locked=True)
+            .filter(is_closed=False, ends_at__lte=now)
+            .order_by("ends_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+
+        Listing.objects.filter(id__in=ids, is_closed=False).update(
+            is_closed=True, closed_at=now, version=F("version") + 1, modified=now
+        )
+        closed = list(
+            Listing.objects.filter(id__in=ids, closed_at=now).values(
+                "id", "highest_bidder_id", "user_id", "current_price", "category_id",
+            )
+        )
+        Closed.objects.bulk_create([
+            Closed(listing_id=row["id"], winner_id=row["highest_bidder_id"], price=row["current_price"])
+            for row in closed
+        ])
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(
+                kind=OutboxEvent.CLOSED, listing_id=row["id"], actor_id=row["highest_bidder_id"],
+                price=row["current_price"], created=now,
+            )
+            for row in closed
+        ])
+
+        per_category = Counter(row["category_id"] for row in closed)
+        for category_id, count in per_category.items():
+            Category.objects.filter(id=category_id).update(active_count=F("active_count") - count)
+
+        # one rollup update per seller and category, not per listing
+        rollups = {}
+        for row in closed:
+            totals = rollups.setdefault((row["user_id"], row["category_id"]), Counter())
+            totals["closed_count"] += 1
+            if row["highest_bidder_id"] is not None:
+                totals["sold_count"] += 1
+                totals["revenue"] += row["current_price"]
+        for (seller_id, category_id), totals in rollups.items():
+            update_rollup(seller_id, category_id, active_count=-totals["closed_count"], **totals)
+
+        def after_commit():
+            invalidate_category_directory()
+            pagecache.purge(
+                pagecache.INDEX,
+                *(pagecache.listing_scope(row["id"]) for row in closed),
+                *(pagecache.category_scope(category_id) for category_id in per_category),
+            )
+            # no bids means the seller keeps it, same as Listing.winner
+            winners = {row["id"]: row["highest_bidder_id"] or row["user_id"] for row in closed}
+            names = dict(User.objects.filter(id__in=set(winners.values())).values_list("id", "username"))
+            for listing_id, winner_id in winners.items():
+                publish(listing_id, "closed", winner=names.get(winner_id))
+        transaction.on_commit(after_commit, using=db)
+
+    return len(closed)
+
+
+def add_comment(listing, user, text):
+    """
+    Save a comment and bump the listing's comment count in one transaction.
+
+    Raises CommentRejected when the user is over the comment rate limit, a
+    flood is turned away before it costs a database write.
+    """
+    if not comment_limit.allow(user.id):
+        raise CommentRejected("you're commenting too fast, wait a bit and try again")
+    db = listing_db(listing)
+    with sharding.atomic(db):
+        comment = Comment.objects.create(text=text, listing=listing, user=user)
+        Listing.objects.filter(id=listing.id).update(
+            comment_count=F("comment_count") + 1, modified=timezone.now()
+        )
+        transaction.on_commit(lambda: pagecache.purge(pagecache.listing_scope(listing.id)), using=db)
+        transaction.on_commit(lambda: publish(
+            listing.id, "comment", text=text, user=user.username
+        ), using=db)
+    return comment
+
+
+def add_listing(listing):
+    """Save a new listing and count it in its category."""
+    if sharding.shards() and listing.id is None:
+        # the id picks the shard, so it's handed out before the insert
+        listing.id = sharding.allocate_listing_id()
+    db = listing_db(listing)
+    with sharding.atomic(db):
+        listing.save(using=db, force_insert=bool(sharding.shards()))
+        Category.objects.filter(id=listing.category_id).update(
+            listing_count=F("listing_count") + 1,
+            active_count=F("active_count") + (0 if listing.is_closed else 1),
+        )
+        update_rollup(
+            listing.user_id, listing.category_id, listing_count=1,
+            active_count=0 if listing.is_closed else 1, closed_count=1 if listing.is_closed else 0,
+        )
+        transaction.on_commit(invalidate_category_directory, using=db)
+        transaction.on_commit(
+            lambda: pagecache.purge(pagecache.category_scope(listing.category_id), pagecache.INDEX), using=db
+        )
+        transaction.on_commit(lambda: warm_thumbnails(listing.image_url), using=db)
+    return listing
+
+
+def recategorize(listing, category):
+    """Move a listing to another category, shifting the counts with it."""
+    db = listing_db(listing)
+    with sharding.atomic(db):
+        state = Listing.objects.values(
+            "category_id", "user_id", "is_closed", "highest_bidder_id", "current_price", "bid_count"
+        ).get(id=listing.id)
+        old_category_id = state["category_id"]
+        if old_category_id == category.id:
+            return
+        Listing.objects.filter(id=listing.id).update(category=category)
+
+        # is_closed as read under the lock, the caller's listing may be older than a close
+        active = 0 if state["is_closed"] else 1
+        Category.objects.filter(id=old_category_id).update(
+            listing_count=F("listing_count") - 1, active_count=F("active_count") - active
+        )
+        Category.objects.filter(id=category.id).update(
+            listing_count=F("listing_count") + 1, active_count=F("active_count") + active
+        )
+
+        # the listing takes its share of the seller's rollup with it
+        sold = state["is_closed"] and state["highest_bidder_id"] is not None
+        share = {
+            "listing_count": 1,
+            "active_count": active,
+            "closed_count": 1 if state["is_closed"] else 0,
+            "sold_count": int(sold),
+            "revenue": state["current_price"] if sold else 0,
+            "bid_count": state["bid_count"],
+        }
+        update_rollup(state["user_id"], old_category_id, **{field: -value for field, value in share.items()})
+        update_rollup(state["user_id"], category.id, **share)
+        transaction.on_commit(invalidate_category_directory, using=db)
+        transaction.on_commit(lambda: pagecache.purge(
+            pagecache.listing_scope(listing.id), pagecache.category_scope(old_category_id),
+            pagecache.category_scope(category.id), pagecache.INDEX,
+        ), using=db)
+    listing.category = category
+
+
+def update_rollup(seller_id, category_id, **deltas):
+    """
+    Add deltas to a seller's rollup for a category, creating the row on first use.
+
+    Called inside the transaction of the write it counts, which holds the
+    write lock, so the update-or-create can't race (see record_price).
+    Counts stop at zero: a row that missed listings (written while sharded,
+    where the migration can't backfill, until rebuild_seller_rollups runs)
+    is short rather than failing the close or recategorize it counts.
+    """
+    changes = {
+        field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, Value(type(delta)(0)))
+        for field, delta in deltas.items() if delta
+    }
+    if not changes:
+        return
+    updated = SellerRollup.objects.filter(seller_id=seller_id, category_id=category_id).update(**changes)
+    if not updated:
+        # no row yet can also mean listings the rollups missed, rebuild_seller_rollups
+        # counts those, here they'd only make the counts negative
+        SellerRollup.objects.create(
+            seller_id=seller_id, category_id=category_id, **{field: max(delta, 0) for field, delta in deltas.items()}
+        )
+
+
+def seller_rollups(seller_id):
+    """
+    The seller dashboard numbers: totals and a row per category, from the rollups alone.
+
+    Returns (totals, categories), categories are dicts ordered by revenue.
+    """
+    fields = ["listing_count", "active_count", "closed_count", "sold_count", "revenue", "bid_count"]
+    categories = list(
+        SellerRollup.objects.filter(seller_id=seller_id, listing_count__gt=0)
+        .order_by("-revenue", "category__name")
+        .values("category__slug", "category__name", *fields)
+    )
+    totals = {field: sum(row[field] for row in categories) for field in fields}
+    totals["revenue"] = Decimal(totals["revenue"]).quantize(CENT)
+    return totals, categories
+
+
+def rebuild_seller_rollups(batch_size=ROLLUP_BATCH, progress=None):
+    """
+    Recompute every seller's rollups from their listings, returns how many sellers were rebuilt.
+
+    Sellers are walked in id order batch_size at a time, each batch in its
+    own transaction: one grouped query per listing database over the
+    seller index, then the batch's rows are replaced. Memory stays flat
+    however many listings there are, and writers get the lock back
+    between batches. progress(sellers) is called after every batch.
+    """
+    rebuilt = 0
+    last_id = 0
+    while True:
+        seller_ids = list(
+            User.objects.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        if not seller_ids:
+            return rebuilt
+        last_id = seller_ids[-1]
+
+        sold = Q(is_closed=True, highest_bidder__isnull=False)
+        rollups = {}
+        with transaction.atomic():
+            for db in listing_databases():
+                rows = (
+                    Listing.objects.using(db).filter(user_id__in=seller_ids)
+                    .order_by().values("user_id", "category_id")
+                    .annotate(
+                        listing_count=Count("id"),
+                        active_count=Count("id", filter=Q(is_closed=False)),
+                        closed_count=Count("id", filter=Q(is_closed=True)),
+                        sold_count=Count("id", filter=sold),
+                        revenue=Coalesce(Sum("current_price", filter=sold), Decimal(0)),
+                        bid_count=Sum("bid_count"),
+                    )
+                )
+                for row in rows:
+                    key = (row.pop("user_id"), row.pop("category_id"))
+                    rollup = rollups.setdefault(key, SellerRollup(seller_id=key[0], category_id=key[1]))
+                    for field, value in row.items():
+                        setattr(rollup, field, getattr(rollup, field) + value)
+            SellerRollup.objects.filter(seller_id__in=seller_ids).delete()
+            SellerRollup.objects.bulk_create(rollups.values())
+        rebuilt += len(seller_ids)
+        if progress:
+            progress(rebuilt)
+
+
+def category_directory():
+    """
+    The categories page, cached until a listing is created, closed or recategorized.
+
+    There is no timeout, the write paths above delete the key instead.
+    """
+    def load():
+        return list(
+            Category.objects.filter(listing_count__gt=0)
+            .order_by("name")
+            .values("id", "slug", "name", "listing_count", "active_count")
+        )
+    return cache.get_or_set(CATEGORY_DIRECTORY_KEY, load, timeout=None)
+
+
+def invalidate_category_directory():
+    cache.delete(CATEGORY_DIRECTORY_KEY)
+    # the categories page shows the same counts
+    pagecache.purge(pagecache.CATEGORIES)
@@ -0,0 +1,241 @@
+import heapq
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+# models stored on the shard of their listing, everything else (users,
+# categories, notifications, sessions) stays on default
+SHARDED_MODELS = {"listing", "bid", "comment", "watchlist", "closed", "pricebucket", "proxybid", "outboxevent"}
+
+# the shard unhinted queries on sharded models go to, see on_shard
+_current = ContextVar("auctions_shard", default=None)
+
+
+def shards():
+    return getattr(settings, "AUCTIONS_SHARDS", [])
+
+
+def listing_databases():
+    """Every database holding listings, just default when sharding is off."""
+    return shards() or [DEFAULT_DB_ALIAS]
+
+
+def is_sharded(model):
+    return bool(shards()) and model._meta.app_label == "auctions" and model._meta.model_name in SHARDED_MODELS
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping and Veach) of an integer key into range(buckets).
+
+    Going from n to n + 1 buckets only moves 1 / (n + 1) of the keys, all of
+    them into the new bucket, so adding a shard doesn't reshuffle the others.
+    """
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) % 2 ** 64
+        jump = int((bucket + 1) * (2 ** 31 / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(listing_id):
+    aliases = shards()
+    return aliases[jump_hash(listing_id, len(aliases))]
+
+
+def listing_db(listing):
+    """Database alias of a listing (or listing id), default when sharding is off."""
+    if not shards():
+        return DEFAULT_DB_ALIAS
+    return shard_for(listing if isinstance(listing, int) else listing.id)
+
+
+@contextmanager
+def on_shard(alias):
+    """Send queries on sharded models that carry no instance to route by to alias."""
+    token = _current.set(alias)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def listing_shard(view):
+    """Run a view taking a listing id on that listing's shard."""
+    @wraps(view)
+    def wrapper(request, id, *args, **kwargs):
+        with on_shard(listing_db(id)):
+            return view(request, id, *args, **kwargs)
+    return wrapper
+
+
+def atomic(db):
+    """
+    transaction.atomic on a listing's database, which also sends unhinted
+    queries there. On a shard the category counts and users on default get a
+    transaction of their own inside it, committed just before the shard's.
+    """
+    stack = ExitStack()
+    stack.enter_context(on_shard(db))
+    stack.enter_context(transaction.atomic(using=db))
+    if db != DEFAULT_DB_ALIAS:
+        stack.enter_context(transaction.atomic())
+    return stack
+
+
+def with_users(queryset, *fields):
+    """select_related for foreign keys to users, which are a separate query on default when sharded."""
+    if is_sharded(queryset.model):
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def spans_shards(queryset):
+    """Whether queryset has to be run on every shard, it isn't pinned to one."""
+    return is_sharded(queryset.model) and queryset._db is None and _current.get() is None
+
+
+def fan_out(queryset, limit, key=attrgetter("id")):
+    """
+    The first limit rows of queryset, from every shard when it isn't pinned to one.
+
+    queryset has to be ordered newest first by id (or a column equal to it),
+    key(row) gives a row's id (for values_list rows, say). Listing ids come
+    from one sequence on default so they're unique across shards, each
+    shard's newest rows are merged into one page the same way a single
+    database would have returned it.
+    """
+    if not spans_shards(queryset):
+        return list(queryset[:limit])
+    pages = [list(queryset.using(alias)[:limit]) for alias in shards()]
+    return list(islice(heapq.merge(*pages, key=lambda row: -key(row)), limit))
+
+
+def stream(queryset, key, chunk_size=2000):
+    """
+    Every row of queryset, oldest first by key(row), streamed from each shard at once.
+
+    queryset has to be ordered by id (or a column equal to it) ascending,
+    the shards' cursors are merged lazily so nothing is held in memory.
+    """
+    if not spans_shards(queryset):
+        return queryset.iterator(chunk_size=chunk_size)
+    return heapq.merge(*(queryset.using(alias).iterator(chunk_size=chunk_size) for alias in shards()), key=key)
+
+
+def default_joins(model, lookups):
+    """
+    values_list lookups for model that a shard can run, and the joins it can't.
+
+    Users and categories live on default, so on a shard a lookup through
+    them (user__username) selects the foreign key instead and comes back in
+    joins as (position, related model, column) for fill_joins. Without
+    sharding the lookups are returned as they are.
+    """
+    if not is_sharded(model):
+        return list(lookups), []
+    local, joins = [], []
+    for position, lookup in enumerate(lookups):
+        relation, _, column = lookup.partition("__")
+        field = model._meta.get_field(relation) if column else None
+        if field is not None and field.is_relation and not is_sharded(field.related_model):
+            local.append(field.attname)
+            joins.append((position, field.related_model, column))
+        else:
+            local.append(lookup)
+    return local, joins
+
+
+def fill_joins(rows, joins):
+    """values_list rows with the keys default_joins selected replaced by their values, a query on default per join."""
+    if not joins:
+        return rows
+    rows = [list(row) for row in rows]
+    for position, model, column in joins:
+        ids = {row[position] for row in rows} - {None}
+        values = dict(model.objects.using(DEFAULT_DB_ALIAS).filter(id__in=ids).values_list("id", column))
+        for row in rows:
+            row[position] = values.get(row[position])
+    return [tuple(row) for row in rows]
+
+
+def allocate_listing_ids(count):
+    """The next count listing ids from the sequence on default, unique across all shards."""
+    from .models import ListingSequence
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        numbers = [row.id for row in ListingSequence.objects.bulk_create([ListingSequence() for _ in range(count)])]
+        # only the highest row matters, sqlite's AUTOINCREMENT never hands an id out twice
+        ListingSequence.objects.filter(id__lt=numbers[-1]).delete()
+    return numbers
+
+
+def allocate_listing_id():
+    """Next listing id from the sequence on default, unique across all shards."""
+    return allocate_listing_ids(1)[0]
+
+
+def disable_foreign_keys(using="default", **kwargs):
+    """
+    post_migrate hook, sqlite's schema editor turns foreign key checks back on
+    for the connection it migrated with. Rows on a shard point at users and
+    categories on default, which sqlite can't see, so they stay off when sharded.
+    """
+    if shards():
+        connections[using].disable_constraint_checking()
+
+
+def _listing_id(instance):
+    if instance._meta.model_name == "listing":
+        return instance.id
+    return getattr(instance, "listing_id", None)
+
+
+class ShardRouter:
+    """
+    Routes listings, and the rows hanging off a listing, to the shard of the listing id.
+
+    Instances carry their listing id (saves, deletes, related managers, a
+    notification's listing), other queries, Model.objects.create included,
+    go to the shard set with on_shard or @listing_shard. Queries with neither fall through to default, which
+    has no listing tables unless it was migrated before sharding was turned
+    on, so a missed route fails instead of quietly reading another database.
+    Without AUCTIONS_SHARDS this router changes nothing.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if not is_sharded(model):
+            # users and categories reached from a row on a shard, django would look on the shard
+            if shards() and instance is not None and instance._state.db in shards():
+                return DEFAULT_DB_ALIAS
+            return None
+        if instance is not None:
+            listing_id = _listing_id(instance)
+            if listing_id is not None:
+                return shard_for(listing_id)
+        return _current.get()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # users and categories on default are referenced from every shard
+        return True if shards() else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not shards():
+            return None
+        if db in shards():
+            return app_label == "auctions" and model_name in SHARDED_MODELS
+        # default keeps users, categories, notifications and django's own tables. the data
+        # migrations (no model_name) read listings, they run before sharding is turned on
+        if app_label == "auctions" and (model_name is None or model_name in SHARDED_MODELS):
+            return False
+        return None
@@ -0,0 +1,156 @@
+import gzip
+import json
+import mimetypes
+import os
+from functools import cache
+
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    # without brotli only the .gz variants are written
+    brotli = None
+
+
+# third party assets served from our own static files, fetched by the
+# vendor_assets command and committed. Without them pages fall back to the CDN url.
+VENDOR_ASSETS = {
+    "bootstrap": {
+        "path": "vendor/bootstrap-4.4.1.min.css",
+        "url": "https://cdn.jsdelivr.net/npm/bootstrap@4.4.1/dist/css/bootstrap.min.css",
+        "integrity": "sha384-Vkoo8x4CGsO3+Hhxv8T/Q5PaXtkKtu6ug5TOeNV6gBiFeWPGFN9MuhOf23Q9Ifjh",
+    },
+}
+
+# already compressed formats, gzipping them again only costs cpu
+SKIP_COMPRESSION = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2", ".zip", ".gz", ".br"}
+# a variant that saves less than this share of the file isn't worth a Vary
+MIN_SAVING = 0.05
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+@cache
+def vendored(name):
+    """The static path of a vendored asset, or None if it hasn't been fetched."""
+    path = VENDOR_ASSETS[name]["path"]
+    return path if finders.find(path) else None
+
+
+def compress(path):
+    """Write .gz (and .br with brotli installed) next to path, returns the files written."""
+    if os.path.splitext(path)[1].lower() in SKIP_COMPRESSION:
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    variants = {".gz": lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = lambda: brotli.compress(data)
+    written = []
+    for suffix, compressor in variants.items():
+        compressed = compressor()
+        if len(compressed) > len(data) * (1 - MIN_SAVING):
+            continue
+        with open(path + suffix, "wb") as f:
+            f.write(compressed)
+        written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic storage that names files by their content hash and
+    precompresses them.
+
+    The hashed names never change content, so they're served with a year
+    long immutable Cache-Control by auctions.middleware.StaticFilesMiddleware.
+    Compressing here once means the server only picks a file per request.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            names.add(name)
+            if hashed_name:
+                names.add(hashed_name)
+        if dry_run:
+            return
+        for name in sorted(names):
+            for written in compress(self.path(name)):
+                yield name, os.path.relpath(written, self.location), True
+
+
+class StaticFile:
+    """One collected file and its compressed variants, with the headers to serve them."""
+
+    def __init__(self, path, immutable):
+        self.path = path
+        stat = os.stat(path)
+        self.size = stat.st_size
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or "application/octet-stream"
+        if content_type.startswith("text/") or content_type in ("application/javascript", "image/svg+xml"):
+            content_type += "; charset=utf-8"
+        self.content_type = content_type
+        self.etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+        self.cache_control = "public, max-age=31536000, immutable" if immutable else "public, max-age=60"
+        self.variants = {
+            encoding: (path + suffix, os.path.getsize(path + suffix))
+            for encoding, suffix in ENCODINGS.items()
+            if os.path.exists(path + suffix)
+        }
+
+    def pick(self, accept_encoding):
+        """(path, size, encoding) of the smallest variant the client accepts."""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, (path, size) in self.variants.items():
+            if encoding in accepted:
+                return path, size, encoding
+        return self.path, self.size, None
+
+
+def accepted_encodings(header):
+    # Accept-Encoding: "gzip, deflate, br;q=0.9", a q of 0 means "not this one"
+    encodings = set()
+    for part in (header or "").split(","):
+        encoding, *params = [param.strip() for param in part.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if encoding and quality > 0:
+            encodings.add(encoding.lower())
+    return encodings
+
+
+def index_static_root(root):
+    """
+    url path -> StaticFile for everything collectstatic put in root.
+
+    Names listed in the manifest as hashed are immutable, everything else
+    (the unhashed originals collectstatic also keeps) gets a short max-age.
+    """
+    hashed = set()
+    manifest = os.path.join(root, ManifestStaticFilesStorage.manifest_name)
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            hashed = set(json.load(f).get("paths", {}).values())
+
+    files = {}
+    suffixes = tuple(ENCODINGS.values())
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            if filename.endswith(suffixes) and os.path.exists(path[: -len(os.path.splitext(path)[1])]):
+                # a variant, served through the file it was made from
+                continue
+            files[name] = StaticFile(path, name in hashed)
+    return files
@@ -0,0 +1,42 @@
+from django import template
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils.html import format_html
+
+from auctions import idempotency
+from auctions.cards import render_cards
+from auctions.images import source_key
+from auctions.staticfiles import VENDOR_ASSETS, vendored
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def listing_cards(listings):
+    """{% listing_cards listings %} renders the grid cards, served from the card cache."""
+    return render_cards(listings)
+
+
+@register.simple_tag
+def thumbnail_url(listing, size):
+    """{% thumbnail_url listing "card" %} is the proxied, resized image of a listing."""
+    return reverse("thumbnail", args=[listing.id, size, source_key(listing.image_url)])
+
+
+@register.simple_tag
+def idempotency_key():
+    """{% idempotency_key %} in a POST form, so submitting it twice only does it once."""
+    return format_html('<input type="hidden" name="{}" value="{}">', idempotency.FORM_FIELD, idempotency.new_key())
+
+
+@register.simple_tag
+def vendor_stylesheet(name):
+    """{% vendor_stylesheet "bootstrap" %} links our vendored copy, or the CDN until vendor_assets has fetched it."""
+    path = vendored(name)
+    if path:
+        return format_html('<link rel="stylesheet" href="{}">', static(path))
+    asset = VENDOR_ASSETS[name]
+    return format_html(
+        '<link rel="stylesheet" href="{}" integrity="{}" crossorigin="anonymous">', asset["url"], asset["integrity"]
+    )
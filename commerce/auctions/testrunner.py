@@ -0,0 +1,31 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner that points the file based caches at a throwaway directory.
+
+    The sessions cache is shared between server processes on disk, tests
+    writing their users into it would show up as someone else's login.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix="auctions-test-cache-")
+        caches = {
+            alias: {**options, "LOCATION": f"{self.cache_dir}/{alias}"}
+            if options["BACKEND"].endswith("FileBasedCache") else options
+            for alias, options in settings.CACHES.items()
+        }
+        self.caches_override = override_settings(CACHES=caches)
+        self.caches_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches_override.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
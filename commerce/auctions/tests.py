@@ -1,3 +1,1842 @@
-from django.test import TestCase
+import base64
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmarks, cards, images, middleware, notifications, services, sharding
+from .bulk import import_listings, read_rows
+from .notifications import deliver_notifications
+from .events import event_stream, get_broker, publish
+from .models import ApiToken, Bid, Category, Closed, Comment, Listing, Notification, OutboxEvent, PriceBucket, ProxyBid, SellerRollup, User, Watchlist
+from .ratelimit import TokenBucket
+from .search import rebuild_index, search_listings
+from .services import (
+    BidRejected, CommentRejected, add_comment, add_listing, bid_increment, category_directory, close_expired, close_listing, place_bid,
+    place_max_bid, rebuild_bid_stats, rebuild_seller_rollups, recategorize
+)
+
+
+class PlaceBidTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.bidder = User.objects.create_user("bidder", password="pw")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("5.00"), current_price=Decimal("5.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+
+    def test_bid_updates_price(self):
+        bid = place_bid(self.listing, self.bidder, "6.50")
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, Decimal("6.50"))
+        self.assertEqual(bid.amount, Decimal("6.50"))
+
+    def test_stale_bid_rejected(self):
+        # another bidder got in first with the listing object still holding the old price
+        place_bid(Listing.objects.get(id=self.listing.id), self.seller, "8.00")
+        with self.assertRaisesMessage(BidRejected, "higher than the highest"):
+            place_bid(self.listing, self.bidder, "7.00")
+        self.assertEqual(Bid.objects.count(), 1)
+
+    def test_invalid_bids_rejected(self):
+        for amount in ["", "abc", "0", "-1", "NaN", "4.99", "99999999999", "1e30"]:
+            with self.assertRaises(BidRejected):
+                place_bid(self.listing, self.bidder, amount)
+            with self.assertRaises(BidRejected):
+                place_max_bid(self.listing, self.bidder, amount)
+        self.assertFalse(Bid.objects.exists())
+
+        # too big for the price column is a form error, not a 500
+        self.client.login(username="bidder", password="pw")
+        url = reverse("listing", args=[self.listing.id])
+        self.assertEqual(self.client.post(url, {"action": "place_bid", "bid": "1e30"}).status_code, 302)
+        response = self.client.post(reverse("api_bids", args=[self.listing.id]), {"amount": "99999999999"})
+        self.assertEqual(response.status_code, 409)
+
+    def test_closed_listing_rejects_bids(self):
+        close_listing(self.listing)
+        with self.assertRaisesMessage(BidRejected, "closed"):
+            place_bid(self.listing, self.bidder, "10.00")
+
+    def test_bid_maintains_listing_state(self):
+        place_bid(self.listing, self.bidder, "6.00")
+        place_bid(self.listing, self.seller, "7.00")
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.highest_bidder, self.seller)
+        self.assertEqual(self.listing.bid_count, 2)
+
+
+class ListingPageTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+
+    def add_activity(self, n):
+        for i in range(n):
+            user = User.objects.create_user(f"user{User.objects.count()}")
+            place_bid(self.listing, user, self.listing.current_price + 1)
+            add_comment(self.listing, user, f"comment {i}")
+
+    def test_query_count_is_constant(self):
+        self.client.login(username="seller", password="pw")
+        url = reverse("listing", args=[self.listing.id])
+
+        # listing, watchlist, comments. the session and user come from the cache once loaded
+        self.client.get(url)
+        self.add_activity(1)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+        self.add_activity(30)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        # newest page only, the rest behind load more
+        self.assertEqual(len(response.context["comments"]), 20)
+        self.assertEqual(response.context["comments"][0].text, "comment 29")
+
+    def test_close_listing(self):
+        place_bid(self.listing, User.objects.create_user("bidder"), "3.00")
+        self.assertTrue(close_listing(self.listing))
+        self.assertFalse(close_listing(self.listing))
+        self.assertEqual(Closed.objects.filter(listing=self.listing).count(), 1)
+
+        response = self.client.get(reverse("listing", args=[self.listing.id]))
+        self.assertContains(response, "SOLD to bidder")
+
+    def test_close_announces_the_winner_at_close(self):
+        # loaded before the last bid, the winner comes from the row closed
+        stale = Listing.objects.get(id=self.listing.id)
+        bidder = User.objects.create_user("bidder")
+        place_bid(self.listing, bidder, "3.00")
+        with mock.patch("auctions.services.publish") as publish_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                close_listing(stale)
+        self.assertEqual(stale.winner, bidder)
+        publish_mock.assert_called_with(self.listing.id, "closed", winner="bidder")
+
+
+class GridPaginationTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        lamps = Category.for_name("lamps")
+        self.listings = [
+            add_listing(Listing(title=f"item {i}", current_price=1, category=lamps, user=self.seller))
+            for i in range(30)
+        ]
+        close_listing(self.listings[-1])
+
+    def test_index_pages_through_active_listings(self):
+        response = self.client.get(reverse("index"))
+        first_page = response.context["listings"]
+        self.assertEqual(len(first_page), 24)
+        # newest first, and the closed newest listing is left out
+        self.assertEqual(first_page[0], self.listings[-2])
+
+        response = self.client.get(reverse("index") + "?" + response.context["next_page"])
+        self.assertEqual(len(response.context["listings"]), 5)
+        self.assertIsNone(response.context["next_page"])
+
+    def test_show_closed(self):
+        response = self.client.get(reverse("category", args=["lamps"]) + "?all=1")
+        self.assertEqual(response.context["listings"][0], self.listings[-1])
+        self.assertIn("all=1", response.context["next_page"])
+
+
+class CategoryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user("seller", password="pw")
+
+    def new_listing(self, category_name):
+        return add_listing(Listing(
+            title="thing", current_price=1, user=self.seller, category=Category.for_name(category_name)
+        ))
+
+    def test_names_share_a_slug(self):
+        self.assertEqual(Category.for_name("Desk Lamps"), Category.for_name(" desk lamps"))
+
+    def test_counts_follow_writes(self):
+        listing = self.new_listing("Lamps")
+        self.new_listing("lamps")
+        close_listing(listing)
+        recategorize(listing, Category.for_name("Chairs"))
+
+        counts = {c["slug"]: (c["listing_count"], c["active_count"]) for c in category_directory()}
+        self.assertEqual(counts, {"lamps": (1, 1), "chairs": (1, 0)})
+
+    def test_recategorize_a_listing_closed_since_it_was_read(self):
+        stale = self.new_listing("lamps")
+        close_listing(Listing.objects.get(id=stale.id))
+        recategorize(stale, Category.for_name("chairs"))
+
+        counts = dict(Category.objects.values_list("slug", "active_count"))
+        self.assertEqual(counts, {"lamps": 0, "chairs": 0})
+
+    def test_directory_is_cached_until_a_write(self):
+        self.new_listing("lamps")
+        category_directory()
+        with self.assertNumQueries(0):
+            self.client.get(reverse("categories"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.new_listing("chairs")
+        response = self.client.get(reverse("categories"))
+        self.assertContains(response, "chairs")
+
+
+class MigrationTests(TransactionTestCase):
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("auctions", target)])
+        return executor.loader.project_state([("auctions", target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes("auctions"))
+
+    def test_text_categories_are_linked_whatever_their_whitespace(self):
+        apps = self.migrate("0011_grid_indexes")
+        seller = apps.get_model("auctions", "User").objects.create(username="seller")
+        OldListing = apps.get_model("auctions", "Listing")
+        for name in ["Lamps ", "lamps", " chairs"]:
+            OldListing.objects.create(title="thing", current_price=1, category=name, user=seller)
+
+        apps = self.migrate("0012_category")
+        listings = apps.get_model("auctions", "Listing").objects.order_by("id")
+        self.assertEqual([listing.category.slug for listing in listings], ["lamps", "lamps", "chairs"])
+        counts = apps.get_model("auctions", "Category").objects.values_list("slug", "listing_count")
+        self.assertEqual(sorted(counts), [("chairs", 1), ("lamps", 2)])
+
+    def test_closed_listings_get_a_close_time(self):
+        apps = self.migrate("0009_alter_listing_category")
+        seller = apps.get_model("auctions", "User").objects.create(username="seller")
+        listing = apps.get_model("auctions", "Listing").objects.create(title="lamp", current_price=1, user=seller)
+        apps.get_model("auctions", "Closed").objects.create(listing=listing)
+
+        apps = self.migrate("0010_listing_auction_state")
+        closed = apps.get_model("auctions", "Listing").objects.get(id=listing.id)
+        self.assertTrue(closed.is_closed)
+        self.assertIsNotNone(closed.closed_at)
+
+        # databases migrated past 0010 before it timed the old closes
+        apps = self.migrate("0024_api_tokens")
+        apps.get_model("auctions", "Listing").objects.filter(id=listing.id).update(closed_at=None)
+        self.migrate("0025_backfill_closed_at")
+        closed = Listing.objects.get(id=listing.id)
+        self.assertEqual(closed.closed_at, closed.modified)
+
+    def test_seller_rollups_are_backfilled(self):
+        apps = self.migrate("0022_listing_sequence")
+        seller = apps.get_model("auctions", "User").objects.create(username="seller")
+        lamps = apps.get_model("auctions", "Category").objects.create(name="lamps", slug="lamps", listing_count=1, active_count=1)
+        old = apps.get_model("auctions", "Listing").objects.create(
+            title="old lamp", current_price=1, category=lamps, user=seller
+        )
+
+        self.migrate("0024_api_tokens")
+        seller, lamps = User.objects.get(username="seller"), Category.objects.get(slug="lamps")
+        new = add_listing(Listing(title="new lamp", current_price=1, category=lamps, user=seller))
+        for listing in [Listing.objects.get(id=old.id), new]:
+            close_listing(listing)
+        rollup = SellerRollup.objects.get(seller=seller, category=lamps)
+        self.assertEqual((rollup.listing_count, rollup.active_count, rollup.closed_count), (2, 0, 2))
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.lamp = self.new_listing("Brass desk lamp", "lighting", 20, "a lamp for your desk")
+        self.desk = self.new_listing("Oak desk", "furniture", 150, "solid oak, fits a lamp")
+        self.chair = self.new_listing("Office chair", "furniture", 80, "comfy")
+
+    def new_listing(self, title, category, price, description=""):
+        return add_listing(Listing(
+            title=title, description=description, current_price=price, user=self.seller,
+            category=Category.for_name(category)
+        ))
+
+    def test_prefix_match_ranked_by_title(self):
+        listings, has_next = search_listings("lam")
+        self.assertEqual(listings, [self.lamp, self.desk])
+        self.assertFalse(has_next)
+
+    def test_filters(self):
+        furniture = Category.objects.get(slug="furniture")
+        self.assertEqual(search_listings("desk", category=furniture)[0], [self.desk])
+        self.assertEqual(search_listings("furniture", max_price=100)[0], [self.chair])
+        close_listing(self.chair)
+        self.assertEqual(search_listings("chair")[0], [])
+        self.assertEqual(search_listings("chair", include_closed=True)[0], [self.chair])
+
+    def test_index_follows_writes(self):
+        Listing.objects.filter(id=self.chair.id).update(title="Gaming stool")
+        self.assertEqual(search_listings("stool")[0], [self.chair])
+        self.assertEqual(search_listings("office")[0], [])
+
+        recategorize(self.chair, Category.for_name("games"))
+        self.assertEqual(search_listings("games")[0], [self.chair])
+
+        self.chair.delete()
+        self.assertEqual(search_listings("stool")[0], [])
+
+        self.assertEqual(rebuild_index(), 2)
+        self.assertEqual(search_listings("oak")[0], [self.desk])
+
+    def test_user_syntax_is_escaped(self):
+        response = self.client.get(reverse("search"), {"q": 'title:"desk*', "min_price": "x"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["listings"]), [])
+
+        response = self.client.get(reverse("search"), {"q": '"desk', "min_price": "NaN"})
+        self.assertEqual(list(response.context["listings"]), [self.lamp, self.desk])
+
+
+class ListingEventsTests(TestCase):
+
+    def setUp(self):
+        caches["pages"].clear()
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.listing = add_listing(Listing(
+            title="lamp", current_price=1, user=self.seller, category=Category.for_name("lamps")
+        ))
+
+    async def test_stream_receives_published_events(self):
+        stream = event_stream(self.listing.id)
+        self.assertEqual(await anext(stream), "retry: 3000\n\n")
+
+        publish(self.listing.id, "bid", price="3.00", bidder="bidder")
+        chunk = await anext(stream)
+        self.assertTrue(chunk.startswith("event: bid\n"))
+        self.assertIn('"price": "3.00"', chunk)
+
+        await stream.aclose()
+        self.assertEqual(get_broker().subscriber_count(self.listing.id), 0)
+
+    async def test_events_view(self):
+        response = await self.async_client.get(reverse("listing_events", args=[self.listing.id]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(await anext(aiter(response.streaming_content)), b"retry: 3000\n\n")
+
+        response = await self.async_client.get(reverse("listing_events", args=[self.listing.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_wsgi_pages_do_without_events(self):
+        # a wsgi server can't stream the async generator, the request would hang instead
+        response = self.client.get(reverse("listing_events", args=[self.listing.id]))
+        self.assertEqual(response.status_code, 204)
+        self.assertNotContains(self.client.get(reverse("listing", args=[self.listing.id])), "EventSource")
+
+    async def test_asgi_pages_subscribe(self):
+        response = await self.async_client.get(reverse("listing", args=[self.listing.id]))
+        self.assertContains(response, "EventSource")
+
+    def test_write_paths_publish_after_commit(self):
+        with mock.patch("auctions.services.publish") as publish_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                place_bid(self.listing, self.seller, "2.00")
+                add_comment(self.listing, self.seller, "hi")
+                close_listing(self.listing)
+        kinds = [call.args[1] for call in publish_mock.call_args_list]
+        self.assertEqual(kinds, ["bid", "comment", "closed"])
+
+
+class CardCacheTests(TestCase):
+
+    def setUp(self):
+        caches["cards"].clear()
+        caches["pages"].clear()
+        cards.stats.reset()
+        self.seller = User.objects.create_user("seller", password="pw", is_staff=True)
+        self.listing = add_listing(Listing(
+            title="lamp", current_price=1, user=self.seller, category=Category.for_name("lamps")
+        ))
+
+    def test_cards_cached_until_listing_changes(self):
+        self.client.get(reverse("index"))
+        # render the page again instead of serving it whole from the page cache
+        caches["pages"].clear()
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "$1.00 USD")
+        self.assertEqual((cards.stats.hits, cards.stats.misses), (1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bid(self.listing, self.seller, "2.00")
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "$2.00 USD")
+        self.assertEqual(cards.stats.misses, 2)
+
+    def test_stats_endpoint(self):
+        self.client.get(reverse("index"))
+        caches["pages"].clear()
+        self.client.get(reverse("index"))
+        self.assertEqual(self.client.get(reverse("card_cache_stats")).status_code, 302)
+
+        self.client.login(username="seller", password="pw")
+        data = self.client.get(reverse("card_cache_stats")).json()
+        self.assertEqual(data["hit_ratio"], 0.5)
+
+
+class ApiTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.lamps = Category.for_name("lamps")
+        self.listings = [
+            add_listing(Listing(title=f"lamp {i}", current_price=1, user=self.seller, category=self.lamps))
+            for i in range(3)
+        ]
+
+    def test_listings_fields_and_pagination(self):
+        response = self.client.get(reverse("api_listings"), {"fields": "title,current_price", "limit": 2})
+        data = response.json()
+        self.assertEqual(data["results"], [
+            {"title": "lamp 2", "current_price": "1.00"},
+            {"title": "lamp 1", "current_price": "1.00"},
+        ])
+        data = self.client.get(data["next"]).json()
+        self.assertEqual([row["title"] for row in data["results"]], ["lamp 0"])
+        self.assertIsNone(data["next"])
+
+        response = self.client.get(reverse("api_listings"), {"fields": "title,password"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_listing_conditional_get(self):
+        url = reverse("api_listing", args=[self.listings[0].id])
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        add_comment(self.listings[0], self.seller, "still available?")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_grid_conditional_get(self):
+        etag = self.client.get(reverse("api_listings"))["ETag"]
+        self.assertEqual(self.client.get(reverse("api_listings"), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_bid_comment_and_watchlist(self):
+        listing = self.listings[0]
+        self.assertEqual(self.client.post(reverse("api_bids", args=[listing.id]), {"amount": "5"}).status_code, 401)
+
+        self.client.login(username="seller", password="pw")
+        response = self.client.post(
+            reverse("api_bids", args=[listing.id]), {"amount": "5"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["current_price"], "5.00")
+        response = self.client.post(reverse("api_bids", args=[listing.id]), {"amount": "4"})
+        self.assertEqual(response.status_code, 409)
+
+        self.client.post(reverse("api_comments", args=[listing.id]), {"text": "nice"})
+        data = self.client.get(reverse("api_comments", args=[listing.id])).json()
+        self.assertEqual(data["results"][0]["text"], "nice")
+
+        self.client.put(reverse("api_watchlist_entry", args=[listing.id]))
+        self.client.put(reverse("api_watchlist_entry", args=[listing.id]))
+        data = self.client.get(reverse("api_watchlist"), {"fields": "id"}).json()
+        self.assertEqual(data["results"], [{"id": listing.id}])
+        self.client.delete(reverse("api_watchlist_entry", args=[listing.id]))
+        self.assertEqual(self.client.get(reverse("api_watchlist")).json()["results"], [])
+
+
+class ApiTokenTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.listing = add_listing(Listing(
+            title="lamp", current_price=1, user=self.seller, category=Category.for_name("lamps")
+        ))
+        self.bidder = User.objects.create_user("bidder", password="pw")
+        # a real client checks csrf, the default test client doesn't
+        self.client = Client(enforce_csrf_checks=True)
+
+    def bid(self, amount, **headers):
+        return self.client.post(
+            reverse("api_bids", args=[self.listing.id]), {"amount": amount}, content_type="application/json", headers=headers
+        )
+
+    def test_token_writes_need_no_csrf(self):
+        response = self.client.post(
+            reverse("api_tokens"), {"username": "bidder", "password": "wrong"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            reverse("api_tokens"), {"username": "bidder", "password": "pw"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        auth = f"Token {response.json()['token']}"
+        self.assertNotIn(response.json()["token"], ApiToken.objects.get().key_hash)
+
+        self.assertEqual(self.bid("2", Authorization=auth).status_code, 201)
+        self.assertEqual(Bid.objects.get().user, self.bidder)
+        response = self.client.put(reverse("api_watchlist_entry", args=[self.listing.id]), headers={"Authorization": auth})
+        self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(self.bid("3", Authorization="Token nope").status_code, 401)
+        self.assertEqual(self.client.delete(reverse("api_tokens"), headers={"Authorization": auth}).status_code, 204)
+        self.assertEqual(self.bid("3", Authorization=auth).status_code, 401)
+
+    def test_session_writes_need_the_csrf_token(self):
+        self.client.login(username="bidder", password="pw")
+        response = self.bid("2")
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("X-CSRFToken", response.json()["error"])
+
+        # the cookie a page view hands out, sent back in the header
+        self.client.get(reverse("create_listing"))
+        csrf = self.client.cookies["csrftoken"].value
+        self.assertEqual(self.bid("2", **{"X-CSRFToken": csrf}).status_code, 201)
+
+
+class ExpiryTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.bidder = User.objects.create_user("bidder", password="pw")
+        self.lamps = Category.for_name("lamps")
+        self.past = timezone.now() - timedelta(minutes=1)
+
+    def new_listing(self, ends_at):
+        return add_listing(Listing(
+            title="lamp", current_price=1, user=self.seller, category=self.lamps, ends_at=ends_at
+        ))
+
+    def test_close_expired_in_batches(self):
+        expired = [self.new_listing(timezone.now() + timedelta(days=1)) for _ in range(5)]
+        running = self.new_listing(timezone.now() + timedelta(days=1))
+        forever = self.new_listing(None)
+        place_bid(expired[0], self.bidder, "3.00")
+        Listing.objects.filter(id__in=[listing.id for listing in expired]).update(ends_at=self.past)
+
+        self.assertEqual(close_expired(batch_size=3), 3)
+        self.assertEqual(close_expired(batch_size=3), 2)
+        self.assertEqual(close_expired(batch_size=3), 0)
+
+        self.assertEqual(Listing.objects.filter(is_closed=True).count(), 5)
+        self.assertFalse(Listing.objects.get(id=running.id).is_closed)
+        self.assertFalse(Listing.objects.get(id=forever.id).is_closed)
+        closed = Closed.objects.get(listing=expired[0])
+        self.assertEqual((closed.winner, closed.price), (self.bidder, Decimal("3.00")))
+        self.lamps.refresh_from_db()
+        self.assertEqual(self.lamps.active_count, 2)
+
+    def test_expired_auction_rejects_bids(self):
+        listing = self.new_listing(self.past)
+        with self.assertRaisesMessage(BidRejected, "ended"):
+            place_bid(listing, self.bidder, "5.00")
+
+
+@override_settings(AUCTIONS_PERF_ENABLED=True)
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        middleware.registry.reset()
+        caches["pages"].clear()
+        self.seller = User.objects.create_user("seller", password="pw", is_staff=True)
+        self.listing = add_listing(Listing(
+            title="lamp", current_price=1, user=self.seller, category=Category.for_name("lamps")
+        ))
+
+    def test_records_per_view_stats(self):
+        for _ in range(3):
+            self.client.get(reverse("listing", args=[self.listing.id]))
+        stats = middleware.registry.report()["listing"]
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["max_queries"], 1)
+        self.assertEqual(stats["duplicate_queries"], 0)
+        self.assertGreater(stats["avg_template_ms"], 0)
+
+    def test_duplicate_queries_detected(self):
+        request_stats = middleware.RequestStats()
+        with connection.execute_wrapper(request_stats):
+            for _ in range(3):
+                list(Listing.objects.filter(id=self.listing.id))
+        self.assertEqual((request_stats.queries, request_stats.duplicates), (3, 2))
+
+    def test_endpoint_is_staff_only(self):
+        self.client.get(reverse("index"))
+        self.assertEqual(self.client.get(reverse("perf_stats")).status_code, 302)
+        self.client.login(username="seller", password="pw")
+        self.assertIn("index", self.client.get(reverse("perf_stats")).json())
+
+
+class BulkImportExportTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+
+    def test_import_csv_validates_like_create_listing(self):
+        data = (
+            "title,description,category,start_bid,image_url\n"
+            "Desk lamp,brass,Lamps,5,\n"
+            ",no title,Lamps,5,\n"
+            "Chair,,Chairs,abc,\n"
+            "Stool,,chairs,,\n"
+        )
+        report = import_listings(read_rows(io.BytesIO(data.encode()), "csv"), self.seller, batch_size=1)
+        self.assertEqual((report.rows, report.imported), (4, 2))
+        self.assertEqual(report.errors, [(3, "title cannot be blank"), (4, "an issue with the starting bid format")])
+
+        self.assertEqual(Listing.objects.get(title="Stool").start_bid, Decimal("0.01"))
+        self.assertEqual(Category.objects.get(slug="chairs").active_count, 1)
+        self.assertEqual(search_listings("lamp")[0], [Listing.objects.get(title="Desk lamp")])
+
+    def test_unreadable_files_are_reported(self):
+        latin1 = "title,category\nLampe à pied,lamps\n".encode("latin-1")
+        report = import_listings(read_rows(io.BytesIO(latin1), "csv"), self.seller)
+        self.assertEqual(report.errors, [(1, "the file is not UTF-8 text, nothing from this line on was read")])
+        report = import_listings(read_rows(io.BytesIO(latin1), "jsonl"), self.seller)
+        self.assertEqual(report.imported, 0)
+        self.assertEqual(report.error_count, 1)
+
+        huge = f"title,category\nLamp,lamps\n{'x' * 200000},lamps\n".encode()
+        report = import_listings(read_rows(io.BytesIO(huge), "csv"), self.seller)
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(report.errors[0][0], 3)
+        self.assertTrue(report.errors[0][1].startswith("invalid CSV"))
+
+        self.client.login(username="seller", password="pw")
+        upload = SimpleUploadedFile("listings.csv", latin1)
+        response = self.client.post(reverse("import_listings"), {"file": upload}, follow=True)
+        self.assertContains(response, "imported 0 of 1 listings")
+        self.assertContains(response, "line 1: the file is not UTF-8 text")
+
+    def test_start_bid_too_large_for_the_price_column(self):
+        self.client.login(username="seller", password="pw")
+        for start_bid in ["99999999999", "1e30"]:
+            response = self.client.post(
+                reverse("create_listing"), {"title": "Lamp", "category": "lamps", "starting_bid": start_bid}
+            )
+            self.assertRedirects(response, reverse("create_listing"), fetch_redirect_response=False)
+        self.assertFalse(Listing.objects.exists())
+
+    def test_upload_jsonl_and_export(self):
+        self.client.login(username="seller", password="pw")
+        upload = SimpleUploadedFile(
+            "listings.jsonl", b'{"title": "Lamp", "category": "lamps", "start_bid": 2}\nnot json\n'
+        )
+        response = self.client.post(reverse("import_listings"), {"file": upload}, follow=True)
+        self.assertContains(response, "imported 1 of 2 listings")
+        self.assertContains(response, "line 2: invalid JSON")
+
+        response = self.client.get(reverse("export_listings"))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["id", "title", "description"])
+        self.assertEqual(len(lines), 2)
+
+
+class BidHistoryTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.alice = User.objects.create_user("alice", password="pw")
+        self.bob = User.objects.create_user("bob", password="pw")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+        start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        # two bids in one hour, one in the next
+        for minutes, user, amount in [(5, self.alice, "2"), (10, self.bob, "3"), (70, self.alice, "4")]:
+            with mock.patch("django.utils.timezone.now", return_value=start + timedelta(minutes=minutes)):
+                place_bid(self.listing, user, amount)
+        self.start = start
+
+    def buckets(self):
+        return list(PriceBucket.objects.filter(listing=self.listing).order_by("start").values_list(
+            "start", "open", "close", "bids"
+        ))
+
+    def test_aggregates_maintained_per_bid(self):
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.bid_count, self.listing.bidder_count), (3, 2))
+        self.assertEqual(self.listing.last_bid_at, self.start + timedelta(minutes=70))
+        self.assertEqual(self.buckets(), [
+            (self.start, Decimal("2.00"), Decimal("3.00"), 2),
+            (self.start + timedelta(hours=1), Decimal("4.00"), Decimal("4.00"), 1),
+        ])
+
+    def test_rebuild_matches_incremental(self):
+        expected = self.buckets()
+        Listing.objects.update(bidder_count=0, last_bid_at=None)
+        PriceBucket.objects.all().delete()
+        rebuild_bid_stats()
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.bidder_count, self.listing.last_bid_at), (2, self.start + timedelta(minutes=70)))
+        self.assertEqual(self.buckets(), expected)
+
+    def test_history_page_and_api(self):
+        response = self.client.get(reverse("bid_history", args=[self.listing.id]))
+        self.assertEqual([bid.amount for bid in response.context["bids"]], [Decimal("4.00"), Decimal("3.00"), Decimal("2.00")])
+        self.assertEqual(len(response.context["timeline"]), 2)
+
+        url = reverse("api_bids", args=[self.listing.id])
+        data = self.client.get(url, {"limit": 2, "fields": "amount,bidder"}).json()
+        self.assertEqual(data["results"], [{"amount": "4.00", "bidder": "alice"}, {"amount": "3.00", "bidder": "bob"}])
+        older = self.client.get(data["next"]).json()
+        self.assertEqual(older["results"], [{"amount": "2.00", "bidder": "alice"}])
+
+        since = (self.start + timedelta(minutes=30)).isoformat()
+        data = self.client.get(url, {"since": since, "fields": "amount"}).json()
+        self.assertEqual(data["results"], [{"amount": "4.00"}])
+        self.assertEqual(self.client.get(url, {"since": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"since": "2020-13-45T00:00"}).status_code, 400)
+
+        timeline = self.client.get(reverse("api_timeline", args=[self.listing.id])).json()["results"]
+        self.assertEqual([bucket["bids"] for bucket in timeline], [2, 1])
+
+
+# stand-in for the remote image hosts, read by fake_fetch
+IMAGE_STORE = {
+    "https://img.example/lamp.png": base64.b64decode(
+        "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+    ),
+    "https://img.example/page.html": b"<html><script>alert(1)</script></html>",
+}
+
+
+def fake_fetch(url):
+    try:
+        return IMAGE_STORE[url]
+    except KeyError:
+        raise images.ImageUnavailable("not found")
+
+
+class ImageProxyTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = override_settings(
+            AUCTIONS_IMAGE_CACHE_DIR=self.directory.name, AUCTIONS_IMAGE_FETCHER="auctions.tests.fake_fetch"
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        images._service = None
+        self.addCleanup(setattr, images, "_service", None)
+        caches[cards.CARD_CACHE].clear()
+        caches["pages"].clear()
+
+        seller = User.objects.create_user("seller", password="pw")
+        self.listing = Listing.objects.create(
+            title="lamp", current_price=1, user=seller, category=Category.for_name("lamps"),
+            image_url="https://img.example/lamp.png",
+        )
+
+    def url(self, size="card"):
+        return reverse("thumbnail", args=[self.listing.id, size, images.source_key(self.listing.image_url)])
+
+    def test_miss_redirects_then_serves_from_disk(self):
+        response = self.client.get(self.url())
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], self.listing.image_url)
+        images.get_thumbnails().schedule(self.listing.image_url, "card").result()
+
+        response = self.client.get(self.url())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("image/"))
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertTrue(b"".join(response.streaming_content))
+
+        response = self.client.get(self.url(), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_thumbnails_are_resized(self):
+        # Pillow is a requirement, without it this fails rather than skips
+        from PIL import Image
+
+        source = io.BytesIO()
+        Image.new("RGBA", (2000, 1000), "red").save(source, "PNG")
+        self.enterContext(mock.patch.dict(IMAGE_STORE, {"https://img.example/big.png": source.getvalue()}))
+        service = images.get_thumbnails()
+        for size, expected in [("card", (640, 320)), ("large", (1280, 640))]:
+            service.schedule("https://img.example/big.png", size).result()
+            path = service.lookup("https://img.example/big.png", size)
+            self.assertTrue(path.endswith(".jpg"))
+            with Image.open(path) as thumbnail:
+                self.assertEqual(thumbnail.size, expected)
+
+    def test_evicted_between_lookup_and_open_is_a_miss(self):
+        service = images.get_thumbnails()
+        missing = os.path.join(self.directory.name, "evicted.png")
+        with mock.patch.object(service, "lookup", return_value=missing), mock.patch.object(service, "schedule") as schedule:
+            response = self.client.get(self.url())
+        self.assertRedirects(response, self.listing.image_url, fetch_redirect_response=False)
+        schedule.assert_called_once_with(self.listing.image_url, "card")
+
+    def test_stale_and_unknown_urls(self):
+        stale = reverse("thumbnail", args=[self.listing.id, "card", "0" * 16])
+        self.assertRedirects(self.client.get(stale), self.url(), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(self.url("huge")).status_code, 404)
+
+    def test_non_images_are_not_cached(self):
+        Listing.objects.filter(id=self.listing.id).update(image_url="https://img.example/page.html")
+        service = images.get_thumbnails()
+        self.assertIsNone(service.schedule("https://img.example/page.html", "card").result())
+        self.assertIsNone(service.lookup("https://img.example/page.html", "card"))
+        # the failure is remembered instead of fetched again on every request
+        self.assertIsNone(service.schedule("https://img.example/page.html", "card"))
+
+    def test_failures_remembered_are_bounded(self):
+        service = images.get_thumbnails()
+        with mock.patch.object(images, "MAX_FAILURES", 2):
+            for n in range(3):
+                service.schedule(f"https://img.example/missing{n}.png", "card").result()
+        self.assertEqual(list(service._failed), [
+            ("https://img.example/missing1.png", "card"), ("https://img.example/missing2.png", "card"),
+        ])
+
+    def test_redirects_are_checked_like_the_source(self):
+        handler = images.PublicRedirectHandler()
+        request = urllib.request.Request("http://93.184.216.34/lamp.png")
+        for target in ["http://127.0.0.1/admin", "http://169.254.169.254/latest/meta-data", "file:///etc/passwd"]:
+            with self.assertRaises(images.ImageUnavailable):
+                handler.redirect_request(request, None, 302, "Found", {}, target)
+        followed = handler.redirect_request(request, None, 302, "Found", {}, "http://93.184.216.35/lamp.png")
+        self.assertEqual(followed.full_url, "http://93.184.216.35/lamp.png")
+
+    def test_cards_use_thumbnails(self):
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, self.url())
+
+    def test_disk_cache_evicts_least_recently_used(self):
+        cache = images.DiskImageCache(self.directory.name, max_bytes=350)
+        for n in range(3):
+            cache.put(f"https://img.example/{n}.png", "card", b"x" * 100, "png")
+            path = cache.get(f"https://img.example/{n}.png", "card")
+            os.utime(path, (time.time() - 100 + n, time.time() - 100 + n))
+        # reading 0 makes 1 the least recently used
+        cache.get("https://img.example/0.png", "card")
+        cache.put("https://img.example/3.png", "card", b"x" * 100, "png")
+
+        cached = [cache.get(f"https://img.example/{n}.png", "card") is not None for n in range(4)]
+        self.assertEqual(cached, [True, False, True, True])
+
+
+class NotificationTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", "seller@example.com", "pw")
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.carol = User.objects.create_user("carol", "carol@example.com", "pw")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+        Watchlist.objects.create(user=self.carol, listing=self.listing)
+
+    def inbox(self, user):
+        return list(Notification.objects.filter(user=user).values_list("kind", "count", "message"))
+
+    def test_bids_only_write_the_outbox(self):
+        place_bid(self.listing, self.alice, "2")
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_burst_is_coalesced(self):
+        for user, amount in [(self.alice, "2"), (self.bob, "3"), (self.alice, "4")]:
+            place_bid(self.listing, user, amount)
+        self.assertEqual(deliver_notifications(), 3)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+        # one notification each for the latest price, none for the bidder who's winning
+        self.assertEqual(self.inbox(self.bob), [("outbid", 1, "you've been outbid on lamp, it's now $4.00")])
+        self.assertEqual(self.inbox(self.carol), [("new_bid", 1, "new bid of $4.00 on lamp")])
+        self.assertEqual(self.inbox(self.alice), [])
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["bob@example.com", "carol@example.com"])
+
+        # still unread: updated in place, no second email
+        place_bid(self.listing, self.alice, "5")
+        deliver_notifications()
+        self.assertEqual(self.inbox(self.bob), [("outbid", 2, "you've been outbid on lamp, it's now $5.00")])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_close_notifies_watchers_and_bidders(self):
+        place_bid(self.listing, self.alice, "2")
+        place_bid(self.listing, self.bob, "3")
+        close_listing(self.listing)
+        deliver_notifications()
+        # the bids were dropped in favour of the close that came after them
+        for user in [self.alice, self.bob, self.carol]:
+            self.assertEqual(self.inbox(user), [("closed", 1, "lamp closed, bob won at $3.00")])
+
+    def test_fan_out_in_chunks(self):
+        watchers = [User.objects.create_user(f"watcher{n}") for n in range(5)]
+        Watchlist.objects.bulk_create([Watchlist(user=user, listing=self.listing) for user in watchers])
+        close_listing(self.listing)
+        with mock.patch.object(notifications, "RECIPIENT_CHUNK", 2):
+            deliver_notifications()
+        self.assertEqual(Notification.objects.filter(kind="closed").count(), 6)
+        # watchers without an email address only get the inbox entry
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_inbox_marks_shown_notifications_read(self):
+        place_bid(self.listing, self.alice, "2")
+        deliver_notifications()
+        self.client.force_login(self.carol)
+        response = self.client.get(reverse("inbox"))
+        self.assertContains(response, "new bid of $2.00 on lamp")
+        self.assertFalse(Notification.objects.filter(user=self.carol, read=False).exists())
+
+
+class BenchmarkHarnessTests(TransactionTestCase):
+    # the benchmark's client threads need committed data, so no wrapping transaction
+
+    def test_seed_and_run(self):
+        seeded = benchmarks.seed(users=10, listings=40, bids=300, comments=20, watchlists=30)
+        self.assertEqual(Bid.objects.count(), 300)
+        self.assertEqual(Listing.objects.filter(is_closed=True).count(), seeded["closed"])
+        # derived state matches what the write paths would have left
+        busiest = Listing.objects.order_by("-bid_count").first()
+        self.assertEqual(busiest.current_price, Bid.objects.filter(listing=busiest).order_by("-amount")[0].amount)
+        self.assertEqual(sum(Category.objects.values_list("listing_count", flat=True)), 40)
+
+        # one client thread, the in-memory test database locks whole tables between connections
+        report = benchmarks.run(requests=60, concurrency=1)
+        self.assertEqual(report["total"]["requests"], 60)
+        self.assertEqual(report["total"]["errors"], 0, report["exceptions"])
+        for row in report["scenarios"].values():
+            self.assertLessEqual(row["p50_ms"], row["p95_ms"])
+            self.assertLessEqual(row["p95_ms"], row["p99_ms"])
+            self.assertGreater(row["avg_queries"], 0)
+        self.assertEqual([row[0] for row in benchmarks.compare(report, report)], list(report["scenarios"]))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(
+            [benchmarks.percentile(values, p) for p in (50, 95, 99)], [50, 95, 99]
+        )
+        self.assertIsNone(benchmarks.percentile([], 50))
+
+
+class SessionCacheTests(TestCase):
+
+    def setUp(self):
+        caches["sessions"].clear()
+        self.user = User.objects.create_user("alice", password="pw")
+        self.client.login(username="alice", password="pw")
+        # the first request fills the user cache
+        self.client.get(reverse("index"))
+
+    def test_logged_in_page_skips_session_and_user_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("index"))
+        self.assertEqual(response.context["user"], self.user)
+
+    def test_user_changes_are_picked_up(self):
+        self.user.username = "alicia"
+        self.user.save()
+        self.assertContains(self.client.get(reverse("index")), "alicia")
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.user.set_password("new")
+        self.user.save()
+        self.assertFalse(self.client.get(reverse("index")).context["user"].is_authenticated)
+
+    def test_logout_forgets_the_user(self):
+        self.client.get(reverse("logout"))
+        self.assertIsNone(caches["sessions"].get(f"auctions:user:{self.user.id}"))
+        self.assertFalse(self.client.get(reverse("index")).context["user"].is_authenticated)
+
+    def cached_in_another_process(self, key):
+        # another server process, with its own copy of the settings pointed at the test's cache
+        script = (
+            "import django; django.setup(); from django.core.cache import caches; "
+            f"print(caches['sessions'].get({key!r}) is not None)"
+        )
+        env = {
+            **os.environ, "DJANGO_SETTINGS_MODULE": "commerce.settings",
+            "AUCTIONS_SESSION_CACHE_DIR": caches["sessions"]._dir,
+        }
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        return result.stdout.strip() == "True"
+
+    def test_other_processes_see_logouts_and_password_changes(self):
+        user_key = f"auctions:user:{self.user.id}"
+        session_key = self.client.session.cache_key
+        self.assertTrue(self.cached_in_another_process(user_key))
+        self.assertTrue(self.cached_in_another_process(session_key))
+
+        self.user.set_password("new")
+        self.user.save()
+        self.assertFalse(self.cached_in_another_process(user_key))
+        self.client.get(reverse("logout"))
+        self.assertFalse(self.cached_in_another_process(session_key))
+
+    def test_tests_dont_share_the_servers_cache(self):
+        self.assertFalse(caches["sessions"]._dir.startswith(settings.BASE_DIR))
+
+
+class CommentTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+
+    def test_load_more_pages(self):
+        users = [User.objects.create_user(f"user{n}") for n in range(25)]
+        for n, user in enumerate(users):
+            add_comment(self.listing, user, f"comment {n}")
+        response = self.client.get(reverse("listing", args=[self.listing.id]))
+        self.assertContains(response, "Load older comments")
+
+        older = self.client.get(f"{reverse('listing_comments', args=[self.listing.id])}?{response.context['next_comments']}")
+        self.assertEqual([c.text for c in older.context["comments"]], [f"comment {n}" for n in range(4, -1, -1)])
+        self.assertNotContains(older, "Load older comments")
+        self.assertNotContains(older, "<html")
+
+    def test_comment_flood_is_limited(self):
+        self.client.force_login(self.seller)
+        url = reverse("listing", args=[self.listing.id])
+        for n in range(5):
+            self.client.post(url, {"action": "comment", "comment": f"spam {n}"})
+        response = self.client.post(url, {"action": "comment", "comment": "spam 5"}, follow=True)
+        self.assertContains(response, "commenting too fast")
+        self.assertEqual(Comment.objects.count(), 5)
+
+        response = self.client.post(reverse("api_comments", args=[self.listing.id]), {"text": "more"})
+        self.assertEqual(response.status_code, 429)
+        with self.assertRaises(CommentRejected):
+            add_comment(self.listing, self.seller, "and more")
+
+    def test_token_bucket_refills(self):
+        bucket = TokenBucket("test", capacity=2, rate=1)
+        with mock.patch("auctions.ratelimit.time.time", return_value=1000.0):
+            self.assertEqual([bucket.allow("k") for _ in range(3)], [True, True, False])
+        with mock.patch("auctions.ratelimit.time.time", return_value=1001.5):
+            self.assertEqual([bucket.allow("k") for _ in range(2)], [True, False])
+
+
+STATIC_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    STATIC_ROOT=STATIC_ROOT,
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "auctions.staticfiles.CompressedManifestStaticFilesStorage"},
+    },
+)
+class StaticFilesTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command("collectstatic", interactive=False, verbosity=0)
+        cls.css = staticfiles_storage.stored_name("admin/css/base.css")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(STATIC_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_collected_with_hashed_names_and_variants(self):
+        self.assertRegex(self.css, r"^admin/css/base\.[0-9a-f]{12}\.css$")
+        path = os.path.join(STATIC_ROOT, self.css)
+        with open(path, "rb") as f, gzip.open(path + ".gz") as gz:
+            self.assertEqual(gz.read(), f.read())
+        # too small to be worth compressing
+        self.assertFalse(os.path.exists(os.path.join(STATIC_ROOT, staticfiles_storage.stored_name("auctions/styles.css") + ".gz")))
+
+    def test_pages_link_hashed_names(self):
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, staticfiles_storage.url("auctions/styles.css"))
+        self.assertNotContains(response, 'href="/static/auctions/styles.css"')
+        # the vendored bootstrap, not the CDN
+        self.assertContains(response, staticfiles_storage.url("vendor/bootstrap-4.4.1.min.css"))
+        self.assertNotContains(response, "integrity=")
+
+    def test_vendored_bootstrap_is_served_compressed_and_immutable(self):
+        name = staticfiles_storage.stored_name("vendor/bootstrap-4.4.1.min.css")
+        response = self.client.get(f"/static/{name}", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertIn(b".btn-primary", gzip.decompress(b"".join(response.streaming_content)))
+
+    def test_serves_gzip_when_accepted(self):
+        response = self.client.get(f"/static/{self.css}", HTTP_ACCEPT_ENCODING="gzip, deflate, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertTrue(response["Content-Type"].startswith("text/css"))
+        body = gzip.decompress(b"".join(response.streaming_content))
+        self.assertEqual(int(response["Content-Length"]), os.path.getsize(os.path.join(STATIC_ROOT, self.css) + ".gz"))
+        with open(os.path.join(STATIC_ROOT, self.css), "rb") as f:
+            self.assertEqual(body, f.read())
+
+    def test_serves_identity_and_revalidates(self):
+        response = self.client.get(f"/static/{self.css}")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(
+            int(response["Content-Length"]), os.path.getsize(os.path.join(STATIC_ROOT, self.css))
+        )
+        self.assertEqual(
+            self.client.get(f"/static/{self.css}", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304
+        )
+
+    def test_unhashed_names_get_a_short_max_age(self):
+        response = self.client.get("/static/admin/css/base.css")
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+
+    def test_unknown_files_fall_through(self):
+        self.assertEqual(self.client.get("/static/nope.css").status_code, 404)
+
+
+class ProxyBidTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller")
+        self.users = [User.objects.create_user(f"bidder{n}") for n in range(4)]
+        self.alice, self.bob, self.carol, _ = self.users
+        self.listing = self.new_listing()
+
+    def new_listing(self):
+        return add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+
+    def state(self):
+        listing = Listing.objects.get(id=self.listing.id)
+        return listing.highest_bidder, listing.current_price
+
+    def test_first_max_bid_opens_at_the_start_bid(self):
+        place_max_bid(self.listing, self.alice, "10.00")
+        self.assertEqual(self.state(), (self.alice, Decimal("1.00")))
+        self.assertEqual(list(Bid.objects.values_list("user__username", "amount")), [("bidder0", Decimal("1.00"))])
+
+    def test_leader_bids_one_increment_over_the_runner_up(self):
+        place_max_bid(self.listing, self.alice, "10.00")
+        place_max_bid(self.listing, self.bob, "5.00")
+        self.assertEqual(self.state(), (self.alice, Decimal("5.50")))
+        place_max_bid(self.listing, self.bob, "20.00")
+        self.assertEqual(self.state(), (self.bob, Decimal("10.50")))
+        # only the visible bids are written, not every increment in between
+        self.assertEqual(
+            list(Bid.objects.order_by("id").values_list("user__username", "amount")),
+            [("bidder0", Decimal("1.00")), ("bidder1", Decimal("5.00")), ("bidder0", Decimal("5.50")),
+             ("bidder0", Decimal("10.00")), ("bidder1", Decimal("10.50"))],
+        )
+        listing = Listing.objects.get(id=self.listing.id)
+        self.assertEqual((listing.bid_count, listing.bidder_count), (5, 2))
+        # one outbox event per resolution, for the final price
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by("id").values_list("actor__username", "price")),
+            [("bidder0", Decimal("1.00")), ("bidder0", Decimal("5.50")), ("bidder1", Decimal("10.50"))],
+        )
+
+    def test_equal_maximums_go_to_the_earlier_one(self):
+        place_max_bid(self.listing, self.alice, "10.00")
+        place_max_bid(self.listing, self.bob, "10.00")
+        self.assertEqual(self.state(), (self.alice, Decimal("10.00")))
+
+    def test_manual_bid_is_answered_by_a_higher_maximum(self):
+        place_max_bid(self.listing, self.alice, "10.00")
+        place_bid(self.listing, self.bob, "3.00")
+        self.assertEqual(self.listing.highest_bidder, self.alice)
+        self.assertEqual(self.state(), (self.alice, Decimal("3.25")))
+        place_bid(self.listing, self.bob, "12.00")
+        self.assertEqual(self.state(), (self.bob, Decimal("12.00")))
+
+    def test_plain_bid_equal_to_a_maximum_loses_the_tie(self):
+        place_max_bid(self.listing, self.alice, "10.00")
+        place_bid(self.listing, self.bob, "10.00")
+        self.assertEqual(self.state(), (self.alice, Decimal("10.00")))
+        with self.assertRaisesMessage(BidRejected, "higher than the highest"):
+            place_bid(self.listing, self.bob, "10.00")
+
+    def test_leader_raising_its_maximum_keeps_the_price(self):
+        place_max_bid(self.listing, self.alice, "10.00")
+        place_max_bid(self.listing, self.bob, "5.00")
+        place_max_bid(self.listing, self.alice, "50.00")
+        self.assertEqual(self.state(), (self.alice, Decimal("5.50")))
+        with self.assertRaisesMessage(BidRejected, "has to be higher"):
+            place_max_bid(self.listing, self.alice, "20.00")
+
+    def test_rejected_maximums(self):
+        place_max_bid(self.listing, self.alice, "10.00")
+        place_max_bid(self.listing, self.bob, "5.00")
+        for amount in ["", "abc", "-1", "5.99"]:
+            with self.assertRaises(BidRejected):
+                place_max_bid(self.listing, self.carol, amount)
+        close_listing(self.listing)
+        with self.assertRaisesMessage(BidRejected, "closed"):
+            place_max_bid(self.listing, self.carol, "100.00")
+
+    def test_resolving_reads_the_same_however_many_maximums(self):
+        def queries(proxies):
+            self.listing = self.new_listing()
+            ProxyBid.objects.bulk_create([
+                ProxyBid(listing=self.listing, user=User.objects.create_user(f"proxy{self.listing.id}-{n}"),
+                         max_amount=Decimal("1.00"))
+                for n in range(proxies)
+            ])
+            place_max_bid(self.listing, self.alice, "5.00")
+            with CaptureQueriesContext(connection) as captured:
+                place_max_bid(self.listing, self.bob, "9.00")
+            return len(captured)
+
+        self.assertEqual(queries(2), queries(50))
+
+    def expected(self, maximums):
+        # the whole auction worked out from the accepted maximums in the order they were set
+        ranked = sorted(range(len(maximums)), key=lambda n: (-maximums[n][1], n))
+        leader, top = maximums[ranked[0]]
+        if len(maximums) == 1:
+            return leader, self.listing.start_bid
+        second = maximums[ranked[1]][1]
+        return leader, min(top, second + bid_increment(second))
+
+    def test_property_maximums_resolve_like_one_sealed_auction(self):
+        rng = random.Random(0)
+        for run in range(40):
+            self.listing = self.new_listing()
+            accepted = []
+            for user in rng.sample(self.users, len(self.users)):
+                amount = Decimal(rng.randint(100, 3000)) / 100
+                try:
+                    place_max_bid(self.listing, user, amount)
+                except BidRejected:
+                    leader, price = self.state()
+                    self.assertLess(amount, price + bid_increment(price), f"run {run}")
+                    continue
+                accepted.append((user, amount))
+                self.assertEqual(self.state(), self.expected(accepted), f"run {run}: {accepted}")
+
+    def test_property_invariants_under_mixed_bids(self):
+        rng = random.Random(1)
+        for run in range(25):
+            self.listing = self.new_listing()
+            last_price = self.listing.start_bid
+            plain_bids = []
+            for _ in range(12):
+                user = rng.choice(self.users)
+                price = Listing.objects.get(id=self.listing.id).current_price
+                amount = price + Decimal(rng.randint(-100, 1500)) / 100
+                maximums = list(ProxyBid.objects.filter(listing=self.listing).values_list("max_amount", flat=True))
+                if maximums and rng.random() < 0.2:
+                    # a tie with a maximum already set
+                    amount = rng.choice(maximums)
+                try:
+                    if rng.random() < 0.6:
+                        place_max_bid(self.listing, user, amount)
+                    else:
+                        place_bid(self.listing, user, amount)
+                        plain_bids.append((user, amount))
+                except BidRejected:
+                    pass
+
+                listing = Listing.objects.get(id=self.listing.id)
+                leader, price = listing.highest_bidder, listing.current_price
+                bids = Bid.objects.filter(listing=listing)
+                proxies = dict(ProxyBid.objects.filter(listing=listing).values_list("user_id", "max_amount"))
+                message = f"run {run}: {leader} at {price}, maximums {proxies}"
+                # the price only goes up and it is the highest visible bid, placed by the leader
+                self.assertGreaterEqual(price, last_price, message)
+                last_price = price
+                if leader is None:
+                    self.assertFalse(bids.exists(), message)
+                    continue
+                top = bids.order_by("-amount", "-id").first()
+                self.assertEqual((top.user, top.amount), (leader, price), message)
+                self.assertEqual(listing.bid_count, bids.count(), message)
+                self.assertEqual(listing.bidder_count, bids.values("user").distinct().count(), message)
+                # the earliest of the highest maximums leads unless a plain bid went over it
+                top_proxy = ProxyBid.objects.filter(listing=listing).order_by("-max_amount", "created", "id").first()
+                if top_proxy is not None and top_proxy.max_amount >= price:
+                    self.assertEqual(leader.id, top_proxy.user_id, message)
+                # every maximum but the leader's has been bid up to its limit and lost
+                for user_id, maximum in proxies.items():
+                    if user_id != leader.id:
+                        self.assertLessEqual(maximum, price, message)
+                # and the leader pays no more than it took to beat everyone else
+                rivals = [
+                    amount for amount in bids.exclude(user=leader).values_list("amount", flat=True)
+                ] + [maximum for user_id, maximum in proxies.items() if user_id != leader.id]
+                own_bids = [amount for user, amount in plain_bids if user == leader]
+                ceiling = max([listing.start_bid, *own_bids, *(r + bid_increment(r) for r in rivals)])
+                self.assertLessEqual(price, ceiling, message)
+
+
+class WatchlistDashboardTests(TestCase):
+
+    def setUp(self):
+        caches["sessions"].clear()
+        self.seller = User.objects.create_user("seller")
+        self.rival = User.objects.create_user("rival")
+        self.user = User.objects.create_user("alice", password="pw")
+        self.client.login(username="alice", password="pw")
+        category = Category.for_name("lamps")
+        self.winning, self.outbid, self.watching, self.won = [
+            add_listing(Listing(
+                title=title, start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+                category=category
+            ))
+            for title in ["winning", "outbid", "watching", "won"]
+        ]
+        place_bid(self.winning, self.user, "2.00")
+        place_bid(self.outbid, self.user, "2.00")
+        place_bid(self.outbid, self.user, "3.00")
+        place_bid(self.outbid, self.rival, "4.00")
+        place_bid(self.won, self.user, "5.00")
+        close_listing(self.won)
+        for listing in [self.winning, self.outbid, self.watching, self.won]:
+            Watchlist.objects.create(user=self.user, listing=listing)
+        Watchlist.objects.create(user=self.rival, listing=self.watching)
+
+    def rows(self, response):
+        return {
+            listing.title: (listing.current_price, listing.my_bid, listing.winning)
+            for listing in response.context["listings"]
+        }
+
+    def test_shows_where_the_user_stands(self):
+        response = self.client.get(reverse("watchlist"))
+        self.assertEqual(self.rows(response), {
+            "winning": (Decimal("2.00"), Decimal("2.00"), True),
+            "outbid": (Decimal("4.00"), Decimal("3.00"), False),
+            "watching": (Decimal("1.00"), None, False),
+        })
+        self.assertContains(response, "outbid</span>")
+        self.assertIn("won", self.rows(self.client.get(reverse("watchlist"), {"all": "1"})))
+
+    def test_one_query_per_page(self):
+        self.client.get(reverse("watchlist"))
+        with self.assertNumQueries(1):
+            self.client.get(reverse("watchlist"))
+
+    def test_pages_newest_first(self):
+        response = self.client.get(reverse("watchlist"), {"all": "1"})
+        self.assertEqual(list(self.rows(response)), ["won", "watching", "outbid", "winning"])
+        with mock.patch("auctions.views.WATCHLIST_PAGE_SIZE", 2):
+            first = self.client.get(reverse("watchlist"), {"all": "1"})
+            second = self.client.get(f"{reverse('watchlist')}?{first.context['next_page']}")
+        self.assertEqual(list(self.rows(first)) + list(self.rows(second)), ["won", "watching", "outbid", "winning"])
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("watchlist")).status_code, 302)
+
+    def test_listing_is_watched_once(self):
+        url = reverse("listing", args=[self.winning.id])
+        self.client.post(url, {"action": "add_watchlist"})
+        self.assertEqual(Watchlist.objects.filter(user=self.user, listing=self.winning).count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Watchlist.objects.create(user=self.user, listing=self.winning)
+
+
+
+class SellerDashboardTests(TestCase):
+
+    def setUp(self):
+        caches["sessions"].clear()
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.lamps = Category.for_name("lamps")
+        self.chairs = Category.for_name("chairs")
+        self.listings = [self.create(f"lamp {n}", self.lamps) for n in range(4)] + [self.create("chair", self.chairs)]
+        self.client.login(username="seller", password="pw")
+
+    def create(self, title, category, seller=None):
+        return add_listing(Listing(
+            title=title, start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=seller or self.seller,
+            category=category
+        ))
+
+    def rollups(self):
+        return sorted(SellerRollup.objects.values_list(
+            "seller_id", "category_id", "listing_count", "active_count", "closed_count", "sold_count", "revenue", "bid_count",
+        ))
+
+    def test_rollups_missing_listings_stop_at_zero(self):
+        SellerRollup.objects.all().delete()
+        # as if the chair was listed before the rollups were backfilled
+        stool = add_listing(Listing(title="stool", current_price=1, user=self.seller, category=self.chairs))
+        close_listing(self.listings[4])
+        close_listing(stool)
+        rollup = SellerRollup.objects.get(seller=self.seller, category=self.chairs)
+        self.assertEqual((rollup.listing_count, rollup.active_count, rollup.closed_count), (1, 0, 2))
+
+    def test_rollups_match_a_rebuild(self):
+        lamp, sold, expired, unsold, chair = self.listings
+        place_bid(lamp, self.alice, "2")
+        place_max_bid(sold, self.alice, "10")
+        # alice's maximum answers at 4.25
+        place_bid(sold, self.bob, "4")
+        close_listing(sold)
+        place_bid(expired, self.bob, "3")
+        Listing.objects.filter(id=expired.id).update(ends_at=timezone.now() - timedelta(minutes=1))
+        close_expired()
+        close_listing(unsold)
+        recategorize(sold, self.chairs)
+        import_listings([(1, {"title": "stool", "category": "chairs", "start_bid": "1"})], self.bob)
+
+        incremental = self.rollups()
+        rebuild_seller_rollups(batch_size=1)
+        self.assertEqual(incremental, self.rollups())
+
+        totals, categories = services.seller_rollups(self.seller.id)
+        self.assertEqual(totals, {
+            "listing_count": 5, "active_count": 2, "closed_count": 3, "sold_count": 2,
+            "revenue": Decimal("7.25"), "bid_count": 5,
+        })
+        self.assertEqual([row["category__slug"] for row in categories], ["chairs", "lamps"])
+
+    def test_dashboard_page(self):
+        place_bid(self.listings[0], self.alice, "2")
+        close_listing(self.listings[0])
+        self.client.get(reverse("dashboard"))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("dashboard"))
+        self.assertEqual(response.context["totals"]["revenue"], Decimal("2.00"))
+        self.assertEqual([listing.id for listing in response.context["listings"]], [l.id for l in reversed(self.listings)])
+        self.assertContains(response, "alice")
+        self.assertContains(response, "sold</span>")
+
+    def test_only_the_sellers_listings(self):
+        self.create("other", self.lamps, seller=self.alice)
+        response = self.client.get(reverse("dashboard"))
+        self.assertEqual(response.context["totals"]["listing_count"], 5)
+        self.assertNotContains(response, "other")
+
+    def test_api(self):
+        place_bid(self.listings[4], self.alice, "3")
+        close_listing(self.listings[4])
+        response = self.client.get(reverse("api_dashboard"), {"fields": "title,highest_bidder", "limit": 2})
+        data = response.json()
+        self.assertEqual(data["totals"]["revenue"], "3.00")
+        self.assertEqual(data["categories"][0]["category"], "chairs")
+        self.assertEqual(data["results"], [{"title": "chair", "highest_bidder": "alice"}, {"title": "lamp 3", "highest_bidder": None}])
+        self.assertIsNotNone(data["next"])
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("api_dashboard")).status_code, 401)
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        caches["sessions"].clear()
+        caches["idempotency"].clear()
+        self.seller = User.objects.create_user("seller")
+        self.bidder = User.objects.create_user("bidder", password="pw")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+        self.url = reverse("listing", args=[self.listing.id])
+        self.client.login(username="bidder", password="pw")
+
+    def test_forms_carry_a_key(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'name="idempotency_key"', count=4)
+        self.assertContains(self.client.get(reverse("create_listing")), 'name="idempotency_key"', count=1)
+
+    def test_repeated_bid_is_placed_once(self):
+        data = {"action": "place_bid", "bid": "2", "idempotency_key": "k1"}
+        first = self.client.post(self.url, data)
+        with self.assertNumQueries(0):
+            second = self.client.post(self.url, data)
+        self.assertEqual(Bid.objects.count(), 1)
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        # the replay brings the original message back
+        messages = [str(m) for m in self.client.get(self.url).context["messages"]]
+        self.assertEqual(messages, ["Your bid has been placed successfully."] * 2)
+
+        # a new submission is a new bid, and without a key nothing changes from before
+        self.client.post(self.url, {**data, "idempotency_key": "k2"})
+        self.client.post(self.url, {"action": "place_bid", "bid": "2"})
+        self.assertEqual(Bid.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        data = {"action": "comment", "comment": "hello", "idempotency_key": "k1"}
+        self.client.post(self.url, data)
+        self.client.force_login(self.seller)
+        self.client.post(self.url, data)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_repeated_listing_is_created_once(self):
+        data = {"title": "chair", "category": "chairs", "starting_bid": "3", "idempotency_key": "k1"}
+        self.client.post(reverse("create_listing"), data)
+        self.client.post(reverse("create_listing"), data)
+        self.assertEqual(Listing.objects.filter(title="chair").count(), 1)
+        self.assertEqual(Category.objects.get(slug="chairs").listing_count, 1)
+
+    def test_api_replays_json(self):
+        url = reverse("api_bids", args=[self.listing.id])
+        first = self.client.post(url, {"amount": "2"}, HTTP_IDEMPOTENCY_KEY="k1")
+        second = self.client.post(url, {"amount": "2"}, HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual((second.status_code, second.json()), (201, first.json()))
+        self.assertEqual(Bid.objects.count(), 1)
+
+        # same key, different request
+        self.assertEqual(self.client.post(url, {"amount": "3"}, HTTP_IDEMPOTENCY_KEY="k1").status_code, 422)
+
+    def test_failures_can_be_retried(self):
+        with mock.patch("auctions.views.add_comment", side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                self.client.post(self.url, {"action": "comment", "comment": "hi", "idempotency_key": "k1"})
+        self.client.post(self.url, {"action": "comment", "comment": "hi", "idempotency_key": "k1"})
+        self.assertEqual(Comment.objects.count(), 1)
+
+
+class ConcurrentSubmitTests(TransactionTestCase):
+    # the duplicates come in from threads, which need committed data
+
+    def setUp(self):
+        caches["sessions"].clear()
+        caches["idempotency"].clear()
+        self.seller = User.objects.create_user("seller")
+        self.bidder = User.objects.create_user("bidder")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=Category.for_name("lamps")
+        ))
+
+    def submit_together(self, url, data, clients=5):
+        """POST the same data from several logged in clients (same user, like tabs or retries) at once."""
+        browsers = []
+        for _ in range(clients):
+            client = Client()
+            client.force_login(self.bidder)
+            browsers.append(client)
+        barrier = threading.Barrier(clients)
+        responses = [None] * clients
+
+        def submit(n):
+            try:
+                barrier.wait()
+                responses[n] = browsers[n].post(url, data)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=submit, args=(n,)) for n in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def slowly(self, target):
+        # the first request is still running when the duplicates arrive
+        original = target
+        def slow(*args, **kwargs):
+            time.sleep(0.2)
+            return original(*args, **kwargs)
+        return slow
+
+    def test_duplicate_bids_place_one(self):
+        url = reverse("listing", args=[self.listing.id])
+        with mock.patch("auctions.views.place_bid", self.slowly(place_bid)):
+            responses = self.submit_together(url, {"action": "place_bid", "bid": "2", "idempotency_key": "k1"})
+        self.assertEqual(Bid.objects.count(), 1)
+        self.assertEqual(Listing.objects.get(id=self.listing.id).bid_count, 1)
+        self.assertEqual({(r.status_code, r["Location"]) for r in responses}, {(302, url)})
+        self.assertEqual(sum(r.has_header("Idempotent-Replayed") for r in responses), 4)
+
+    def test_duplicate_listings_create_one(self):
+        with mock.patch("auctions.views.add_listing", self.slowly(add_listing)):
+            responses = self.submit_together(
+                reverse("create_listing"), {"title": "chair", "category": "chairs", "idempotency_key": "k1"}
+            )
+        self.assertEqual(Listing.objects.filter(title="chair").count(), 1)
+        self.assertEqual(Category.objects.get(slug="chairs").listing_count, 1)
+        self.assertEqual({r.status_code for r in responses}, {302})
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches["pages"].clear()
+        caches["sessions"].clear()
+        self.seller = User.objects.create_user("seller", password="pw")
+        self.lamps = Category.for_name("lamps")
+        self.chairs = Category.for_name("chairs")
+        self.listing = add_listing(Listing(
+            title="lamp", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller, category=self.lamps
+        ))
+        self.chair = add_listing(Listing(
+            title="chair", start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller, category=self.chairs
+        ))
+        self.urls = {
+            "listing": reverse("listing", args=[self.listing.id]),
+            "lamps": reverse("category", args=[self.lamps.slug]),
+            "chairs": reverse("category", args=[self.chairs.slug]),
+            "index": reverse("index"),
+            "categories": reverse("categories"),
+        }
+
+    def etags(self):
+        return {name: self.client.get(url)["ETag"] for name, url in self.urls.items()}
+
+    def changed(self, before):
+        after = self.etags()
+        return {name for name in before if before[name] != after[name]}
+
+    def test_repeat_visit_is_served_from_cache(self):
+        first = self.client.get(self.urls["listing"])
+        self.assertEqual(first["Cache-Control"], "public, no-cache")
+        self.assertIn("Cookie", first["Vary"])
+        with self.assertNumQueries(0):
+            second = self.client.get(self.urls["listing"])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_benchmarks_can_turn_it_off(self):
+        self.client.get(self.urls["listing"])
+        with benchmarks.uncached_pages():
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(self.urls["listing"])
+        self.assertContains(response, "lamp")
+        self.assertGreater(len(captured), 0)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.urls["listing"])
+        with self.assertNumQueries(0):
+            revalidated = self.client.get(self.urls["listing"], HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b"")
+        since = self.client.get(self.urls["listing"], HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(since.status_code, 304)
+        self.assertEqual(self.client.get(self.urls["listing"], HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_bid_purges_the_pages_showing_the_listing(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bid(self.listing, User.objects.create_user("bidder"), "2.00")
+        self.assertEqual(self.changed(before), {"listing", "lamps", "index"})
+        self.assertContains(self.client.get(self.urls["listing"]), "2.00")
+
+    def test_comment_purges_only_the_listing_page(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            add_comment(self.listing, self.seller, "works fine")
+        self.assertEqual(self.changed(before), {"listing"})
+        self.assertContains(self.client.get(self.urls["listing"]), "works fine")
+
+    def test_new_listing_purges_its_category_and_the_index(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            add_listing(Listing(title="stool", current_price=1, user=self.seller, category=self.chairs))
+        self.assertEqual(self.changed(before), {"chairs", "index", "categories"})
+        self.assertContains(self.client.get(self.urls["chairs"]), "stool")
+
+    def test_logged_in_and_flashed_pages_are_not_cached(self):
+        self.client.get(self.urls["listing"])
+        self.client.login(username="seller", password="pw")
+        response = self.client.get(self.urls["listing"])
+        self.assertNotIn("ETag", response)
+        self.assertIn("Cookie", response["Vary"])
+        self.assertContains(response, "Close Auction")
+
+        self.client.logout()
+        self.client.cookies["messages"] = "pending"
+        self.assertNotIn("ETag", self.client.get(self.urls["listing"]))
+
+
+class JumpHashTests(TestCase):
+
+    def test_spreads_keys_evenly(self):
+        counts = [0] * 4
+        for key in range(20000):
+            counts[sharding.jump_hash(key, 4)] += 1
+        for count in counts:
+            self.assertAlmostEqual(count / 20000, 0.25, delta=0.02)
+
+    def test_new_bucket_only_takes_keys(self):
+        moved = 0
+        for key in range(20000):
+            before, after = sharding.jump_hash(key, 4), sharding.jump_hash(key, 5)
+            if before != after:
+                self.assertEqual(after, 4)
+                moved += 1
+        self.assertAlmostEqual(moved / 20000, 1 / 5, delta=0.02)
+
+
+# the rest of the suite runs against a single database, these run with AUCTIONS_SHARDS=2 set:
+# AUCTIONS_SHARDS=2 python manage.py test auctions.tests.ShardingTests
+# TransactionTestCase, TestCase's foreign key check at the end of each test can't see across databases
+@skipUnless(settings.AUCTIONS_SHARDS, "AUCTIONS_SHARDS isn't set")
+class ShardingTests(TransactionTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", "seller@example.com", "pw")
+        self.bidder = User.objects.create_user("bidder", "bidder@example.com", "pw")
+        self.category = Category.for_name("lamps")
+        self.listings = [self.create(f"lamp {n}") for n in range(6)]
+
+    def create(self, title):
+        return add_listing(Listing(
+            title=title, start_bid=Decimal("1.00"), current_price=Decimal("1.00"), user=self.seller,
+            category=self.category
+        ))
+
+    def stored_on(self, model, **filters):
+        return [db for db in settings.AUCTIONS_SHARDS if model.objects.using(db).filter(**filters).exists()]
+
+    def test_listing_and_its_rows_share_a_shard(self):
+        ids = [listing.id for listing in self.listings]
+        self.assertEqual(ids, list(range(ids[0], ids[0] + 6)))
+        self.assertGreater(len({sharding.listing_db(listing) for listing in self.listings}), 1)
+        listing = self.listings[0]
+        place_bid(listing, self.bidder, "2")
+        add_comment(listing, self.bidder, "nice")
+        with sharding.on_shard(sharding.listing_db(listing)):
+            Watchlist.objects.create(user=self.bidder, listing=listing)
+        for model in [Listing, Bid, Comment, Watchlist, OutboxEvent]:
+            filters = {"id": listing.id} if model is Listing else {"listing_id": listing.id}
+            self.assertEqual(self.stored_on(model, **filters), [sharding.listing_db(listing)])
+        self.assertEqual(Category.objects.get(id=self.category.id).active_count, 6)
+
+    def test_pages_merge_every_shard(self):
+        self.listings += [self.create(f"lamp {n}") for n in range(6, 30)]
+        ids = [listing.id for listing in reversed(self.listings)]
+        first = self.client.get(reverse("index"))
+        second = self.client.get(f"{reverse('index')}?{first.context['next_page']}")
+        self.assertEqual([listing.id for listing in first.context["listings"]], ids[:24])
+        self.assertEqual([listing.id for listing in second.context["listings"]], ids[24:])
+        self.assertIsNone(second.context["next_page"])
+
+    def test_listing_page(self):
+        listing = self.listings[1]
+        self.client.force_login(self.bidder)
+        self.client.post(reverse("listing", args=[listing.id]), {"action": "place_bid", "bid": "3"})
+        self.client.post(reverse("listing", args=[listing.id]), {"action": "comment", "comment": "mine"})
+        response = self.client.get(reverse("listing", args=[listing.id]))
+        self.assertEqual(response.context["listing"].highest_bidder, self.bidder)
+        self.assertContains(response, "mine")
+        self.assertContains(self.client.get(reverse("bid_history", args=[listing.id])), "bidder")
+
+    def test_close_expired_and_notify_on_every_shard(self):
+        with sharding.on_shard(sharding.listing_db(self.listings[0])):
+            Watchlist.objects.create(user=self.bidder, listing=self.listings[0])
+        for db in settings.AUCTIONS_SHARDS:
+            Listing.objects.using(db).update(ends_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(close_expired(), 6)
+        self.assertEqual(sum(Closed.objects.using(db).count() for db in settings.AUCTIONS_SHARDS), 6)
+        self.assertEqual(Category.objects.get(id=self.category.id).active_count, 0)
+        self.assertEqual(deliver_notifications(), 6)
+        self.assertEqual(
+            list(Notification.objects.values_list("user__username", "listing_id")),
+            [("bidder", self.listings[0].id)],
+        )
+        self.assertEqual([m.to for m in mail.outbox], [["bidder@example.com"]])
+
+    def test_rebalance_moves_misplaced_listings(self):
+        listing = self.listings[2]
+        place_bid(listing, self.bidder, "2")
+        home = sharding.listing_db(listing)
+        other = next(db for db in settings.AUCTIONS_SHARDS if db != home)
+        # as if the listing was written before the last shard was added
+        call_command("rebalance_shards", "--from", home, stdout=io.StringIO())
+        with mock.patch.object(sharding, "shard_for", return_value=other):
+            call_command("rebalance_shards", "--from", home, stdout=io.StringIO())
+        self.assertEqual(self.stored_on(Listing, id=listing.id), [other])
+
+        call_command("rebalance_shards", stdout=io.StringIO())
+        self.assertEqual(self.stored_on(Listing, id=listing.id), [home])
+        self.assertEqual(self.stored_on(Bid, listing_id=listing.id), [home])
+        self.assertEqual(Bid.objects.using(home).get(listing_id=listing.id).amount, Decimal("2.00"))
+
+    def test_api(self):
+        listing = self.listings[3]
+        data = self.client.get(reverse("api_listings"), {"fields": "id", "limit": 4}).json()
+        data = self.client.get(data["next"]).json()
+        self.assertEqual([row["id"] for row in data["results"]], [self.listings[1].id, self.listings[0].id])
+        data = self.client.get(reverse("api_listing", args=[listing.id]), {"fields": "title,seller,category"}).json()
+        self.assertEqual(data, {"title": "lamp 3", "seller": "seller", "category": "lamps"})
+
+        self.client.force_login(self.bidder)
+        self.assertEqual(self.client.post(reverse("api_bids", args=[listing.id]), {"amount": "4"}).status_code, 201)
+        bids = self.client.get(reverse("api_bids", args=[listing.id])).json()["results"]
+        self.assertEqual([(bid["amount"], bid["bidder"]) for bid in bids], [("4.00", "bidder")])
+        timeline = self.client.get(reverse("api_timeline", args=[listing.id])).json()["results"]
+        self.assertEqual([(bucket["close"], bucket["bids"]) for bucket in timeline], [("4.00", 1)])
+        self.client.post(reverse("api_comments", args=[listing.id]), {"text": "nice"})
+        comments = self.client.get(reverse("api_comments", args=[listing.id])).json()["results"]
+        self.assertEqual([comment["text"] for comment in comments], ["nice"])
+        for other in self.listings[:2]:
+            self.client.put(reverse("api_watchlist_entry", args=[other.id]))
+        data = self.client.get(reverse("api_watchlist"), {"fields": "id"}).json()
+        self.assertEqual(data["results"], [{"id": self.listings[1].id}, {"id": self.listings[0].id}])
+
+        self.client.force_login(self.seller)
+        data = self.client.get(reverse("api_dashboard"), {"fields": "title,highest_bidder", "limit": 3}).json()
+        self.assertEqual(data["totals"]["listing_count"], 6)
+        self.assertEqual(data["results"][2], {"title": "lamp 3", "highest_bidder": "bidder"})
+
+    def test_bulk_import_and_export(self):
+        rows = [(n, {"title": f"desk {n}", "category": "desks", "start_bid": "2"}) for n in range(1, 7)]
+        report = import_listings(rows, self.seller, batch_size=4)
+        self.assertEqual(report.imported, 6)
+        desks = [listing.id for listing in sharding.fan_out(Listing.objects.filter(category=Category.for_name("desks")), 10)]
+        self.assertEqual(sorted(desks), list(range(self.listings[-1].id + 1, self.listings[-1].id + 7)))
+        self.assertGreater(len(self.stored_on(Listing, id__in=desks)), 1)
+        self.assertEqual(Category.objects.get(slug="desks").active_count, 6)
+        place_bid(self.listings[0], self.bidder, "2")
+
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse("export_listings"), {"format": "jsonl"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["id"] for row in rows], sorted(listing.id for listing in self.listings) + desks[::-1])
+        self.assertEqual({(row["user__username"], row["category__name"]) for row in rows}, {("seller", "lamps"), ("seller", "desks")})
+        self.assertEqual(rows[0]["highest_bidder__username"], "bidder")
+        response = self.client.get(reverse("export_bids"))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[1].split(",")[2:4], ["lamp 0", "bidder"])
+
+    def test_search(self):
+        desk = add_listing(Listing(title="oak desk", start_bid=1, current_price=1, user=self.seller, category=Category.for_name("desks")))
+        self.assertEqual({listing.id for listing in search_listings("lamp", page_size=24)[0]}, {listing.id for listing in self.listings})
+        first, has_next = search_listings("lamp", page_size=4)
+        second, _ = search_listings("lamp", page=2, page_size=4)
+        self.assertTrue(has_next)
+        self.assertEqual(len({listing.id for listing in first + second}), 6)
+        self.assertEqual(search_listings("oak")[0], [desk])
+        self.assertEqual(search_listings("desks")[0], [desk])
+        self.assertEqual(rebuild_index(), 7)
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        self.assertEqual(search_listings("oak")[0], [desk])
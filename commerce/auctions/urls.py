@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.index, name="index"),
@@ -8,8 +8,31 @@ urlpatterns = [
     path("logout", views.logout_view, name="logout"),
     path("register", views.register, name="register"),
     path("create_listing", views.create_listing, name="create_listing"),
+    path("import_listings", views.import_listings, name="import_listings"),
+    path("export/listings", views.export_listings, name="export_listings"),
+    path("export/bids", views.export_bids, name="export_bids"),
     path("watchlist", views.watchlist, name="watchlist"),
+    path("inbox", views.inbox, name="inbox"),
+    path("dashboard", views.dashboard, name="dashboard"),
     path("categories", views.categories, name="categories"),
-    path("category/<str:category>", views.category, name="category"),
-    path("listing/<int:id>", views.listing, name="listing")
+    path("category/<slug:slug>", views.category, name="category"),
+    path("listing/<int:id>", views.listing, name="listing"),
+    path("listing/<int:id>/bids", views.bid_history, name="bid_history"),
+    path("listing/<int:id>/comments", views.listing_comments, name="listing_comments"),
+    path("listing/<int:id>/events", views.listing_events, name="listing_events"),
+    path("image/<int:id>/<str:size>/<str:key>", views.thumbnail, name="thumbnail"),
+    path("search", views.search, name="search"),
+    path("stats/cards", views.card_cache_stats, name="card_cache_stats"),
+    path("stats/perf", views.perf_stats, name="perf_stats"),
+
+    # json api
+    path("api/v1/listings", api.listings, name="api_listings"),
+    path("api/v1/listings/<int:id>", api.listing, name="api_listing"),
+    path("api/v1/listings/<int:id>/bids", api.bids, name="api_bids"),
+    path("api/v1/listings/<int:id>/timeline", api.timeline, name="api_timeline"),
+    path("api/v1/listings/<int:id>/comments", api.comments, name="api_comments"),
+    path("api/v1/watchlist", api.watchlist, name="api_watchlist"),
+    path("api/v1/dashboard", api.dashboard, name="api_dashboard"),
+    path("api/v1/watchlist/<int:id>", api.watchlist_entry, name="api_watchlist_entry"),
+    path("api/v1/tokens", api.tokens, name="api_tokens")
 ]
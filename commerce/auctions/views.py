@@ -1,7 +1,10 @@
 from django.contrib.auth import authenticate, login, logout
 from django.db import IntegrityError
-from django.db.models import Max
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db.models import BooleanField, Case, Max, OuterRef, Subquery, Value, When
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.contrib import messages
@@ -12,37 +15,38 @@ from django.contrib.auth.decorators import login_required
 
 from django.shortcuts import get_object_or_404
 
+from . import bulk, cards, middleware
+from .events import event_stream, streams_events
+from .idempotency import idempotent
+from .images import CONTENT_TYPES, THUMBNAIL_SIZES, get_thumbnails, source_key
 from .models import *
+from .pagecache import CATEGORIES, INDEX, cache_anonymous, category_scope, listing_scope
+from .pagination import keyset_page, show_closed
+from .routers import use_replica
+from .search import SEARCH_MAX_PAGE, search_listings
+from .sharding import listing_db, listing_shard, with_users
+from .services import BidRejected, CommentRejected, ListingInvalid, add_comment, add_listing, category_directory, clean_listing, close_listing, place_bid, place_max_bid, seller_rollups
 
 
+@cache_anonymous(lambda request: [INDEX])
+@use_replica
 def index(request):
     listings = Listing.objects.all()
+    if not show_closed(request):
+        listings = listings.filter(is_closed=False)
+    listings, next_page = keyset_page(listings, request)
 
     return render(request, "auctions/index.html",{
-                  "listings": listings
+                  "listings": listings,
+                  "next_page": next_page
                   })
 
+@cache_anonymous(lambda request, id: [listing_scope(id)])
+@listing_shard
+@idempotent
 def listing(request, id):
-    listing = get_object_or_404(Listing, id=id)
-    # Initialize is_in_watchlist to False in case user is not logged in
-    is_in_watchlist = False
-    # Get the Bid object with the highest bid for the listing. -amount is sort by descending
-    highest_bid = Bid.objects.filter(listing=listing).order_by('-amount').first()
-
-    # If no bids exist, create a "default" Bid object
-    if highest_bid is None:
-        # Create a fake Bid object (this will not save to the database, just a temporary placeholder)
-        highest_bid = Bid(amount=listing.current_price, user=listing.user, listing=listing)
-
-    #check if listing is closed
-    closed = Closed.objects.filter(listing=listing).exists()
-
-    #get any comments
-    comments = Comment.objects.filter(listing=listing)
-
-    # Check if the user is authenticated before querying for the watchlist
-    if request.user.is_authenticated:
-        is_in_watchlist = Watchlist.objects.filter(listing=listing, user=request.user).exists()
+    # highest bidder and seller come along in the same query for the sold banner
+    listing = get_object_or_404(with_users(Listing.objects.all(), "user", "highest_bidder"), id=id)
 
     #if any button is pressed
     if request.method == "POST":
@@ -51,13 +55,12 @@ def listing(request, id):
         #if add watchlists form
         if action == "add_watchlist":
             if request.user.is_authenticated:
-                #check database for other watchlist entries
-                if Watchlist.objects.filter(user=request.user, listing=listing).exists():
-                    messages.error(request, "entry exists")
-                else:
-                    watchlist = Watchlist(user=request.user, listing=listing)
-                    watchlist.save()
+                #the unique (user, listing) constraint settles two saves racing each other
+                _, created = Watchlist.objects.get_or_create(user=request.user, listing=listing)
+                if created:
                     messages.success(request, "watchlist saved")
+                else:
+                    messages.error(request, "entry exists")
             else:
                 messages.error(request, "you aren't logged in")
 
@@ -67,62 +70,166 @@ def listing(request, id):
         #if bid placed
 
         elif action == "place_bid":
-            try:
-                bid = Decimal(request.POST["bid"])
-                # Retrieve the highest bid amount using aggregate(Max)
-                same_bid = Bid.objects.filter(listing=listing, user=request.user, amount=bid).exists()
-                #check if bid not empty
-                if bid <= 0:
-                    messages.error(request, "Enter a valid bid greater than zero.")
-                #check if bid higher than min bid set
-                elif bid < listing.start_bid:
-                    messages.error(request, "your bid isn't higher than the minimum bid")
-                #check if bid is higher than highest bid
-                elif highest_bid and bid <= highest_bid.amount:
-                    messages.error(request, "your bid must be higher than the highest bid")
-                #check if you are trying to enter the same bid as you already did
-                elif same_bid:
-                    messages.error(request, "you can't enter the same bid twice")
-                else:
-                    new_bid = Bid(amount=bid, listing=listing, user=request.user)
-                    new_bid.save()
-                    messages.success(request, "Your bid has been placed successfully.")
-
-                    #update listing with new price
-                    listing.current_price = bid
-                    listing.save()
+            if request.user.is_authenticated:
+                try:
+                    place_bid(listing, request.user, request.POST.get("bid", ""))
+                    if listing.highest_bidder == request.user:
+                        messages.success(request, "Your bid has been placed successfully.")
+                    else:
+                        messages.error(request, f"Someone's maximum bid was higher, you've been outbid at ${listing.current_price}.")
+                except BidRejected as e:
+                    messages.error(request, str(e))
+            else:
+                messages.error(request, "you aren't logged in")
 
-            except (InvalidOperation, ValueError):
-                messages.error(request, "invalid bid")
+        #if maximum bid set, the engine bids for the user from here
+        elif action == "place_max_bid":
+            if request.user.is_authenticated:
+                try:
+                    proxy = place_max_bid(listing, request.user, request.POST.get("max_bid", ""))
+                    if listing.highest_bidder == request.user:
+                        messages.success(request, f"You're the highest bidder, we'll bid for you up to ${proxy.max_amount}.")
+                    else:
+                        messages.error(request, f"Someone else's maximum is higher, you've been outbid at ${listing.current_price}.")
+                except BidRejected as e:
+                    messages.error(request, str(e))
+            else:
+                messages.error(request, "you aren't logged in")
 
         elif action == "close_auction":
             if request.user.is_authenticated and request.user == listing.user:
-                if Closed.objects.filter(listing=listing).exists():
-                    messages.error(request, "this is already closed")
+                if close_listing(listing):
+                    messages.success(request, f'sure we\'ll close it. {listing.winner} won')
                 else:
-                    messages.success(request, f'sure we\'ll close it. {highest_bid.user} won')
-                    Closed(listing=listing).save()
+                    messages.error(request, "this is already closed")
 
         elif action == "comment":
             comment = request.POST.get("comment")
-            if request.user.is_authenticated and comment != "":
-                Comment(text=comment, listing=listing, user= request.user).save()
-                messages.success(request, "comment added")
+            if request.user.is_authenticated and comment:
+                try:
+                    add_comment(listing, request.user, comment)
+                    messages.success(request, "comment added")
+                except CommentRejected as e:
+                    messages.error(request, str(e))
             else:
                 messages.error(request, "type something")
 
          # After handling POST, redirect to avoid resubmission on refresh
         return redirect('listing', id=id)
     
+    # Initialize is_in_watchlist to False in case user is not logged in
+    is_in_watchlist = False
+    # Check if the user is authenticated before querying for the watchlist
+    if request.user.is_authenticated:
+        is_in_watchlist = Watchlist.objects.filter(listing=listing, user=request.user).exists()
+
+    #newest page of comments with their authors in the same query, skipped entirely when there are none
+    comments, next_comments = [], None
+    if listing.comment_count:
+        comments, next_comments = comment_page(listing, request)
+
     #default rendering        
     return render(request, "auctions/listing.html",{
                   "listing": listing,
                   'is_in_watchlist': is_in_watchlist,
-                  'closed': closed,
-                  'highest_bid': highest_bid,
-                  'comments': comments
+                  'closed': listing.is_closed,
+                  'winner': listing.winner,
+                  'comments': comments,
+                  'next_comments': next_comments,
+                  'live_events': streams_events(request)
+                  })
+
+# comments shown at once, older ones are loaded on demand
+COMMENT_PAGE_SIZE = 20
+
+def comment_page(listing, request):
+    return keyset_page(with_users(Comment.objects.filter(listing=listing), "user"), request, COMMENT_PAGE_SIZE)
+
+@use_replica
+@listing_shard
+def listing_comments(request, id):
+    """The next page of a listing's comments as an html fragment, for the load more button."""
+    listing = get_object_or_404(Listing, id=id)
+    comments, next_comments = comment_page(listing, request)
+    return render(request, "auctions/comments.html", {
+                  "listing": listing,
+                  "comments": comments,
+                  "next_comments": next_comments
                   })
 
+# hourly buckets shown on the bid history page
+TIMELINE_BUCKETS = 48
+
+@use_replica
+@listing_shard
+def bid_history(request, id):
+    listing = get_object_or_404(Listing, id=id)
+    # bid ids are handed out in creation order, so newest first is a range scan on the listing's bids
+    bids, next_page = keyset_page(with_users(Bid.objects.filter(listing=listing), "user"), request)
+    # the counts come from the listing and the timeline from the buckets place_bid keeps,
+    # nothing here has to go over all the bids
+    timeline = list(PriceBucket.objects.filter(listing=listing).order_by("-start")[:TIMELINE_BUCKETS])
+    timeline.reverse()
+
+    return render(request, "auctions/bid_history.html", {
+                  "listing": listing,
+                  "bids": bids,
+                  "timeline": timeline,
+                  "next_page": next_page
+                  })
+
+async def listing_events(request, id):
+    """Server-sent events stream of bids, comments and closes on one listing."""
+    if not await Listing.objects.using(listing_db(id)).filter(id=id).aexists():
+        raise Http404("no such listing")
+    if not streams_events(request):
+        # 204 tells EventSource to stop reconnecting
+        return HttpResponse(status=204)
+
+    response = StreamingHttpResponse(event_stream(id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+# thumbnail urls change with the image, so browsers and CDNs can keep them forever
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@use_replica
+@listing_shard
+def thumbnail(request, id, size, key):
+    """Resized listing image from the disk cache, generated in the background on a miss."""
+    image_url = Listing.objects.filter(id=id).values_list("image_url", flat=True).first()
+    if not image_url or size not in THUMBNAIL_SIZES:
+        raise Http404("no such image")
+    if key != source_key(image_url):
+        # a page rendered before the image changed
+        return redirect("thumbnail", id=id, size=size, key=source_key(image_url))
+
+    etag = f'"{key}-{size}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        thumbnails = get_thumbnails()
+        path = thumbnails.lookup(image_url, size)
+        try:
+            image = open(path, "rb") if path else None
+        except FileNotFoundError:
+            # evicted by another thread since the lookup, a miss like any other
+            image = None
+        if image is None:
+            # not ready yet, the browser gets the original this once
+            thumbnails.schedule(image_url, size)
+            if not image_url.startswith(("http://", "https://")):
+                raise Http404("no such image")
+            response = HttpResponseRedirect(image_url)
+            response["Cache-Control"] = "no-cache"
+            return response
+        response = FileResponse(image, content_type=CONTENT_TYPES[path.rsplit(".", 1)[1]])
+        response["X-Content-Type-Options"] = "nosniff"
+    response["ETag"] = etag
+    response["Cache-Control"] = THUMBNAIL_CACHE_CONTROL
+    return response
+
 def login_view(request):
     if request.method == "POST":
 
@@ -175,63 +282,205 @@ def register(request):
         return render(request, "auctions/register.html")
 
 @login_required
+@idempotent
 def create_listing(request):
     if request.method == "POST":
-        title = request.POST["title"]
-        description = request.POST["description"]
-        #testing get since POST is a dictionary by default
-        start_bid = request.POST.get("starting_bid", "")
-        image_url = request.POST["image_url"]
-        category = request.POST["category"]
-
-        if title.strip() == "":
-           messages.error(request, "title cannot be blank")
-           return redirect('create_listing')
-        elif category.strip() == "":
-           messages.error(request, "category cannot be blank")
-           return redirect('create_listing')
-        
-        if start_bid.strip() == "":
-            start_bid = 0.01
-        else:
-            try:
-                start_bid = Decimal(start_bid)
-            except ValueError:
-                messages.error(request, "an issue with the starting bid format")
-                return redirect('create_listing')
-            
+        try:
+            fields = clean_listing(
+                request.POST.get("title"),
+                request.POST.get("description"),
+                request.POST.get("category"),
+                #testing get since POST is a dictionary by default
+                request.POST.get("starting_bid", ""),
+                request.POST.get("image_url"),
+                request.POST.get("duration_days", ""),
+            )
+        except ListingInvalid as e:
+            messages.error(request, str(e))
+            return redirect('create_listing')
+
         #pass user.id from request
-        listing = Listing(user=request.user, title=title, description=description, start_bid=start_bid, current_price=start_bid, image_url=image_url, category=category)
-        listing.save()
+        category = Category.for_name(fields.pop("category"))
+        listing = Listing(user=request.user, category=category, **fields)
+        add_listing(listing)
         return redirect('index')
     
     else:
         #return default page if not post form
         return render(request, "auctions/create_listing.html")
 
-def watchlist(request):
-    # Get all listing IDs associated with the user's watchlist
-    listing_ids = Watchlist.objects.filter(user=request.user).values_list('listing', flat=True)
+@login_required
+def import_listings(request):
+    # bulk version of create_listing, a CSV or JSONL file of listings
+    if request.method != "POST" or "file" not in request.FILES:
+        messages.error(request, "choose a CSV or JSONL file to import")
+        return redirect('create_listing')
+
+    upload = request.FILES["file"]
+    fmt = "jsonl" if upload.name.lower().endswith((".jsonl", ".json")) else "csv"
+    report = bulk.import_listings(bulk.read_rows(upload.file, fmt), request.user)
+
+    messages.success(request, f"imported {report.imported} of {report.rows} listings")
+    for line, message in report.errors[:10]:
+        messages.error(request, f"line {line}: {message}")
+    if report.error_count > 10:
+        messages.error(request, f"...and {report.error_count - 10} more errors")
+    return redirect('create_listing')
+
+def export_rows_response(rows, filename):
+    response = StreamingHttpResponse(rows, content_type="text/plain; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
 
-    # Get all Listings that match these IDs
-    listings = Listing.objects.filter(id__in=listing_ids)
+@login_required
+def export_listings(request):
+    # streamed straight from a database cursor, never built up in memory
+    fmt = "jsonl" if request.GET.get("format") == "jsonl" else "csv"
+    rows = bulk.export_rows(bulk.listings_for_export(request.user), bulk.LISTING_EXPORT_FIELDS, fmt)
+    return export_rows_response(rows, f"listings.{fmt}")
+
+@login_required
+def export_bids(request):
+    fmt = "jsonl" if request.GET.get("format") == "jsonl" else "csv"
+    rows = bulk.export_rows(bulk.bids_for_export(request.user), bulk.BID_EXPORT_FIELDS, fmt)
+    return export_rows_response(rows, f"bids.{fmt}")
+
+# rows per page on the watchlist dashboard
+WATCHLIST_PAGE_SIZE = 50
+
+@login_required
+@use_replica
+def watchlist(request):
+    # every watched listing with where the user stands on it, in one query. pages walk the unique
+    # (user, listing) watchlist index in order (no sort) and the user's top bid comes off the
+    # (listing, user, -amount) bid index, so a page costs the same with 20 or 20000 watched
+    top_bid = Bid.objects.filter(listing=OuterRef("pk"), user=request.user).order_by("-amount").values("amount")[:1]
+    listings = Listing.objects.filter(watchlist__user=request.user).annotate(
+        my_bid=Subquery(top_bid),
+        winning=Case(When(highest_bidder=request.user, then=Value(True)), default=Value(False), output_field=BooleanField()),
+    )
+    if not show_closed(request):
+        listings = listings.filter(is_closed=False)
+    listings, next_page = keyset_page(listings, request, WATCHLIST_PAGE_SIZE, order="-watchlist__listing_id")
 
     return render(request, "auctions/watchlist.html",{
-                  "listings": listings
+                  "listings": listings,
+                  "next_page": next_page
+                  })
+
+# listings per page on the seller dashboard
+DASHBOARD_PAGE_SIZE = 50
+
+@login_required
+def dashboard(request):
+    # totals and the per category breakdown come off the seller's rollups, a few rows however much
+    # they've sold. listings carry their winning bid, so the table doesn't query bids either
+    totals, categories = seller_rollups(request.user.id)
+    listings, next_page = keyset_page(
+        with_users(Listing.objects.filter(user=request.user), "highest_bidder"), request, DASHBOARD_PAGE_SIZE
+    )
+
+    return render(request, "auctions/dashboard.html",{
+                  "totals": totals,
+                  "categories": categories,
+                  "listings": listings,
+                  "next_page": next_page
+                  })
+
+@login_required
+def inbox(request):
+    # outbid and closed notifications written by the send_notifications worker
+    notifications, next_page = keyset_page(
+        Notification.objects.filter(user=request.user), request
+    )
+    # what's shown counts as read, the next notification for the same listing starts a new row
+    unread = [notification.id for notification in notifications if not notification.read]
+    if unread:
+        Notification.objects.filter(id__in=unread).update(read=True)
+
+    return render(request, "auctions/inbox.html",{
+                  "notifications": notifications,
+                  "next_page": next_page
                   })
 
+@cache_anonymous(lambda request: [CATEGORIES])
+@use_replica
 def categories(request):
-    # Get all listing IDs associated with the user's watchlist
-    categories = Listing.objects.values('category').distinct()
+    # Category names and counts, served from cache between listing writes
+    categories = category_directory()
     
     return render(request, "auctions/categories.html",{
                   "categories": categories
                   })
 
-def category(request, category):
-    # Get all listing IDs associated with the user's watchlist
+def category_scopes(request, slug):
+    # the directory is cached, unknown slugs (a 404, or no listings yet) are rendered as usual
+    ids = {row["slug"]: row["id"] for row in category_directory()}
+    return [category_scope(ids[slug])] if slug in ids else None
+
+@cache_anonymous(category_scopes)
+@use_replica
+def category(request, slug):
+    category = get_object_or_404(Category, slug=slug)
     listings = Listing.objects.filter(category=category)
+    if not show_closed(request):
+        listings = listings.filter(is_closed=False)
+    listings, next_page = keyset_page(listings, request)
 
     return render(request, "auctions/category.html",{
-                  "listings": listings
-                  })
\ No newline at end of file
+                  "category": category,
+                  "listings": listings,
+                  "next_page": next_page
+                  })
+
+def search(request):
+    query = request.GET.get("q", "")
+    # unknown category slugs and bad prices are ignored rather than erroring
+    category = Category.objects.filter(slug=request.GET.get("category", "")).first()
+    prices = {}
+    for field in ("min_price", "max_price"):
+        try:
+            price = Decimal(request.GET.get(field, ""))
+        except InvalidOperation:
+            price = None
+        prices[field] = price if price is not None and price.is_finite() else None
+    try:
+        page = min(max(int(request.GET.get("page", 1)), 1), SEARCH_MAX_PAGE)
+    except ValueError:
+        page = 1
+
+    listings, has_next = search_listings(
+        query, category=category, include_closed=show_closed(request), page=page, **prices
+    )
+
+    next_page = None
+    if has_next and page < SEARCH_MAX_PAGE:
+        params = request.GET.copy()
+        params["page"] = page + 1
+        next_page = params.urlencode()
+
+    return render(request, "auctions/search.html",{
+                  "query": query,
+                  "category": category,
+                  "categories": category_directory(),
+                  "listings": listings,
+                  "next_page": next_page
+                  })
+
+
+@staff_member_required
+def card_cache_stats(request):
+    # listing card cache hit ratio for this process, ?reset=1 starts counting again
+    data = cards.stats.as_dict()
+    if request.GET.get("reset") == "1":
+        cards.stats.reset()
+    return JsonResponse(data)
+
+
+@staff_member_required
+def perf_stats(request):
+    # per-view performance of this process, needs AUCTIONS_PERF_ENABLED. ?reset=1 clears it
+    data = middleware.registry.report()
+    if request.GET.get("reset") == "1":
+        middleware.registry.reset()
+    return JsonResponse(data)
@@ -41,7 +41,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first so its latency covers the rest of the middleware too
+    'auctions.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # collected static files answered before sessions and auth run
+    'auctions.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -50,6 +54,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-view query, db, template and latency stats, see /stats/perf and the
+# perf_report command. Removed from the middleware chain at startup when off.
+AUCTIONS_PERF_ENABLED = False
+
 ROOT_URLCONF = 'commerce.urls'
 
 TEMPLATES = [
@@ -74,15 +82,146 @@ WSGI_APPLICATION = 'commerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# Pragmas run on every new SQLite connection. WAL lets readers carry on while
+# a bid is being written, synchronous=NORMAL is safe under WAL and skips an
+# fsync per commit, cache_size is in KiB when negative.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+SQLITE_OPTIONS = {
+    # seconds a connection waits for the write lock before "database is locked"
+    'timeout': 20,
+    # take the write lock when the transaction starts instead of failing
+    # halfway through when a read lock can't be upgraded
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': SQLITE_OPTIONS,
+        # keep connections open between requests instead of reopening per request
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Optional read replica (e.g. a copy kept up to date by litestream) for the
+# read-only grid views, set AUCTIONS_DB_REPLICA to its path to turn it on.
+if os.environ.get('AUCTIONS_DB_REPLICA'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['AUCTIONS_DB_REPLICA'],
+        'OPTIONS': {**SQLITE_OPTIONS, 'transaction_mode': None},
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Optional sharding by listing id, AUCTIONS_SHARDS=4 keeps listings and their
+# bids, comments, watchlists, closes and outbox rows in shard_0.sqlite3 to
+# shard_3.sqlite3, users, categories, notifications and sessions stay in
+# db.sqlite3. Move existing data with the rebalance_shards command.
+AUCTIONS_SHARDS = [f'shard_{n}' for n in range(int(os.environ.get('AUCTIONS_SHARDS') or 0))]
+
+if AUCTIONS_SHARDS:
+    # rows on a shard point at users and categories on default, foreign keys
+    # between databases can't be enforced by sqlite
+    SHARD_OPTIONS = {
+        **SQLITE_OPTIONS,
+        'init_command': ';'.join(
+            f'PRAGMA {name}={value}' for name, value in {**SQLITE_PRAGMAS, 'foreign_keys': 'OFF'}.items()
+        ),
+    }
+    DATABASES['default']['OPTIONS'] = SHARD_OPTIONS
+    for alias in AUCTIONS_SHARDS:
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, f'{alias}.sqlite3'),
+            'OPTIONS': SHARD_OPTIONS,
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+        }
+
+DATABASE_ROUTERS = ['auctions.sharding.ShardRouter', 'auctions.routers.ReadReplicaRouter']
+
 AUTH_USER_MODEL = 'auctions.User'
 
+# tests get their own directory for the file based caches
+TEST_RUNNER = 'auctions.testrunner.TestRunner'
+
+# request.user is loaded from the cache instead of an auth_user query per request
+AUTHENTICATION_BACKENDS = ['auctions.backends.CachedModelBackend']
+
+# Sessions are read from the cache and written through to the database by
+# default. AUCTIONS_SESSION_ENGINE=signed_cookies keeps them in the cookie
+# instead, no session storage at all but they can't be revoked server side.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get('AUCTIONS_SESSION_ENGINE', 'cached_db')]
+SESSION_CACHE_ALIAS = 'sessions'
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# "cards" holds rendered listing cards. For a cache shared between processes
+# point it at django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.memcached.PyMemcacheCache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'cards': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'listing-cards',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # sessions and the logged in users of auctions.backends. A logout, password
+    # change or deactivation has to reach every server process, so this is a
+    # cache they share: files on local disk for processes on one host, point it
+    # at redis or memcached when there are several
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('AUCTIONS_SESSION_CACHE_DIR', os.path.join(BASE_DIR, 'session_cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # idempotency keys of recent POSTs, see auctions.idempotency. With more than
+    # one server process this has to be a cache they share (redis, memcached or
+    # django's database cache) for duplicates to find each other
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'idempotency',
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+    # pages rendered for anonymous visitors and when what they show last changed,
+    # see auctions.pagecache. Purges only reach other processes through a shared cache
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -120,3 +259,57 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# collectstatic copies the static files here under content hashed names with
+# .gz (and .br when the brotli package is installed) variants next to them.
+# Without DEBUG auctions.middleware.StaticFilesMiddleware serves them with
+# far-future immutable caching, so a repeat page load only fetches the HTML.
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'auctions.staticfiles.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
+
+# Live listing updates
+# Backend that fans bid/close/comment events out to listing pages over
+# server-sent events. The in-process broker only reaches viewers connected to
+# the same process, serve the site with an ASGI server (commerce.asgi) for it.
+# Under WSGI (runserver, commerce.wsgi) listing pages go without live updates.
+
+AUCTIONS_EVENT_BROKER = 'auctions.events.InProcessBroker'
+
+# Max bids are bid up one increment over what they have to beat, capped at the
+# maximum. (price from, increment) pairs, lowest price first.
+AUCTIONS_BID_INCREMENTS = [
+    ('0.00', '0.05'),
+    ('1.00', '0.25'),
+    ('5.00', '0.50'),
+    ('25.00', '1.00'),
+    ('100.00', '2.50'),
+    ('250.00', '5.00'),
+    ('500.00', '10.00'),
+    ('1000.00', '25.00'),
+    ('2500.00', '50.00'),
+    ('5000.00', '100.00'),
+]
+
+# Listing images are proxied through /image/..., resized with Pillow in a
+# pool of worker threads and kept in an on-disk LRU cache.
+AUCTIONS_IMAGE_CACHE_DIR = os.path.join(BASE_DIR, 'image_cache')
+AUCTIONS_IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+AUCTIONS_IMAGE_WORKERS = 4
+AUCTIONS_IMAGE_FETCHER = 'auctions.images.fetch_url'
+
+# Outbid and auction closed emails sent by the send_notifications worker,
+# printed to the console until a real mail backend is configured.
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'auctions@localhost'